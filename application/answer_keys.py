@@ -0,0 +1,155 @@
+from redis.exceptions import RedisError
+from flask import current_app
+from sqlalchemy import event, inspect, update
+from .models import db, Quiz, Question
+from .instance import get_redis
+import logging
+import json
+
+logger = logging.getLogger(__name__)
+
+# ------------- Answer Key Storage -------------
+# Each quiz carries an answer_key_version column, bumped by the Question mapper
+# events below in the same transaction as the edit. The compiled key is stored
+# in Redis and process memory under that version, so a committed edit retires
+# every copy at once and a Redis failure can never leave a stale key in use.
+KEY = 'answer_key:{quiz_id}:rev{version}'
+
+_local_keys = {}  # quiz_id -> compiled answer key held in process memory
+
+
+def _bump_version(connection, quiz_id):
+    if quiz_id is None:
+        return
+    quizzes = Quiz.__table__
+    connection.execute(
+        update(quizzes).where(quizzes.c.id == quiz_id)
+        .values(answer_key_version=quizzes.c.answer_key_version + 1)
+    )
+
+
+@event.listens_for(Question, 'after_insert')
+@event.listens_for(Question, 'after_delete')
+def _question_added_or_removed(mapper, connection, target):
+    _bump_version(connection, target.quiz_id)
+
+
+@event.listens_for(Question, 'after_update')
+def _question_changed(mapper, connection, target):
+    for old_quiz_id in inspect(target).attrs.quiz_id.history.deleted:
+        _bump_version(connection, old_quiz_id)  # Moved to another quiz
+    _bump_version(connection, target.quiz_id)
+
+
+def compile_answer_key(quiz_id, version=0):
+    """Build the answer key for a quiz from its questions"""
+    questions = Question.query.filter_by(quiz_id=quiz_id).order_by(Question.id).all()
+    return {
+        'quiz_id': quiz_id,
+        'version': version,
+        'total_marks': sum(q.marks for q in questions),
+        'questions': [{
+            'id': q.id,
+            'text': q.question_text,
+            'options': q.options,
+            'correct': q.correct_answer,
+            'marks': q.marks
+        } for q in questions]
+    }
+
+
+def get_answer_key(quiz_id, version=None):
+    """Return the current answer key from process memory, Redis or the database
+
+    version is the quiz's answer_key_version, read from the database when not given.
+    """
+    if version is None:
+        version = db.session.query(Quiz.answer_key_version).filter(Quiz.id == quiz_id).scalar() or 0
+
+    answer_key = _local_keys.get(quiz_id)
+    if answer_key and answer_key['version'] == version:
+        return answer_key
+
+    redis_key = KEY.format(quiz_id=quiz_id, version=version)
+    try:
+        raw = get_redis().get(redis_key)
+    except RedisError as e:
+        logger.warning(f"Redis unavailable, compiling answer key for quiz {quiz_id}: {str(e)}")
+        raw = None
+
+    if raw:
+        answer_key = json.loads(raw)
+    else:
+        answer_key = compile_answer_key(quiz_id, version)
+        try:
+            get_redis().set(redis_key, json.dumps(answer_key),
+                            ex=current_app.config.get('ANSWER_KEY_TIMEOUT', 3600))
+        except RedisError as e:
+            logger.warning(f"Failed to store answer key for quiz {quiz_id}: {str(e)}")
+
+    _local_keys[quiz_id] = answer_key
+    return answer_key
+
+
+def invalidate_answer_keys(*quiz_ids):
+    """Drop this process's copies of the quizzes' keys, e.g. once the quizzes are deleted
+
+    Edits need no call: they bump the version, which retires every copy.
+    """
+    for quiz_id in quiz_ids:
+        _local_keys.pop(quiz_id, None)
+
+
+# ------------- Grading -------------
+def chosen_option(question, answers):
+    """Index of the option submitted for a compiled question, None if missing or invalid"""
+    submitted_answer = answers.get(str(question['id']))
+    try:
+        submitted_answer = int(submitted_answer) if submitted_answer is not None else None
+    except (ValueError, TypeError):
+        return None
+    if submitted_answer is not None and not 0 <= submitted_answer < len(question['options']):
+        return None
+    return submitted_answer
+
+
+def grade_answers(answer_key, answers):
+    """Grade submitted answers against a compiled key, returns (scored_marks, response_sheet)"""
+    scored_marks = 0
+    response_sheet = []
+
+    for question in answer_key['questions']:
+        options = question['options']
+        submitted_answer = chosen_option(question, answers)
+        is_correct = submitted_answer is not None and submitted_answer == question['correct']
+        if is_correct:
+            scored_marks += question['marks']
+
+        response_sheet.append({
+            'question_id': question['id'],
+            'text': question['text'],
+            'correct_answer': options[question['correct']],
+            'user_answer': options[submitted_answer] if submitted_answer is not None else None,
+            'is_correct': is_correct,
+            'marks': question['marks'],
+            'scored': question['marks'] if is_correct else 0
+        })
+
+    return scored_marks, response_sheet
+
+
+def answer_facts(answer_key, attempt_id, answers):
+    """attempt_answers rows for a graded submission"""
+    facts = []
+    for question in answer_key['questions']:
+        choice = chosen_option(question, answers)
+        is_correct = choice is not None and choice == question['correct']
+        facts.append({
+            'attempt_id': attempt_id,
+            'question_id': question['id'],
+            'quiz_id': answer_key['quiz_id'],
+            'chosen_option': choice,
+            'is_correct': is_correct,
+            'marks': question['marks'] if is_correct else 0
+        })
+    return facts
@@ -0,0 +1,279 @@
+from flask import current_app
+from redis.exceptions import RedisError
+from datetime import datetime
+from uuid import uuid4
+from .models import db
+from .instance import get_redis, invalidate_tags
+from .answer_keys import get_answer_key, grade_answers, answer_facts
+from .ingest import store_submissions
+from .leaderboard import safe_record_score
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# ------------- Attempt Sessions -------------
+# A session is one Redis hash per student and quiz: the start time, deadline and
+# identity fields, plus one 'q:<question_id>' field per autosaved answer. DEADLINES
+# indexes sessions by deadline so the sweeper finds the abandoned ones without a scan.
+SESSION = 'attempt_session:{user_id}:{quiz_id}'
+DEADLINES = 'attempt_sessions:deadlines'  # Sorted set of '<user_id>:<quiz_id>' by deadline
+SWEEPING = 'attempt_sessions:sweeping'    # Sorted set of sessions taken by the sweeper, by lease
+DEAD = 'attempt_sessions:dead'            # Graded submissions of expired sessions that failed to store
+ANSWER_PREFIX = 'q:'
+MAX_ANSWERS = 500  # Answer fields accepted per autosave
+
+# Create the session unless one exists, returns the session hash either way
+_START_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('HSET', KEYS[1], unpack(ARGV, 4))
+    redis.call('EXPIREAT', KEYS[1], ARGV[2])
+    redis.call('ZADD', KEYS[2], ARGV[1], ARGV[3])
+end
+return redis.call('HGETALL', KEYS[1])
+"""
+
+# Save answers while the session is open: -1 no session, 0 past the deadline, else 1.
+# ARGV[1] is the cut-off time, then field/value pairs; an empty value clears an answer.
+_AUTOSAVE_SCRIPT = """
+local deadline = redis.call('HGET', KEYS[1], 'deadline')
+if not deadline then return -1 end
+if tonumber(deadline) < tonumber(ARGV[1]) then return 0 end
+for i = 2, #ARGV, 2 do
+    if ARGV[i + 1] == '' then
+        redis.call('HDEL', KEYS[1], ARGV[i])
+    else
+        redis.call('HSET', KEYS[1], ARGV[i], ARGV[i + 1])
+    end
+end
+return 1
+"""
+
+# Lease sessions whose deadline passed: push their score LEASE seconds ahead and
+# return them, so a sweeper that dies mid-batch has them retried after the lease.
+_CLAIM_SCRIPT = """
+local members = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, member in ipairs(members) do
+    redis.call('ZADD', KEYS[1], ARGV[3], member)
+end
+return members
+"""
+
+# Take a session over: delete it and return it as a JSON array of field/value pairs,
+# so a submit and the sweeper never both grade it. nil when there is no session, 0
+# when its deadline is before ARGV[2]. The sweeper passes KEYS[3] to keep the taken
+# session there, scored by its lease ARGV[3], until the attempt is stored.
+_TAKE_SCRIPT = """
+local deadline = redis.call('HGET', KEYS[1], 'deadline')
+if not deadline then return false end
+if tonumber(deadline) < tonumber(ARGV[2]) then return 0 end
+local session = cjson.encode(redis.call('HGETALL', KEYS[1]))
+redis.call('DEL', KEYS[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+if KEYS[3] then
+    redis.call('ZADD', KEYS[3], ARGV[3], session)
+end
+return session
+"""
+
+
+class AttemptExpired(Exception):
+    """The session's deadline (plus grace) passed, the sweeper submits its saved answers"""
+
+
+def _decode(raw):
+    """Session hash as {'started_at', 'deadline', ..., 'answers': {question_id: option}}"""
+    session = {'answers': {}}
+    for field, value in raw.items():
+        if field.startswith(ANSWER_PREFIX):
+            session['answers'][field[len(ANSWER_PREFIX):]] = int(value)
+        else:
+            session[field] = value
+    for field in ('started_at', 'deadline'):
+        session[field] = float(session[field])
+    for field in ('user_id', 'quiz_id', 'subject_id'):
+        session[field] = int(session[field])
+    return session
+
+
+def _loads(raw):
+    """Decode a session taken by _TAKE_SCRIPT"""
+    pairs = json.loads(raw)
+    return _decode(dict(zip(pairs[::2], pairs[1::2])))
+
+
+def start_session(user, quiz):
+    """Start (or resume) the user's timed attempt at a quiz, returns the session
+
+    The deadline is the quiz duration from now, capped at the quiz's end time.
+    """
+    now = time.time()
+    deadline = min(now + quiz.duration * 60, quiz.end_time.timestamp())
+    expire_at = int(deadline + current_app.config.get('ATTEMPT_SESSION_RETENTION', 24 * 60 * 60))
+    fields = {
+        'session_id': uuid4().hex, 'user_id': user.id, 'username': user.username,
+        'quiz_id': quiz.id, 'subject_id': quiz.chapter.subject_id,
+        'started_at': now, 'deadline': deadline
+    }
+    client = get_redis()
+    start = client.register_script(_START_SCRIPT)
+    args = [deadline, expire_at, f"{user.id}:{quiz.id}"]
+    for field, value in fields.items():
+        args += [field, value]
+    raw = start(keys=[SESSION.format(user_id=user.id, quiz_id=quiz.id), DEADLINES], args=args)
+    return _decode(dict(zip(raw[::2], raw[1::2])))
+
+
+def autosave(user_id, quiz_id, answers):
+    """Store partial answers ({question_id: option index or None}), returns -1, 0 or 1 as the script
+
+    Raises ValueError for malformed answers. Only Redis is touched.
+    """
+    if not isinstance(answers, dict) or len(answers) > MAX_ANSWERS:
+        raise ValueError(f"answers must be an object of at most {MAX_ANSWERS} entries")
+    args = [time.time() - current_app.config.get('ATTEMPT_GRACE_SECONDS', 30)]
+    for question_id, option in answers.items():
+        if not str(question_id).isdigit() or not (option is None or (isinstance(option, int) and option >= 0)):
+            raise ValueError(f"Invalid answer for question {question_id}")
+        args += [f"{ANSWER_PREFIX}{question_id}", '' if option is None else option]
+    save = get_redis().register_script(_AUTOSAVE_SCRIPT)
+    return save(keys=[SESSION.format(user_id=user_id, quiz_id=quiz_id)], args=args)
+
+
+def take_session(user_id, quiz_id):
+    """Take the user's open session over for a submit, returns it or None when there is none
+
+    The session is deleted as it is read, so the sweeper cannot submit it as well.
+    Raises AttemptExpired once the deadline plus grace passed.
+    """
+    take = get_redis().register_script(_TAKE_SCRIPT)
+    raw = take(keys=[SESSION.format(user_id=user_id, quiz_id=quiz_id), DEADLINES],
+               args=[f"{user_id}:{quiz_id}", time.time() - current_app.config.get('ATTEMPT_GRACE_SECONDS', 30)])
+    if raw == 0:
+        raise AttemptExpired(f"{user_id}:{quiz_id}")
+    return _loads(raw) if raw else None
+
+
+def restore_session(session):
+    """Put back a session taken by a submit that failed before storing the attempt"""
+    key = SESSION.format(user_id=session['user_id'], quiz_id=session['quiz_id'])
+    fields = {field: value for field, value in session.items() if field != 'answers'}
+    fields.update({f"{ANSWER_PREFIX}{question_id}": option for question_id, option in session['answers'].items()})
+    try:
+        pipe = get_redis().pipeline()
+        pipe.hset(key, mapping=fields)
+        pipe.expireat(key, int(session['deadline'] + current_app.config.get('ATTEMPT_SESSION_RETENTION', 24 * 60 * 60)))
+        pipe.zadd(DEADLINES, {f"{session['user_id']}:{session['quiz_id']}": session['deadline']})
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Failed to restore attempt session {session['session_id']}: {str(e)}")
+
+
+def close_quiz_sessions(quiz_id):
+    """Discard every open session on a quiz after it is deleted"""
+    try:
+        client = get_redis()
+        pipe = client.pipeline()
+        for key in client.scan_iter(match=SESSION.format(user_id='*', quiz_id=quiz_id)):
+            pipe.delete(key)
+            pipe.zrem(DEADLINES, f"{key.split(':')[1]}:{quiz_id}")
+        pipe.execute()
+    except RedisError as e:
+        logger.error(f"Failed to close attempt sessions of quiz {quiz_id}: {str(e)}")
+
+
+# ------------- Deadline Sweeper -------------
+def graded_submission(session):
+    """The ingest submission for a session's saved answers, graded against the current key"""
+    answer_key = get_answer_key(session['quiz_id'])
+    total_marks = answer_key['total_marks']
+    scored_marks, response_sheet = grade_answers(answer_key, session['answers'])
+    deadline = datetime.fromtimestamp(session['deadline'])
+    return {
+        'submission_id': session['session_id'],
+        'user_id': session['user_id'],
+        'username': session['username'],
+        'quiz_id': session['quiz_id'],
+        'subject_id': session['subject_id'],
+        'score': (scored_marks / total_marks * 100) if total_marks > 0 else 0,
+        'answers': session['answers'],
+        'response_sheet': response_sheet,
+        'facts': answer_facts(answer_key, None, session['answers']),
+        'started_at': datetime.fromtimestamp(session['started_at']).isoformat(),
+        'submitted_at': deadline.isoformat()
+    }
+
+
+def _store_graded(submissions):
+    """Store submissions in one transaction, one by one when that fails
+
+    Returns ({submission_id: attempt_id} inserted, submissions that still failed).
+    """
+    try:
+        _, inserted = store_submissions(submissions)
+        db.session.commit()
+        return inserted, []
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Batch of {len(submissions)} expired sessions failed, storing them one by one: {str(e)}")
+    inserted, failed = {}, []
+    for submission in submissions:
+        try:
+            _, submission_inserted = store_submissions([submission])
+            db.session.commit()
+            inserted.update(submission_inserted)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Expired session {submission['submission_id']} failed to store: {str(e)}")
+            failed.append(submission)
+    return inserted, failed
+
+
+def sweep_expired_sessions(batch_size=200, lease=300):
+    """Grade and store sessions whose deadline (plus grace) passed without a submit
+
+    Sessions are taken over with the same script as a submit, so only one of the two
+    grades a session. Taken sessions wait in SWEEPING under a lease until their batch
+    is stored in one transaction, keyed by session id, so a sweeper that dies mid-batch
+    has them retried without storing an attempt twice. Sessions that fail on their own
+    are moved to DEAD with their answers. Returns the number inserted.
+    """
+    client = get_redis()
+    claim = client.register_script(_CLAIM_SCRIPT)
+    take = client.register_script(_TAKE_SCRIPT)
+    cutoff = time.time() - current_app.config.get('ATTEMPT_GRACE_SECONDS', 30)
+    swept = 0
+    while True:
+        lease_until = time.time() + lease
+        # Sessions left taken by a sweeper that died first, then newly expired ones
+        taken = claim(keys=[SWEEPING], args=[time.time(), batch_size, lease_until])
+        if not taken:
+            members = claim(keys=[DEADLINES], args=[cutoff, batch_size, lease_until])
+            if not members:
+                return swept
+            for member in members:
+                user_id, quiz_id = member.split(':')
+                raw = take(keys=[SESSION.format(user_id=user_id, quiz_id=quiz_id), DEADLINES, SWEEPING],
+                           args=[member, 0, lease_until])
+                if raw:
+                    taken.append(raw)
+                else:  # Expired or already submitted
+                    client.zrem(DEADLINES, member)
+            if not taken:
+                continue
+
+        sessions = [_loads(raw) for raw in taken]
+        submissions = [graded_submission(session) for session in sessions]
+        inserted, failed = _store_graded(submissions)
+        pipe = client.pipeline()
+        if failed:
+            pipe.rpush(DEAD, *(json.dumps(submission) for submission in failed))
+        pipe.zrem(SWEEPING, *taken)
+        pipe.execute()
+        for submission, session in zip(submissions, sessions):
+            if submission['submission_id'] in inserted:
+                safe_record_score(session['user_id'], session['username'], session['quiz_id'],
+                                  session['subject_id'], submission['score'], inserted[submission['submission_id']])
+        invalidate_tags('reports', *{f"user:{session['user_id']}" for session in sessions})
+        swept += len(inserted)
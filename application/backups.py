@@ -0,0 +1,203 @@
+from datetime import datetime
+from .models import db
+from .instance import get_redis
+from .routing import REPLICA_BIND, SYNCED_KEY
+import gzip
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+try:
+    import zstandard
+except ImportError:  # zstd compression is optional
+    zstandard = None
+
+MANIFEST = 'manifest.json'
+EXTENSIONS = {'none': '.sqlite', 'gzip': '.sqlite.gz', 'zstd': '.sqlite.zst'}
+CHUNK_SIZE = 1024 * 1024
+
+
+# ------------- Online Copy -------------
+def sqlite_path():
+    """Filesystem path of the app's SQLite database"""
+    url = db.engine.url
+    if url.get_backend_name() != 'sqlite' or not url.database or url.database == ':memory:':
+        raise ValueError(f"Online backups need a file-based SQLite database (got {url.render_as_string(hide_password=True)})")
+    return url.database
+
+
+def online_copy(source_path, dest_path, pages=256, sleep=0.05):
+    """Copy a live SQLite database with the backup API, a few pages at a time
+
+    Between steps the source lock is released, so writers only wait for one step.
+    Returns the number of pages copied.
+    """
+    progress = {'pages': 0}
+
+    def on_progress(status, remaining, total):
+        progress['pages'] = total
+
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    dest = sqlite3.connect(dest_path)
+    try:
+        source.backup(dest, pages=pages, progress=on_progress, sleep=sleep)
+    finally:
+        dest.close()
+        source.close()
+    return progress['pages']
+
+
+def refresh_replica(pages=256):
+    """Copy the primary database over the read replica file, returns the number of pages copied
+
+    Replica connections keep reading their snapshot until the copy commits. The
+    start time is recorded as the replica's sync time for @read_replica.
+    """
+    if REPLICA_BIND not in db.engines:
+        raise ValueError(f"No '{REPLICA_BIND}' entry in SQLALCHEMY_BINDS")
+    replica = db.engines[REPLICA_BIND].url
+    if replica.get_backend_name() != 'sqlite' or not replica.database or replica.database == ':memory:':
+        raise ValueError(f"Snapshot refresh needs a file-based SQLite replica (got {replica.render_as_string(hide_password=True)})")
+    started = time.time()
+    copied = online_copy(sqlite_path(), replica.database, pages=pages)
+    get_redis().set(SYNCED_KEY, started)
+    return copied
+
+
+def integrity_check(path):
+    """Run PRAGMA integrity_check on an uncompressed database file, returns the result text"""
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        return '; '.join(row[0] for row in conn.execute('PRAGMA integrity_check'))
+    finally:
+        conn.close()
+
+
+# ------------- Compression -------------
+def _open_compressed(path, compression, mode):
+    if compression == 'gzip':
+        return gzip.open(path, mode)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package")
+        if 'w' in mode:
+            return zstandard.ZstdCompressor().stream_writer(open(path, 'wb'), closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return open(path, mode)
+
+
+def _copy_stream(source, dest):
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            return
+        dest.write(chunk)
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# ------------- Manifest And Retention -------------
+def read_manifest(backups_dir):
+    path = os.path.join(backups_dir, MANIFEST)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_manifest(backups_dir, entries):
+    path = os.path.join(backups_dir, MANIFEST)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(entries, f, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+
+def apply_retention(backups_dir, entries, keep):
+    """Delete all but the newest `keep` backups (0 keeps everything), returns the entries kept"""
+    entries = sorted(entries, key=lambda e: e['created_at'])
+    if not keep:
+        return entries
+    for entry in entries[:-keep]:
+        path = os.path.join(backups_dir, entry['file'])
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Removed expired backup {entry['file']}")
+    return entries[-keep:]
+
+
+# ------------- Backup And Verify -------------
+def create_backup(backups_dir, compression='gzip', keep=7, pages=256, sleep=0.05):
+    """Take an online backup, verify it, compress it and record it in the manifest"""
+    if compression not in EXTENSIONS:
+        raise ValueError(f"Unknown backup compression: {compression}")
+    os.makedirs(backups_dir, exist_ok=True)
+    source_path = sqlite_path()
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    filename = f"db_backup_{timestamp}{EXTENSIONS[compression]}"
+    final_path = os.path.join(backups_dir, filename)
+    partial_path = os.path.join(backups_dir, f".db_backup_{timestamp}.partial")
+
+    try:
+        copied_pages = online_copy(source_path, partial_path, pages=pages, sleep=sleep)
+        integrity = integrity_check(partial_path)
+        if integrity != 'ok':
+            raise RuntimeError(f"Backup failed integrity check: {integrity}")
+        source_size = os.path.getsize(partial_path)
+        source_sha256 = file_sha256(partial_path)
+
+        if compression == 'none':
+            os.replace(partial_path, final_path)
+        else:
+            with open(partial_path, 'rb') as src, _open_compressed(final_path, compression, 'wb') as dest:
+                _copy_stream(src, dest)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+    entry = {
+        'file': filename,
+        'created_at': datetime.now().isoformat(),
+        'compression': compression,
+        'pages': copied_pages,
+        'size': os.path.getsize(final_path),
+        'sha256': file_sha256(final_path),
+        'database_size': source_size,
+        'database_sha256': source_sha256,
+        'integrity': integrity
+    }
+    entries = apply_retention(backups_dir, read_manifest(backups_dir) + [entry], keep)
+    _write_manifest(backups_dir, entries)
+    return entry
+
+
+def verify_backup(backups_dir, filename):
+    """Check a backup against its manifest checksums, restore it to a temp file and integrity-check it"""
+    entry = next((e for e in read_manifest(backups_dir) if e['file'] == filename), None)
+    if entry is None:
+        raise ValueError(f"{filename} is not in the backup manifest")
+    path = os.path.join(backups_dir, filename)
+    if file_sha256(path) != entry['sha256']:
+        return {'file': filename, 'status': 'FAILED', 'error': 'checksum mismatch'}
+
+    fd, restored = tempfile.mkstemp(suffix='.sqlite')
+    try:
+        with os.fdopen(fd, 'wb') as dest, _open_compressed(path, entry['compression'], 'rb') as src:
+            _copy_stream(src, dest)
+        if file_sha256(restored) != entry['database_sha256']:
+            return {'file': filename, 'status': 'FAILED', 'error': 'restored database checksum mismatch'}
+        integrity = integrity_check(restored)
+    finally:
+        os.remove(restored)
+    return {'file': filename, 'status': 'OK' if integrity == 'ok' else 'FAILED', 'integrity': integrity}
@@ -0,0 +1,69 @@
+from sqlalchemy import event, func, inspect, select, update
+from .models import db, Subject, Chapter, Quiz, Question
+
+# ------------- Denormalized Catalog Counters -------------
+# (child model, foreign key attribute, parent model, parent counter column).
+# Mapper events keep the counters in step with every ORM insert, delete and
+# re-parenting flush; bulk Query.delete() skips them, so run recount_counters
+# (manage_db.py recount) after bulk changes.
+COUNTERS = [
+    (Question, 'quiz_id', Quiz, 'questions_count'),
+    (Quiz, 'chapter_id', Chapter, 'quizzes_count'),
+    (Chapter, 'subject_id', Subject, 'chapters_count'),
+]
+
+
+def _bump(connection, parent, column, parent_id, delta):
+    if parent_id is None:
+        return
+    counter = parent.__table__.c[column]
+    connection.execute(
+        update(parent.__table__)
+        .where(parent.__table__.c.id == parent_id)
+        .values({column: counter + delta})
+    )
+
+
+def _watch(child, foreign_key, parent, column):
+    @event.listens_for(child, 'after_insert')
+    def counted_insert(mapper, connection, target):
+        _bump(connection, parent, column, getattr(target, foreign_key), 1)
+
+    @event.listens_for(child, 'after_delete')
+    def counted_delete(mapper, connection, target):
+        _bump(connection, parent, column, getattr(target, foreign_key), -1)
+
+    @event.listens_for(child, 'after_update')
+    def counted_move(mapper, connection, target):
+        history = inspect(target).attrs[foreign_key].history
+        if not history.has_changes():
+            return
+        for old_id in history.deleted:
+            _bump(connection, parent, column, old_id, -1)
+        _bump(connection, parent, column, getattr(target, foreign_key), 1)
+
+
+for _child, _foreign_key, _parent, _column in COUNTERS:
+    _watch(_child, _foreign_key, _parent, _column)
+
+
+def recount_counters(conn=None):
+    """Recompute every counter from the child tables, returns the number of rows corrected
+
+    Runs on the given connection (inside a migration) or on the session, which it commits.
+    """
+    executor = conn if conn is not None else db.session
+    corrected = 0
+    for child, foreign_key, parent, column in COUNTERS:
+        actual = select(func.count()).select_from(child.__table__)\
+            .where(child.__table__.c[foreign_key] == parent.__table__.c.id)\
+            .scalar_subquery()
+        result = executor.execute(
+            update(parent.__table__)
+            .where(parent.__table__.c[column] != actual)
+            .values({column: actual})
+        )
+        corrected += result.rowcount
+    if conn is None:
+        db.session.commit()
+    return corrected
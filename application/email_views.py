@@ -31,3 +31,9 @@ def test_email():
             'status': 'error',
             'message': str(e)
         }), 500
+
+@email_bp.route('/metrics')
+@roles_required('admin')
+def email_metrics():
+    """SMTP pool throughput counters for this process"""
+    return jsonify(EmailService.metrics())
@@ -0,0 +1,151 @@
+from datetime import datetime
+from sqlalchemy import case, func
+from .models import db, Quiz, QuizAttempt
+from .backups import file_sha256
+from .rollups import PASS_MARK
+import csv
+import gzip
+import json
+import os
+
+EXPORT_BATCH = 2000  # Rows fetched per database round trip
+
+
+def _plain(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+class _ByteCounter:
+    """Text file wrapper counting the UTF-8 bytes written (writes return characters)"""
+
+    def __init__(self, file):
+        self.file = file
+        self.bytes = 0
+
+    def write(self, text):
+        self.bytes += len(text) if text.isascii() else len(text.encode('utf-8'))
+        return self.file.write(text)
+
+
+class PartWriter:
+    """Write rows to gzip-compressed CSV or JSONL parts of bounded size"""
+
+    def __init__(self, directory, dataset, columns, fmt='csv', max_rows=500000, max_bytes=64 * 1024 * 1024):
+        if fmt not in ('csv', 'jsonl'):
+            raise ValueError(f"Unknown export format: {fmt}")
+        self.directory = directory
+        self.dataset = dataset
+        self.columns = columns
+        self.fmt = fmt
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.parts = []
+        self._file = None
+
+    def _open_part(self):
+        name = f"{self.dataset}-{len(self.parts) + 1:05d}.{self.fmt}.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), 'wt', newline='', encoding='utf-8')
+        self._part = {'file': name, 'rows': 0}
+        self._out = _ByteCounter(self._file)
+        if self.fmt == 'csv':
+            self._csv = csv.writer(self._out)
+            self._csv.writerow(self.columns)
+
+    def _close_part(self):
+        self._file.close()
+        self._file = None
+        path = os.path.join(self.directory, self._part['file'])
+        self._part['size'] = os.path.getsize(path)
+        self._part['sha256'] = file_sha256(path)
+        self.parts.append(self._part)
+
+    def write(self, row):
+        if self._file is None:
+            self._open_part()
+        values = [_plain(value) for value in row]
+        if self.fmt == 'csv':
+            self._csv.writerow(values)
+        else:
+            self._out.write(json.dumps(dict(zip(self.columns, values))) + '\n')
+        self._part['rows'] += 1
+        if self._part['rows'] >= self.max_rows or self._out.bytes >= self.max_bytes:
+            self._close_part()
+
+    def close(self):
+        """Finish the open part and return the dataset's manifest entry"""
+        if self._file is not None:
+            self._close_part()
+        return {
+            'dataset': self.dataset,
+            'columns': self.columns,
+            'rows': sum(part['rows'] for part in self.parts),
+            'parts': self.parts
+        }
+
+
+# ------------- Datasets -------------
+def attempt_rows():
+    query = db.session.query(
+        QuizAttempt.id, QuizAttempt.user_id, QuizAttempt.quiz_id, QuizAttempt.score,
+        QuizAttempt.date_created, QuizAttempt.started_at, QuizAttempt.completed_at
+    ).order_by(QuizAttempt.id)
+    return query.yield_per(EXPORT_BATCH)
+
+
+def question_response_rows():
+    """Per-question correctness decoded from each attempt's response sheet"""
+    query = db.session.query(
+        QuizAttempt.id, QuizAttempt.user_id, QuizAttempt.quiz_id, QuizAttempt.response_sheet
+    ).order_by(QuizAttempt.id)
+    for attempt_id, user_id, quiz_id, response_sheet in query.yield_per(EXPORT_BATCH):
+        for item in response_sheet or []:
+            # Older sheets stored the awarded marks as 'scored_marks'
+            yield (attempt_id, user_id, quiz_id, item['question_id'], item['is_correct'],
+                   item.get('marks'), item.get('scored', item.get('scored_marks')))
+
+
+def quiz_aggregate_rows():
+    query = db.session.query(
+        Quiz.id, Quiz.title, Quiz.chapter_id,
+        func.count(QuizAttempt.id),
+        func.avg(QuizAttempt.score),
+        func.sum(case((QuizAttempt.score >= PASS_MARK, 1), else_=0)),
+        func.min(QuizAttempt.date_created),
+        func.max(QuizAttempt.date_created)
+    ).outerjoin(QuizAttempt, QuizAttempt.quiz_id == Quiz.id)\
+     .group_by(Quiz.id, Quiz.title, Quiz.chapter_id)\
+     .order_by(Quiz.id)
+    return query.yield_per(EXPORT_BATCH)
+
+
+DATASETS = [
+    ('attempts', ['attempt_id', 'user_id', 'quiz_id', 'score', 'date_created', 'started_at', 'completed_at'],
+     attempt_rows),
+    ('question_responses', ['attempt_id', 'user_id', 'quiz_id', 'question_id', 'is_correct', 'marks', 'scored'],
+     question_response_rows),
+    ('quiz_aggregates', ['quiz_id', 'title', 'chapter_id', 'attempts', 'avg_score', 'pass_count',
+                         'first_attempt', 'last_attempt'],
+     quiz_aggregate_rows),
+]
+
+
+def export_all(exports_dir, fmt='csv', max_rows=500000, max_bytes=64 * 1024 * 1024):
+    """Stream every dataset into a timestamped export directory, returns the manifest path and manifest"""
+    directory = os.path.join(exports_dir, f"analytics_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+    os.makedirs(directory, exist_ok=True)
+
+    manifest = {
+        'generated_at': datetime.now().isoformat(),
+        'format': fmt,
+        'datasets': []
+    }
+    for dataset, columns, rows in DATASETS:
+        writer = PartWriter(directory, dataset, columns, fmt, max_rows, max_bytes)
+        for row in rows():
+            writer.write(row)
+        manifest['datasets'].append(writer.close())
+
+    manifest_path = os.path.join(directory, 'manifest.json')
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path, manifest
@@ -0,0 +1,94 @@
+from flask import current_app
+from flask_security.utils import set_request_attr
+from redis.exceptions import RedisError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
+from .models import db, User, Role
+from .instance import get_redis
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ------------- Identity Cache -------------
+# Flask-Security loads the user by fs_uniquifier and then lazy-loads its roles on
+# every authenticated request. The cache keeps both as one Redis entry, and the
+# loader rebuilds a session-bound User from it without touching the database.
+# The password hash is never cached: it is loaded on first access.
+IDENTITY_KEY = 'identity:{uniquifier}'
+USER_FIELDS = ('id', 'username', 'email', 'active', 'fs_uniquifier')
+ROLE_FIELDS = ('id', 'name', 'description')
+
+
+def _snapshot(user):
+    return {
+        'user': {field: getattr(user, field) for field in USER_FIELDS},
+        'roles': [{field: getattr(role, field) for field in ROLE_FIELDS} for role in user.roles]
+    }
+
+
+def _attach(snapshot):
+    """A persistent User (and roles) built from a snapshot without a query
+
+    Instances are marked detached-and-loaded before joining the session, so
+    nothing is flushed for them and uncached columns load lazily.
+    """
+    session = db.session()
+    user = session.identity_map.get(session.identity_key(User, snapshot['user']['id']))
+    if user is not None:  # Already loaded in this request
+        return user
+    roles = []
+    for fields in snapshot['roles']:
+        role = Role(**fields)
+        make_transient_to_detached(role)
+        roles.append(session.merge(role, load=False))
+    user = User(**snapshot['user'])
+    make_transient_to_detached(user)
+    set_committed_value(user, 'roles', roles)  # Loaded state, not a change to roles_users
+    session.add(user)
+    return user
+
+
+def find_user(uniquifier):
+    """The user with this fs_uniquifier from the identity cache or the database, else None"""
+    if not current_app.config.get('IDENTITY_CACHE', True):
+        return User.query.filter_by(fs_uniquifier=uniquifier).first()
+    key = IDENTITY_KEY.format(uniquifier=uniquifier)
+    try:
+        raw = get_redis().get(key)
+    except RedisError as e:
+        logger.warning(f"Identity cache unavailable, loading the user from the database: {str(e)}")
+        return User.query.filter_by(fs_uniquifier=uniquifier).first()
+    if raw:
+        return _attach(json.loads(raw))
+
+    user = User.query.filter_by(fs_uniquifier=uniquifier).first()
+    if user is not None:
+        try:
+            get_redis().set(key, json.dumps(_snapshot(user)),
+                            ex=current_app.config.get('IDENTITY_CACHE_TIMEOUT', 60))
+        except RedisError as e:
+            logger.warning(f"Failed to cache identity of user {user.id}: {str(e)}")
+    return user
+
+
+def load_user(uniquifier):
+    """Flask-Login user loader, Flask-Security's session loader on top of the identity cache"""
+    user = find_user(str(uniquifier))
+    if user and user.active:
+        set_request_attr('fs_authn_via', 'session')
+        return user
+    return None
+
+
+def invalidate_identity(*uniquifiers):
+    """Drop cached identities after a user's profile, roles or active flag change"""
+    try:
+        get_redis().delete(*(IDENTITY_KEY.format(uniquifier=uniquifier) for uniquifier in uniquifiers))
+    except RedisError as e:
+        logger.error(f"Failed to invalidate identities {', '.join(uniquifiers)}: {str(e)}")
+
+
+def init_identity(app):
+    """Install the cached user loader, after Security has set up its login manager"""
+    app.security.login_manager.user_loader(load_user)
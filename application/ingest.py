@@ -0,0 +1,230 @@
+from flask import current_app
+from redis.exceptions import RedisError
+from sqlalchemy import insert
+from datetime import datetime
+from .models import db, Quiz, QuizAttempt, AttemptAnswer
+from .instance import get_redis, invalidate_tags
+from .rollups import record_attempts
+from .leaderboard import safe_record_score
+import json
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# ------------- Submission Queue -------------
+# submit_quiz grades and acknowledges at once, then pushes the attempt onto QUEUE.
+# A single writer moves a batch to PROCESSING, inserts it in one transaction and
+# only then drops it, so a crash replays the batch. Replays are harmless because
+# quiz_attempts.submission_id is unique and stored submissions are skipped.
+QUEUE = 'ingest:submissions'
+PROCESSING = 'ingest:processing'
+DEAD = 'ingest:dead'                     # Submissions that failed to insert on their own
+STATUS = 'ingest:status:{submission_id}'  # Hash: state (queued, stored, failed), user_id, attempt_id
+WRITER_LOCK = 'ingest:writer'
+
+# Move up to ARGV[1] submissions from the queue to the processing list, atomically
+_CLAIM_SCRIPT = """
+local items = redis.call('LRANGE', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+if #items > 0 then
+    redis.call('LTRIM', KEYS[1], #items, -1)
+    redis.call('RPUSH', KEYS[2], unpack(items))
+end
+return items
+"""
+
+# Drop a written batch (ARGV[2] items) from the processing list and dead-letter its
+# failures (ARGV[3:]), only while this writer still holds the lock (token ARGV[1]):
+# a writer that stalled past its lock would otherwise trim the next writer's batch
+_RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then return 0 end
+redis.call('LTRIM', KEYS[2], tonumber(ARGV[2]), -1)
+for i = 3, #ARGV do
+    redis.call('RPUSH', KEYS[3], ARGV[i])
+end
+return 1
+"""
+
+
+def enqueue_submission(submission):
+    """Queue a graded submission for the writer and mark it queued, raises RedisError when Redis is down"""
+    status_key = STATUS.format(submission_id=submission['submission_id'])
+    pipe = get_redis().pipeline()  # MULTI/EXEC: the status and the queue entry are written together
+    pipe.hset(status_key, mapping={'state': 'queued', 'user_id': submission['user_id']})
+    pipe.expire(status_key, current_app.config.get('INGEST_STATUS_TIMEOUT', 24 * 60 * 60))
+    pipe.rpush(QUEUE, json.dumps(submission))
+    pipe.execute()
+
+
+def submission_status(submission_id):
+    """{'state', 'user_id', 'attempt_id'} of a submission, from Redis or the stored attempt, else None"""
+    try:
+        status = get_redis().hgetall(STATUS.format(submission_id=submission_id))
+    except RedisError as e:
+        logger.warning(f"Failed to read submission status, checking the database: {str(e)}")
+        status = None
+    if status:
+        return {'state': status['state'], 'user_id': int(status['user_id']),
+                'attempt_id': int(status['attempt_id']) if status.get('attempt_id') else None}
+    row = db.session.query(QuizAttempt.id, QuizAttempt.user_id)\
+        .filter(QuizAttempt.submission_id == submission_id).first()
+    if row is None:
+        return None
+    return {'state': 'stored', 'user_id': row.user_id, 'attempt_id': row.id}
+
+
+def queue_depth():
+    client = get_redis()
+    return {'queued': client.llen(QUEUE), 'processing': client.llen(PROCESSING), 'dead': client.llen(DEAD)}
+
+
+# ------------- Writer -------------
+def store_submissions(submissions):
+    """Insert submissions not stored yet in the current transaction
+
+    Returns ({submission_id: attempt_id} of every stored submission, the same for
+    those inserted by this call).
+
+    Submissions for quizzes deleted since they were graded are dropped (and left
+    out of the result), so they cannot bring back the quiz's attempts or rollups.
+    """
+    ids = [s['submission_id'] for s in submissions]
+    stored = dict(db.session.query(QuizAttempt.submission_id, QuizAttempt.id)
+                  .filter(QuizAttempt.submission_id.in_(ids)))
+    quizzes = {quiz_id for quiz_id, in db.session.query(Quiz.id)
+               .filter(Quiz.id.in_({s['quiz_id'] for s in submissions}))}
+    dropped = [s['submission_id'] for s in submissions if s['quiz_id'] not in quizzes]
+    if dropped:
+        logger.warning(f"Dropping submissions for deleted quizzes: {', '.join(dropped)}")
+    new = [s for s in submissions if s['submission_id'] not in stored and s['quiz_id'] in quizzes]
+    if not new:
+        return stored, {}
+
+    rows = []
+    for s in new:
+        submitted_at = datetime.fromisoformat(s['submitted_at'])
+        rows.append({
+            'submission_id': s['submission_id'], 'user_id': s['user_id'], 'quiz_id': s['quiz_id'],
+            'score': s['score'], 'answers': s['answers'], 'response_sheet': s['response_sheet'],
+            'started_at': datetime.fromisoformat(s['started_at']) if s.get('started_at') else submitted_at,
+            'completed_at': submitted_at, 'date_created': submitted_at
+        })
+    # executemany with RETURNING (batched insertmanyvalues on SQLite 3.35+ and PostgreSQL)
+    result = db.session.execute(
+        insert(QuizAttempt).returning(QuizAttempt.submission_id, QuizAttempt.id), rows
+    )
+    attempt_ids = dict(result.all())
+
+    facts = []
+    for s in new:
+        attempt_id = attempt_ids[s['submission_id']]
+        facts.extend(dict(fact, attempt_id=attempt_id) for fact in s['facts'])
+    if facts:
+        db.session.execute(insert(AttemptAnswer), facts)
+    record_attempts((s['quiz_id'], s['subject_id'], datetime.fromisoformat(s['submitted_at']).date(), s['score'])
+                    for s in new)
+    stored.update(attempt_ids)
+    return stored, attempt_ids
+
+
+def _write_batch(client, lock, raw_items):
+    """Store a claimed batch in one transaction, falling back to one by one on failure
+
+    Returns (stored, failed, released); released is False when the writer lock was
+    lost meanwhile, leaving the batch for the writer that took over to replay.
+    """
+    submissions = [json.loads(raw) for raw in raw_items]
+    try:
+        stored, inserted = store_submissions(submissions)
+        db.session.commit()
+        failed = []
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Batch of {len(submissions)} submissions failed, storing them one by one: {str(e)}")
+        stored, inserted, failed = {}, {}, []
+        for raw, submission in zip(raw_items, submissions):
+            try:
+                submission_stored, submission_inserted = store_submissions([submission])
+                db.session.commit()
+                stored.update(submission_stored)
+                inserted.update(submission_inserted)
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Submission {submission['submission_id']} failed to store: {str(e)}")
+                failed.append((raw, submission))
+
+    # Committed: publish the outcome, then release the batch from PROCESSING
+    timeout = current_app.config.get('INGEST_STATUS_TIMEOUT', 24 * 60 * 60)
+    pipe = client.pipeline()
+    for submission in submissions:
+        status_key = STATUS.format(submission_id=submission['submission_id'])
+        if submission['submission_id'] in stored:
+            pipe.hset(status_key, mapping={'state': 'stored', 'user_id': submission['user_id'],
+                                           'attempt_id': stored[submission['submission_id']]})
+        else:
+            pipe.hset(status_key, mapping={'state': 'failed', 'user_id': submission['user_id']})
+        pipe.expire(status_key, timeout)
+    release = client.register_script(_RELEASE_SCRIPT)
+    release(keys=[WRITER_LOCK, PROCESSING, DEAD],
+            args=[lock.local.token, len(raw_items), *(raw for raw, _ in failed)], client=pipe)
+    released = bool(pipe.execute()[-1])
+
+    users = {s['user_id'] for s in submissions if s['submission_id'] in stored}
+    if users:
+        invalidate_tags('reports', *(f'user:{user_id}' for user_id in users))
+    # Leaderboards only count attempts that were stored, and a replayed batch only once
+    for s in submissions:
+        if s['submission_id'] in inserted:
+            safe_record_score(s['user_id'], s.get('username') or '', s['quiz_id'], s['subject_id'], s['score'],
+                              inserted[s['submission_id']])
+    return len(stored), len(failed), released
+
+
+def drain_submissions(batch_size=None, max_batches=None):
+    """Write queued submissions in batches until the queue is empty, returns (stored, failed)
+
+    Submissions left in PROCESSING by a crashed writer are written first. Only one
+    writer runs at a time; if another holds the lock this returns (0, 0).
+    """
+    client = get_redis()
+    batch_size = batch_size or current_app.config.get('INGEST_BATCH_SIZE', 500)
+    lock = client.lock(WRITER_LOCK, timeout=current_app.config.get('INGEST_WRITER_LOCK_TIMEOUT', 60))
+    if not lock.acquire(blocking=False):
+        return 0, 0
+    claim = client.register_script(_CLAIM_SCRIPT)
+    stored = failed = batches = 0
+    try:
+        while max_batches is None or batches < max_batches:
+            raw_items = client.lrange(PROCESSING, 0, batch_size - 1) or \
+                claim(keys=[QUEUE, PROCESSING], args=[batch_size])
+            if not raw_items:
+                break
+            batch_stored, batch_failed, released = _write_batch(client, lock, raw_items)
+            stored += batch_stored
+            failed += batch_failed
+            batches += 1
+            if not released:
+                logger.warning("Submission writer lost its lock, leaving the batch to the next writer")
+                break
+            lock.extend(lock.timeout, replace_ttl=True)
+    finally:
+        try:
+            lock.release()
+        except RedisError:
+            pass  # Expired; the next writer takes over
+    return stored, failed
+
+
+def run_writer(idle_sleep=0.2):
+    """Drain the queue forever, the long-running writer process (manage_db.py ingest-writer)"""
+    while True:
+        try:
+            stored, failed = drain_submissions()
+        except RedisError as e:
+            logger.error(f"Submission writer cannot reach Redis: {str(e)}")
+            stored = failed = 0
+            time.sleep(1)
+        if stored or failed:
+            logger.info(f"Stored {stored} submissions ({failed} failed)")
+        else:
+            time.sleep(idle_sleep)
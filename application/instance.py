@@ -1,4 +1,506 @@
 from flask_caching import Cache
+from flask import current_app, request, copy_current_request_context, has_request_context
+from flask_security import current_user
+from redis.exceptions import RedisError
+from collections import Counter
+from urllib.parse import urlencode
+from uuid import uuid4
+from .local_cache import LocalCache
+import functools
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import redis
+import threading
+import time
 
+logger = logging.getLogger(__name__)
 
-cache = Cache()
\ No newline at end of file
+
+cache = Cache()
+
+
+def get_redis():
+    """Return the shared Redis client for the current app (created on first use)"""
+    client = current_app.extensions.get('redis')
+    if client is None:
+        client = redis.Redis.from_url(
+            current_app.config.get('REDIS_URL', 'redis://localhost:6379/4'),
+            decode_responses=True
+        )
+        current_app.extensions['redis'] = client
+    return client
+
+
+# ------------- In-Process Cache Tier -------------
+# Tag tokens and cache entries are also kept in a small per-process LRU (L1) in
+# front of Redis (L2) for CACHE_L1_TIMEOUT seconds. invalidate_tags() publishes
+# the tags on INVALIDATION_CHANNEL so every worker drops its copies of their
+# tokens at once; anything missed (a reconnect, a racing read) is bounded by
+# the L1 timeout.
+INVALIDATION_CHANNEL = 'cache_invalidation'
+TIERS_KEY = 'cache_tiers'
+
+_local = {'pid': None, 'cache': None}
+_metrics = {'counts': Counter(), 'flushed_at': time.monotonic(), 'lock': threading.Lock()}
+
+
+def local_cache():
+    """This process's L1 cache (None when CACHE_L1_SIZE is 0), subscribed on first use"""
+    if not current_app.config.get('CACHE_L1_SIZE', 1024):
+        return None
+    if _local['pid'] != os.getpid():  # first use, or first use after a fork
+        l1 = LocalCache(current_app.config.get('CACHE_L1_SIZE', 1024),
+                        current_app.config.get('CACHE_L1_TIMEOUT', 10))
+        _local.update(pid=os.getpid(), cache=l1)
+        _subscribe(l1)
+    return _local['cache']
+
+
+def _subscribe(l1):
+    def on_message(message):
+        l1.delete(*(TAG_KEY.format(tag=tag) for tag in json.loads(message['data'])))
+
+    def on_error(error, pubsub, thread):
+        logger.warning(f"Cache invalidation subscriber error, clearing L1: {str(error)}")
+        l1.clear()  # Invalidations may have been missed
+        time.sleep(1)
+
+    try:
+        pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{INVALIDATION_CHANNEL: on_message})
+        pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=on_error)
+    except RedisError as e:
+        logger.warning(f"Cache invalidation subscriber unavailable, relying on L1 timeouts: {str(e)}")
+
+
+def count_cache_event(hash_key, field):
+    """Count a cache event in process memory, flushed to Redis every CACHE_METRICS_FLUSH seconds"""
+    with _metrics['lock']:
+        _metrics['counts'][(hash_key, field)] += 1
+    if time.monotonic() - _metrics['flushed_at'] >= current_app.config.get('CACHE_METRICS_FLUSH', 10):
+        flush_cache_metrics()
+
+
+def flush_cache_metrics():
+    with _metrics['lock']:
+        counts, _metrics['counts'] = _metrics['counts'], Counter()
+        _metrics['flushed_at'] = time.monotonic()
+    if not counts:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for (hash_key, field), count in counts.items():
+            pipe.hincrby(hash_key, field, count)
+        pipe.execute()
+    except RedisError:
+        pass  # Counters are best effort, never fail the request
+
+
+def tier_stats():
+    """L1 and L2 hit ratios for cache entry lookups"""
+    flush_cache_metrics()
+    counts = {field: int(count) for field, count in get_redis().hgetall(TIERS_KEY).items()}
+    stats = {event: counts.get(event, 0) for event in ('l1_hits', 'l1_misses', 'l2_hits', 'l2_misses')}
+    l1_lookups = stats['l1_hits'] + stats['l1_misses']
+    l2_lookups = stats['l2_hits'] + stats['l2_misses']
+    stats['l1_hit_ratio'] = round(stats['l1_hits'] / l1_lookups, 3) if l1_lookups else 0
+    stats['l2_hit_ratio'] = round(stats['l2_hits'] / l2_lookups, 3) if l2_lookups else 0
+    stats['l1_entries'] = len(_local['cache']) if _local['pid'] == os.getpid() else 0
+    return stats
+
+
+# ------------- Tagged Cache Entries -------------
+# Every tag has a generation token in the cache. Entry keys embed the current
+# tokens of their tags, so invalidating a tag (a new token) orphans all entries
+# built under the old one at once; they then age out through their timeout.
+TAG_KEY = 'tag:{tag}'
+
+
+def new_generation():
+    """Generation token: its creation time in milliseconds (hex) and a random suffix"""
+    return f"{int(time.time() * 1000):x}-{uuid4().hex[:6]}"
+
+
+def generation_time(token):
+    """Creation time of a generation token, None for tokens that do not carry one"""
+    try:
+        return int(token.split('-')[0], 16) / 1000 if '-' in token else None
+    except ValueError:
+        return None
+
+
+def tag_generations(*tags):
+    """Current generation token of each tag, creating tokens for new tags
+
+    Returns None when the cache is unreachable; callers then compute uncached.
+    """
+    keys = [TAG_KEY.format(tag=tag) for tag in tags]
+    l1 = local_cache()
+    generations = l1.get_many(*keys) if l1 is not None else [None] * len(keys)
+    missing = [index for index, token in enumerate(generations) if token is None]
+    if missing:
+        try:
+            for index, token in zip(missing, cache.get_many(*(keys[i] for i in missing))):
+                if token is None:
+                    # add() keeps a token another worker created first
+                    cache.add(keys[index], new_generation(), timeout=0)
+                    token = cache.get(keys[index]) or '0'
+                generations[index] = token
+                if l1 is not None:
+                    l1.set(keys[index], token)
+        except RedisError as e:
+            logger.warning(f"Cache tags unavailable, serving uncached: {str(e)}")
+            return None
+    return generations
+
+
+def invalidate_tags(*tags):
+    """Start a new generation for each tag, orphaning the entries cached under it
+
+    Safe to call after a commit: when the cache is unreachable the failure is
+    logged and the orphaned entries age out through their timeouts instead.
+    """
+    keys = [TAG_KEY.format(tag=tag) for tag in tags]
+    try:
+        cache.set_many({key: new_generation() for key in keys}, timeout=0)
+    except RedisError as e:
+        logger.error(f"Failed to invalidate cache tags {tags}, entries expire with their timeout: {str(e)}")
+    l1 = local_cache()
+    if l1 is not None:
+        l1.delete(*keys)
+    try:
+        get_redis().publish(INVALIDATION_CHANNEL, json.dumps(list(tags)))
+    except RedisError as e:
+        logger.warning(f"Failed to publish cache invalidation for {tags}: {str(e)}")
+
+
+def tagged_key(key, *tags):
+    """key under the tags' current generations, None when the cache is unreachable"""
+    generations = tag_generations(*tags)
+    return f"{key}@{'.'.join(generations)}" if generations is not None else None
+
+
+def tagged_version(key, *tags):
+    """(tagged key, last modified time) where the time is that of the newest tag generation
+
+    Both are None when the cache is unreachable.
+    """
+    generations = tag_generations(*tags)
+    if generations is None:
+        return None, None
+    times = [generation_time(token) for token in generations]
+    last_modified = max(times) if times and None not in times else None
+    return f"{key}@{'.'.join(generations)}", last_modified
+
+
+# ------------- Stampede Protection -------------
+# Entries are stored as {'value', 'expires', 'delta'} and kept CACHE_STALE_GRACE
+# seconds past their logical expiry. Reads refresh early with a probability that
+# grows towards expiry (XFetch: the slower the computation, the earlier), and
+# only the worker holding the key's Redis lock recomputes; the rest serve the
+# stale value, or wait for the fresh one when there is none.
+LOCK_KEY = 'cache_lock:{key}'
+
+_release_script = None
+
+
+def _release_lock(client, lock_key, token):
+    global _release_script
+    if _release_script is None:
+        _release_script = client.register_script(
+            "if redis.call('get', KEYS[1]) == ARGV[1] then return redis.call('del', KEYS[1]) end return 0"
+        )
+    _release_script(keys=[lock_key], args=[token], client=client)
+
+
+def _acquire_lock(key):
+    """Lock token for recomputing key, None if another worker holds it, '' without Redis"""
+    token = uuid4().hex
+    try:
+        timeout = current_app.config.get('CACHE_LOCK_TIMEOUT', 30)
+        if get_redis().set(LOCK_KEY.format(key=key), token, nx=True, ex=timeout):
+            return token
+        return None
+    except RedisError as e:
+        logger.warning(f"Cache lock unavailable, recomputing {key} without it: {str(e)}")
+        return ''
+
+
+def _unlock(key, token):
+    if not token:
+        return
+    try:
+        _release_lock(get_redis(), LOCK_KEY.format(key=key), token)
+    except RedisError as e:
+        logger.warning(f"Failed to release cache lock for {key}: {str(e)}")
+
+
+def _store(key, compute):
+    """Run compute() -> (value, timeout) and cache the value unless timeout is False"""
+    started = time.time()
+    value, timeout = compute()
+    if timeout is False:
+        return value
+    if timeout is None:
+        timeout = current_app.config.get('CACHE_DEFAULT_TIMEOUT', 300)
+    if timeout == 0:
+        expires, physical = math.inf, 0
+    else:
+        expires = time.time() + timeout
+        physical = timeout + current_app.config.get('CACHE_STALE_GRACE', 300)
+    entry = {'value': value, 'expires': expires, 'delta': time.time() - started}
+    try:
+        cache.set(key, entry, timeout=physical)
+    except RedisError as e:
+        logger.warning(f"Failed to cache {key}: {str(e)}")
+        return value
+    l1 = local_cache()
+    if l1 is not None:
+        l1.set(key, entry)
+    return value
+
+
+def _get_entry(key):
+    """Cached entry for key from L1, else from L2 (copied into L1), None if missing"""
+    l1 = local_cache()
+    if l1 is not None:
+        entry = l1.get(key)
+        # An L1 copy past its expiry may have been refreshed in L2 by another worker
+        if entry is not None and time.time() < entry['expires']:
+            count_cache_event(TIERS_KEY, 'l1_hits')
+            return entry
+        count_cache_event(TIERS_KEY, 'l1_misses')
+
+    try:
+        entry = cache.get(key)
+    except RedisError as e:
+        logger.warning(f"Cache unavailable, recomputing {key}: {str(e)}")
+        return None
+    if not isinstance(entry, dict) or 'expires' not in entry:
+        entry = None  # Missing, or written before entries carried their expiry
+    count_cache_event(TIERS_KEY, 'l2_hits' if entry is not None else 'l2_misses')
+    if entry is not None and l1 is not None:
+        l1.set(key, entry)
+    return entry
+
+
+def _in_background(func):
+    """Run func in a daemon thread with the current request (or app) context"""
+    if has_request_context():
+        target = copy_current_request_context(func)
+    else:
+        app = current_app._get_current_object()
+
+        def target():
+            with app.app_context():
+                func()
+    threading.Thread(target=target, daemon=True).start()
+
+
+def _fetch(key, compute, early_refresh=1.0, stale_while_revalidate=False):
+    """Return (value, cache event) for key, recomputing at most once at a time across workers
+
+    early_refresh scales the XFetch window (0 disables it). With
+    stale_while_revalidate the recomputing request also serves the stale value
+    and refreshes in a background thread.
+    """
+    entry = _get_entry(key)
+    if not current_app.config.get('CACHE_STAMPEDE_PROTECTION', True):
+        if entry is not None and time.time() < entry['expires']:
+            return entry['value'], 'hits'
+        return _store(key, compute), 'misses'
+
+    now = time.time()
+    fresh = entry is not None and now < entry['expires']
+    if fresh and now - entry['delta'] * early_refresh * math.log(random.random() or 1e-12) < entry['expires']:
+        return entry['value'], 'hits'
+
+    token = _acquire_lock(key)
+    if token is None:
+        if entry is not None:
+            return entry['value'], 'hits' if fresh else 'stale_hits'
+        # Nothing to serve yet: wait for the lock holder's result
+        deadline = now + current_app.config.get('CACHE_LOCK_WAIT', 5)
+        while time.time() < deadline:
+            time.sleep(0.05)
+            entry = _get_entry(key)
+            if entry is not None:
+                return entry['value'], 'hits'
+        return _store(key, compute), 'misses'
+
+    if entry is not None and stale_while_revalidate:
+        def refresh():
+            try:
+                _store(key, compute)
+            finally:
+                _unlock(key, token)
+        _in_background(refresh)
+        return entry['value'], 'hits' if fresh else 'stale_hits'
+
+    try:
+        return _store(key, compute), 'misses'
+    finally:
+        _unlock(key, token)
+
+
+def remember(key, tags, compute, timeout=None, early_refresh=1.0, stale_while_revalidate=False):
+    """Return compute() through the cache under a tagged key, for data that
+    needs per-request post-processing before it becomes a response"""
+    tagged = tagged_key(key, *tags)
+    if tagged is None:
+        return compute()
+    return _fetch(tagged, lambda: (compute(), timeout),
+                  early_refresh, stale_while_revalidate)[0]
+
+
+# ------------- Per-User Cache Entries -------------
+# Keys carry the key family, the caller's roles and (unless shared by role) the
+# user id, plus the path and the sorted query string, so no user or filter
+# combination can be served another's response.
+STATS_KEY = 'cache_stats'
+CACHE_EVENTS = ('hits', 'stale_hits', 'negative_hits', 'not_modified', 'misses')
+NEGATIVE_STATUSES = (404, 410)
+
+
+def user_cache_key(family, per_user=True):
+    if current_user.is_authenticated:
+        roles = ','.join(sorted(role.name for role in current_user.roles)) or 'none'
+        identity = f"user{current_user.id}" if per_user else 'shared'
+    else:
+        roles, identity = 'anonymous', 'shared'
+    query = urlencode(sorted(request.args.items(multi=True)))
+    return f"{family}/{roles}/{identity}{request.path}?{query}"
+
+
+def record_cache_event(family, event):
+    count_cache_event(STATS_KEY, f"{family}:{event}")
+
+
+def cache_stats():
+    """Hit and miss counters per key family"""
+    flush_cache_metrics()
+    stats = {}
+    for field, count in get_redis().hgetall(STATS_KEY).items():
+        family, event = field.rsplit(':', 1)
+        stats.setdefault(family, dict.fromkeys(CACHE_EVENTS, 0))[event] = int(count)
+    for counters in stats.values():
+        served = counters['hits'] + counters['stale_hits'] + counters['negative_hits'] + counters['not_modified']
+        lookups = served + counters['misses']
+        counters['hit_ratio'] = round(served / lookups, 3) if lookups else 0
+    return stats
+
+
+# ------------- Conditional Requests -------------
+# A tagged key names one version of a response, so its hash is the ETag and the
+# newest tag generation is Last-Modified. A client holding either gets a 304
+# before the cache (or the database) is consulted.
+# HTTP dates have 1 s resolution and generations millisecond resolution, so
+# Last-Modified is the generation rounded up and is only sent once that second
+# is over: any later generation is then strictly newer than the date a client
+# echoes back in If-Modified-Since.
+def _not_modified(etag, last_modified):
+    if request.if_none_match:  # If-None-Match takes precedence over If-Modified-Since
+        # Weak comparison, compressed responses carry the weak form of the ETag
+        return request.if_none_match.contains_weak(etag)
+    if last_modified is not None and request.if_modified_since is not None:
+        return last_modified <= request.if_modified_since.timestamp()
+    return False
+
+
+def _validators(response, etag, last_modified, cache_control):
+    response.set_etag(etag)
+    if last_modified is not None and math.ceil(last_modified) <= time.time():
+        response.last_modified = math.ceil(last_modified)
+    response.headers['Cache-Control'] = cache_control
+    return response
+
+
+def conditional_response(response, cache_control):
+    """ETag from the body hash and a 304 when it matches, for responses built per request"""
+    response.headers['Cache-Control'] = cache_control
+    if response.status_code == 200:
+        response.add_etag()
+        response.make_conditional(request)
+    return response
+
+
+def _cached_response(family, key, view, timeout, negative_timeout, early_refresh, stale_while_revalidate,
+                     last_modified=None, cache_control=None):
+    """Serve a view's response through _fetch, storing (status, body, mimetype)
+
+    With cache_control set, 200 responses carry ETag/Last-Modified validators and
+    matching conditional requests get a 304.
+    """
+    etag = hashlib.sha1(key.encode()).hexdigest()[:20] if cache_control else None
+    if etag and _not_modified(etag, last_modified):
+        record_cache_event(family, 'not_modified')
+        return _validators(current_app.response_class(status=304), etag, last_modified, cache_control)
+
+    def compute():
+        response = current_app.make_response(view())
+        entry = (response.status_code, response.get_data(), response.mimetype)
+        if response.status_code == 200:
+            return entry, timeout
+        if response.status_code in NEGATIVE_STATUSES:
+            return entry, negative_timeout
+        return entry, False
+
+    (status, body, mimetype), event = _fetch(key, compute, early_refresh, stale_while_revalidate)
+    if event != 'misses' and status != 200:
+        event = 'negative_hits'
+    record_cache_event(family, event)
+    response = current_app.response_class(body, status=status, mimetype=mimetype)
+    if etag and status == 200:
+        _validators(response, etag, last_modified, cache_control)
+    return response
+
+
+def cached_view(*tags, timeout=None, query_string=False, early_refresh=1.0, stale_while_revalidate=False,
+                cache_control=None):
+    """Cache a view's response for everyone under tags
+
+    Tags may use the view's URL arguments, e.g. cached_view('chapter:{chapter_id}').
+    cache_control enables conditional requests and is sent as the Cache-Control header.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            path = request.path
+            if query_string:
+                path += '?' + urlencode(sorted(request.args.items(multi=True)))
+            key, last_modified = tagged_version(f"view/{path}", *(tag.format(**kwargs) for tag in tags))
+            if key is None:
+                return f(*args, **kwargs)
+            return _cached_response(f.__name__, key, lambda: f(*args, **kwargs),
+                                    timeout, None, early_refresh, stale_while_revalidate,
+                                    last_modified, cache_control)
+        return decorated_function
+    return decorator
+
+
+def cached_per_user(family, *tags, timeout=None, negative_timeout=60, per_user=True,
+                    early_refresh=1.0, stale_while_revalidate=False, cache_control=None):
+    """Cache a view's response per user (or per role with per_user=False) and query string
+
+    Tags may use the view's URL arguments and {user_id}. 200 responses are kept
+    for `timeout`, 404/410 responses for `negative_timeout`, anything else is not cached.
+    cache_control enables conditional requests and is sent as the Cache-Control header.
+    When the cache backend fails the view runs uncached.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            user_id = current_user.id if current_user.is_authenticated else None
+            key, last_modified = tagged_version(user_cache_key(family, per_user),
+                                                *(tag.format(user_id=user_id, **kwargs) for tag in tags))
+            if key is None:  # Cache unreachable, answer from the view like @cache.cached did
+                return f(*args, **kwargs)
+            return _cached_response(family, key, lambda: f(*args, **kwargs), timeout,
+                                    negative_timeout, early_refresh, stale_while_revalidate,
+                                    last_modified, cache_control)
+        return decorated_function
+    return decorator
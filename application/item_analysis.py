@@ -0,0 +1,113 @@
+from sqlalchemy import and_, case, func, insert
+from .models import db, Question, QuizAttempt, AttemptAnswer
+
+GROUP_FRACTION = 0.27  # Share of attempts in the upper and lower groups for discrimination
+
+
+# ------------- Backfill -------------
+def _facts_from_sheet(attempt_id, quiz_id, response_sheet, options_by_question):
+    """attempt_answers rows recovered from a stored response sheet"""
+    facts = []
+    for item in response_sheet or []:
+        question_id = item['question_id']
+        options = item.get('options') or options_by_question.get(question_id) or []
+        user_answer = item.get('user_answer')
+        facts.append({
+            'attempt_id': attempt_id,
+            'question_id': question_id,
+            'quiz_id': quiz_id,
+            'chosen_option': options.index(user_answer) if user_answer in options else None,
+            'is_correct': bool(item.get('is_correct')),
+            # Older sheets stored the awarded marks as 'scored_marks'
+            'marks': item.get('scored', item.get('scored_marks')) or 0
+        })
+    return facts
+
+
+def backfill_attempt_answers(batch_size=500):
+    """Populate attempt_answers for attempts that have none yet, returns (attempts, rows) written"""
+    has_facts = db.session.query(AttemptAnswer.attempt_id)\
+        .filter(AttemptAnswer.attempt_id == QuizAttempt.id).exists()
+    options_by_quiz = {}  # quiz_id -> {question_id: options}
+    last_id = 0
+    attempts_done = 0
+    rows_written = 0
+
+    while True:
+        batch = db.session.query(
+            QuizAttempt.id, QuizAttempt.quiz_id, QuizAttempt.response_sheet
+        ).filter(QuizAttempt.id > last_id, ~has_facts)\
+         .order_by(QuizAttempt.id).limit(batch_size).all()
+        if not batch:
+            return attempts_done, rows_written
+
+        missing = {quiz_id for _, quiz_id, _ in batch} - set(options_by_quiz)
+        if missing:
+            options_by_quiz.update({quiz_id: {} for quiz_id in missing})
+            for question_id, quiz_id, options in db.session.query(
+                    Question.id, Question.quiz_id, Question.options).filter(Question.quiz_id.in_(missing)):
+                options_by_quiz[quiz_id][question_id] = options
+
+        facts = []
+        for attempt_id, quiz_id, response_sheet in batch:
+            facts.extend(_facts_from_sheet(attempt_id, quiz_id, response_sheet, options_by_quiz[quiz_id]))
+        if facts:
+            db.session.execute(insert(AttemptAnswer), facts)
+        db.session.commit()
+
+        attempts_done += len(batch)
+        rows_written += len(facts)
+        last_id = batch[-1][0]
+
+
+# ------------- Item Statistics -------------
+def item_statistics(quiz_id):
+    """Per-question difficulty and discrimination index for a quiz, computed in SQL
+
+    Difficulty is the share of correct responses. Discrimination is the correct share in
+    the top 27% of attempts by score minus the correct share in the bottom 27%.
+    """
+    ranked = db.session.query(
+        QuizAttempt.id.label('attempt_id'),
+        func.percent_rank().over(order_by=QuizAttempt.score).label('position')
+    ).filter(QuizAttempt.quiz_id == quiz_id).subquery()
+
+    upper = ranked.c.position >= 1 - GROUP_FRACTION
+    lower = ranked.c.position <= GROUP_FRACTION
+    rows = db.session.query(
+        AttemptAnswer.question_id,
+        func.count().label('responses'),
+        func.avg(case((AttemptAnswer.is_correct, 1.0), else_=0.0)).label('difficulty'),
+        func.sum(case((upper, 1), else_=0)).label('upper_total'),
+        func.sum(case((and_(upper, AttemptAnswer.is_correct), 1), else_=0)).label('upper_correct'),
+        func.sum(case((lower, 1), else_=0)).label('lower_total'),
+        func.sum(case((and_(lower, AttemptAnswer.is_correct), 1), else_=0)).label('lower_correct')
+    ).join(ranked, ranked.c.attempt_id == AttemptAnswer.attempt_id)\
+     .filter(AttemptAnswer.quiz_id == quiz_id)\
+     .group_by(AttemptAnswer.question_id)\
+     .all()
+
+    stats = {}
+    for row in rows:
+        discrimination = None
+        if row.upper_total and row.lower_total:
+            discrimination = row.upper_correct / row.upper_total - row.lower_correct / row.lower_total
+        stats[row.question_id] = {
+            'responses': row.responses,
+            'difficulty': round(float(row.difficulty), 3),
+            'discrimination': round(discrimination, 3) if discrimination is not None else None
+        }
+    return stats
+
+
+def option_distribution(quiz_id):
+    """{question_id: {chosen_option: count}} for a quiz, None keys count unanswered"""
+    rows = db.session.query(
+        AttemptAnswer.question_id, AttemptAnswer.chosen_option, func.count()
+    ).filter(AttemptAnswer.quiz_id == quiz_id)\
+     .group_by(AttemptAnswer.question_id, AttemptAnswer.chosen_option)\
+     .all()
+    distribution = {}
+    for question_id, chosen, count in rows:
+        distribution.setdefault(question_id, {})[chosen] = count
+    return distribution
@@ -0,0 +1,256 @@
+from redis.exceptions import RedisError
+from sqlalchemy import func, select
+from .models import db, User, Quiz, Chapter, QuizAttempt
+from .instance import get_redis
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ------------- Leaderboard Keys -------------
+# Each board is a sorted set of user_id -> average score, backed by two hashes
+# holding the score sum and attempt count so averages can be updated in place.
+BOARD = 'leaderboard:{scope}'
+SUMS = 'leaderboard:{scope}:sums'
+COUNTS = 'leaderboard:{scope}:counts'
+NAMES = 'leaderboard:names'
+REBUILDING = 'leaderboard:rebuilding'  # Set while a rebuild runs, scores recorded meanwhile are logged
+REPLAY = 'leaderboard:replay'          # '<scope> <user_id> <score> <attempt_id>' entries to apply on the rebuilt boards
+
+SCOPES = ('global', 'subject', 'quiz')
+MAX_LIMIT = 100
+REBUILD_BATCH = 5000
+REBUILD_TIMEOUT = 60 * 60  # Seconds before the flag of a crashed rebuild expires
+
+# Add one score to a user's running average atomically, and log it for the
+# rebuild in progress, if any, which would otherwise overwrite it
+_RECORD_SCRIPT = """
+local total = redis.call('HINCRBYFLOAT', KEYS[2], ARGV[1], ARGV[2])
+local count = redis.call('HINCRBY', KEYS[3], ARGV[1], 1)
+redis.call('ZADD', KEYS[1], tonumber(total) / count, ARGV[1])
+if redis.call('EXISTS', KEYS[4]) == 1 then
+    redis.call('RPUSH', KEYS[5], ARGV[3] .. ' ' .. ARGV[1] .. ' ' .. ARGV[2] .. ' ' .. ARGV[4])
+end
+return count
+"""
+
+# Swap the rebuilt boards in, drop stale ones and hand back the scores recorded
+# during the rebuild, in one step so none is lost in between. KEYS: the flag, the
+# log, the staged then live keys of each of the ARGV[1] rebuilt scopes, then the
+# keys of the stale scopes.
+_SWAP_SCRIPT = """
+local rebuilt = tonumber(ARGV[1])
+for i = 3, 2 + rebuilt * 6, 6 do
+    for j = 0, 2 do
+        redis.call('RENAME', KEYS[i + j], KEYS[i + j + 3])
+    end
+end
+for i = 3 + rebuilt * 6, #KEYS do
+    redis.call('DEL', KEYS[i])
+end
+local entries = redis.call('LRANGE', KEYS[2], 0, -1)
+redis.call('DEL', KEYS[1], KEYS[2])
+return entries
+"""
+
+
+def board_scope(scope, scope_id=None):
+    """Key suffix for a board, e.g. 'global', 'subject:3' or 'quiz:12'"""
+    if scope not in SCOPES:
+        raise ValueError(f"Unknown leaderboard scope: {scope}")
+    if scope == 'global':
+        return 'global'
+    if scope_id is None:
+        raise ValueError(f"Leaderboard scope '{scope}' needs an id")
+    return f"{scope}:{int(scope_id)}"
+
+
+def _keys(scope):
+    return [BOARD.format(scope=scope), SUMS.format(scope=scope), COUNTS.format(scope=scope)]
+
+
+def record_score(user_id, username, quiz_id, subject_id, score, attempt_id):
+    """Fold a new (committed) attempt into the global, subject and quiz boards"""
+    client = get_redis()
+    record = client.register_script(_RECORD_SCRIPT)
+    pipe = client.pipeline()
+    for scope in ('global', f'subject:{subject_id}', f'quiz:{quiz_id}'):
+        record(keys=_keys(scope) + [REBUILDING, REPLAY], args=[user_id, score, scope, attempt_id], client=pipe)
+    pipe.hset(NAMES, user_id, username)
+    pipe.execute()
+
+
+def top(scope, limit=10):
+    """Return the top entries of a board, best first"""
+    client = get_redis()
+    board, _, counts = _keys(scope)
+    entries = client.zrevrange(board, 0, min(limit, MAX_LIMIT) - 1, withscores=True)
+    if not entries:
+        return []
+    user_ids = [user_id for user_id, _ in entries]
+    names = client.hmget(NAMES, user_ids)
+    attempts = client.hmget(counts, user_ids)
+    return [{
+        'rank': position + 1,
+        'user_id': int(user_id),
+        'username': name,
+        'avg_score': round(avg_score, 1),
+        'attempts': int(count or 0)
+    } for position, ((user_id, avg_score), name, count) in enumerate(zip(entries, names, attempts))]
+
+
+def rank_of(scope, user_id):
+    """Return a user's 1-based rank on a board with their average, or None if unranked"""
+    client = get_redis()
+    board, _, counts = _keys(scope)
+    pipe = client.pipeline()
+    pipe.zrevrank(board, user_id)
+    pipe.zscore(board, user_id)
+    pipe.hget(counts, user_id)
+    pipe.zcard(board)
+    rank, avg_score, count, total = pipe.execute()
+    if rank is None:
+        return None
+    return {
+        'rank': rank + 1,
+        'avg_score': round(avg_score, 1),
+        'attempts': int(count or 0),
+        'total_ranked': total
+    }
+
+
+# ------------- Full Rebuild -------------
+def _read_snapshot():
+    """Connection in a read transaction, so every query on it sees the same data
+
+    Under SQLite's default rollback journal, writers wait for it to close; the
+    'concurrent' profile (WAL) lets them commit meanwhile.
+    """
+    conn = db.engine.connect()
+    if conn.dialect.name == 'sqlite':
+        conn.exec_driver_sql('BEGIN')  # pysqlite only opens a transaction before writes
+    else:
+        conn = conn.execution_options(isolation_level='REPEATABLE READ')
+    return conn
+
+
+def _rebuild_rows(conn):
+    """Yield (scope, user_id, score_sum, attempts) for every board from one pass per scope"""
+    score_sum = func.sum(QuizAttempt.score)
+    attempts = func.count(QuizAttempt.id)
+    queries = [
+        (None, select(QuizAttempt.user_id, score_sum, attempts)
+            .group_by(QuizAttempt.user_id)),
+        ('subject', select(Chapter.subject_id, QuizAttempt.user_id, score_sum, attempts)
+            .join(Quiz, QuizAttempt.quiz_id == Quiz.id)
+            .join(Chapter, Quiz.chapter_id == Chapter.id)
+            .group_by(Chapter.subject_id, QuizAttempt.user_id)),
+        ('quiz', select(QuizAttempt.quiz_id, QuizAttempt.user_id, score_sum, attempts)
+            .group_by(QuizAttempt.quiz_id, QuizAttempt.user_id)),
+    ]
+    for scope, query in queries:
+        for row in conn.execute(query.execution_options(yield_per=REBUILD_BATCH)):
+            if scope is None:
+                yield 'global', row[0], row[1], row[2]
+            else:
+                yield f"{scope}:{row[0]}", row[1], row[2], row[3]
+
+
+def _live_scopes(client):
+    return {
+        key[len('leaderboard:'):] for key in client.scan_iter(match=BOARD.format(scope='*'))
+        if key not in (NAMES, REBUILDING, REPLAY) and not key.endswith((':sums', ':counts', ':rebuild'))
+    }
+
+
+def rebuild_leaderboards():
+    """Recompute every board from quiz_attempts and swap them in atomically
+
+    All scopes are read in one transaction, whose last attempt id is the snapshot
+    boundary. Scores recorded meanwhile are logged with their attempt id, and those
+    above the boundary are replayed onto the rebuilt boards after the swap; the rest
+    are in the snapshot already. On PostgreSQL an attempt committed after a higher id
+    than its own may be left out until the next rebuild.
+    """
+    client = get_redis()
+    pipe = client.pipeline()
+    pipe.delete(REPLAY)
+    pipe.set(REBUILDING, 1, ex=REBUILD_TIMEOUT)
+    pipe.execute()
+    staged = []
+    pipe = client.pipeline(transaction=False)
+    pending = 0
+    conn = _read_snapshot()
+    try:
+        boundary = conn.execute(select(func.max(QuizAttempt.id))).scalar() or 0
+        for scope, user_id, score_sum, attempts in _rebuild_rows(conn):
+            if scope not in staged:
+                staged.append(scope)
+                for key in _keys(scope):
+                    pipe.delete(f"{key}:rebuild")
+            board, sums, counts = (f"{key}:rebuild" for key in _keys(scope))
+            pipe.zadd(board, {user_id: score_sum / attempts})
+            pipe.hset(sums, user_id, score_sum)
+            pipe.hset(counts, user_id, attempts)
+            pending += 1
+            if pending >= REBUILD_BATCH:
+                pipe.execute()
+                pending = 0
+    finally:
+        conn.close()
+    pipe.execute()
+
+    # Swap staged boards in and drop boards that no longer have attempts
+    keys = [REBUILDING, REPLAY]
+    for scope in staged:
+        keys += [f"{key}:rebuild" for key in _keys(scope)] + _keys(scope)
+    for scope in _live_scopes(client) - set(staged):
+        keys += _keys(scope)
+    swap = client.register_script(_SWAP_SCRIPT)
+    entries = swap(keys=keys, args=[len(staged)])
+
+    record = client.register_script(_RECORD_SCRIPT)
+    replay = client.pipeline()
+    replayed = 0
+    for entry in entries:
+        scope, user_id, score, attempt_id = entry.split(' ')
+        if int(attempt_id) > boundary:
+            record(keys=_keys(scope) + [REBUILDING, REPLAY], args=[user_id, score, scope, attempt_id], client=replay)
+            replayed += 1
+    replay.execute()
+    if replayed:
+        logger.info(f"Replayed {replayed} scores recorded during the leaderboard rebuild")
+
+    names = client.pipeline(transaction=False)
+    for user_id, username in db.session.query(User.id, User.username).yield_per(REBUILD_BATCH):
+        names.hset(NAMES, user_id, username or '')
+    names.execute()
+    return len(staged)
+
+
+def remove_user(user_id):
+    """Take a deleted user off every board"""
+    client = get_redis()
+    pipe = client.pipeline()
+    for scope in _live_scopes(client):
+        board, sums, counts = _keys(scope)
+        pipe.zrem(board, user_id)
+        pipe.hdel(sums, user_id)
+        pipe.hdel(counts, user_id)
+    pipe.hdel(NAMES, user_id)
+    pipe.execute()
+
+
+def safe_remove_user(user_id):
+    """remove_user that logs instead of failing the caller when Redis is down"""
+    try:
+        remove_user(user_id)
+    except RedisError as e:
+        logger.error(f"Failed to remove user {user_id} from leaderboards: {str(e)}")
+
+
+def safe_record_score(*args):
+    """record_score that logs instead of failing the caller when Redis is down"""
+    try:
+        record_score(*args)
+    except RedisError as e:
+        logger.error(f"Failed to update leaderboards: {str(e)}")
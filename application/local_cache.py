@@ -0,0 +1,47 @@
+from collections import OrderedDict
+import threading
+import time
+
+
+class LocalCache:
+    """Thread-safe in-process LRU cache with a size bound and per-entry expiry"""
+
+    def __init__(self, max_entries=1024, timeout=10):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def get_many(self, *keys):
+        return [self.get(key) for key in keys]
+
+    def set(self, key, value, timeout=None):
+        expires_at = time.monotonic() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -1,212 +1,327 @@
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
 import smtplib
-from flask import current_app, render_template_string
+from flask import current_app
+from functools import lru_cache
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup
 import logging
+import os
+import queue
+import threading
+import time
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+class _DataTracking:
+    """Records whether DATA was issued, after which the server may already hold the message"""
+    data_sent = False
+
+    def data(self, msg):
+        self.data_sent = True
+        return super().data(msg)
+
+class _SMTP(_DataTracking, smtplib.SMTP):
+    pass
+
+class _SMTP_SSL(_DataTracking, smtplib.SMTP_SSL):
+    pass
+
+class SMTPPool:
+    """Pool of kept-alive SMTP connections to one server"""
+
+    def __init__(self, host, port, size=4, keepalive=60, use_ssl=False, use_tls=False,
+                 username=None, password=None, timeout=30):
+        self.host = host
+        self.port = port
+        self.size = size
+        self.keepalive = keepalive
+        self.use_ssl = use_ssl
+        self.use_tls = use_tls
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._stats = {
+            'sent': 0,
+            'failed': 0,
+            'connections_opened': 0,
+            'reconnects': 0,
+            'send_seconds': 0.0
+        }
+
+    def _connect(self):
+        smtp_class = _SMTP_SSL if self.use_ssl else _SMTP
+        smtp = smtp_class(self.host, self.port, timeout=self.timeout)
+        if self.use_tls and not self.use_ssl:
+            smtp.starttls()
+        if self.username:
+            smtp.login(self.username, self.password)
+        self._count('connections_opened')
+        return smtp
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def acquire(self):
+        """Take an idle connection (checked with NOOP if it sat too long) or open a new one"""
+        self._slots.acquire()
+        try:
+            while True:
+                try:
+                    smtp, last_used = self._idle.get_nowait()
+                except queue.Empty:
+                    return self._connect()
+                if time.monotonic() - last_used < self.keepalive:
+                    return smtp
+                try:
+                    if smtp.noop()[0] == 250:
+                        return smtp
+                except (smtplib.SMTPException, OSError):
+                    pass
+                self._close(smtp)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, smtp, broken=False):
+        """Return a connection to the pool, or close it if it failed"""
+        if broken:
+            self._close(smtp)
+        else:
+            self._idle.put((smtp, time.monotonic()))
+        self._slots.release()
+
+    def _close(self, smtp):
+        try:
+            smtp.quit()
+        except Exception:
+            smtp.close()
+
+    def _send_on(self, smtp, msg):
+        """Send one message, reconnecting once if the server dropped the connection
+
+        Only failures before DATA are retried: past it the server may have accepted
+        the message, and a resend would deliver it twice. If reconnecting or the
+        resend fails, the new connection is closed and the error is raised as a
+        disconnect, so the caller drops the closed one it holds instead of pooling it.
+        """
+        smtp.data_sent = False
+        try:
+            smtp.send_message(msg)
+            return smtp
+        except (smtplib.SMTPServerDisconnected, ConnectionError):
+            if smtp.data_sent:
+                raise
+            self._count('reconnects')
+            self._close(smtp)
+        retry = None
+        try:
+            retry = self._connect()
+            retry.send_message(msg)
+            return retry
+        except (smtplib.SMTPException, OSError) as e:
+            if retry is not None:
+                self._close(retry)
+            raise smtplib.SMTPServerDisconnected(f"Resend after reconnecting failed: {str(e)}") from e
+
+    def send_many(self, messages):
+        """Send messages over a single pooled connection, returns one bool per message"""
+        results = []
+        smtp = self.acquire()
+        healthy = True
+        try:
+            for msg in messages:
+                start = time.perf_counter()
+                try:
+                    smtp = self._send_on(smtp, msg)
+                    healthy = True
+                    self._count('sent')
+                    results.append(True)
+                except (smtplib.SMTPException, OSError) as e:
+                    logger.error(f"Failed to send email to {msg['To']}: {str(e)}")
+                    # Refused recipients leave the session usable, dropped connections do not
+                    healthy = not isinstance(e, (smtplib.SMTPServerDisconnected, OSError))
+                    self._count('failed')
+                    results.append(False)
+                finally:
+                    self._count('send_seconds', time.perf_counter() - start)
+        finally:
+            self.release(smtp, broken=not healthy)
+        return results
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats['messages_per_second'] = round(stats['sent'] / stats['send_seconds'], 1) if stats['send_seconds'] else 0
+        stats['idle_connections'] = self._idle.qsize()
+        return stats
+
+    def close(self):
+        while True:
+            try:
+                smtp, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._close(smtp)
+
+_pools = {}
+_pools_lock = threading.Lock()
+
 class EmailService:
+    @staticmethod
+    def get_pool():
+        """Return this process's SMTP pool for the configured mail server"""
+        config = current_app.config
+        # Get mail settings with defaults for MailHog
+        key = (config.get('MAIL_SERVER', 'localhost'), config.get('MAIL_PORT', 1025))
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = SMTPPool(
+                    *key,
+                    size=config.get('MAIL_POOL_SIZE', 4),
+                    keepalive=config.get('MAIL_KEEPALIVE', 60),
+                    use_ssl=config.get('MAIL_USE_SSL', False),
+                    use_tls=config.get('MAIL_USE_TLS', False),
+                    username=config.get('MAIL_USERNAME'),
+                    password=config.get('MAIL_PASSWORD')
+                )
+        return pool
+
+    @staticmethod
+    def build_message(to_email, subject, html_content, text_content=None):
+        """Build a multipart email with optional plain text alternative"""
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = current_app.config['MAIL_DEFAULT_SENDER']
+        msg['To'] = to_email
+
+        if text_content:
+            msg.attach(MIMEText(text_content, 'plain'))
+        msg.attach(MIMEText(html_content, 'html'))
+        return msg
+
     @staticmethod
     def send_email(to_email, subject, html_content, text_content=None):
-        """Send email using SMTP"""
+        """Send email over a pooled SMTP connection"""
+        return EmailService.send_bulk([(to_email, subject, html_content, text_content)])[0]
+
+    @staticmethod
+    def send_bulk(messages):
+        """Send many (to_email, subject, html_content, text_content) messages over one connection
+
+        Returns a list of booleans, one per message.
+        """
         try:
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = subject
-            msg['From'] = current_app.config['MAIL_DEFAULT_SENDER']
-            msg['To'] = to_email
-
-            if text_content:
-                msg.attach(MIMEText(text_content, 'plain'))
-            msg.attach(MIMEText(html_content, 'html'))
-
-            # Get mail settings with defaults for MailHog
-            mail_server = current_app.config.get('MAIL_SERVER', 'localhost')
-            mail_port = current_app.config.get('MAIL_PORT', 1025)
-            
-            print(f"Attempting to connect to SMTP server: {mail_server}:{mail_port}")
-
-            # Connect to MailHog SMTP server
-            with smtplib.SMTP(mail_server, mail_port) as smtp:
-                # MailHog doesn't require authentication
-                print(f"Connected to SMTP server, sending email to {to_email}")
-                smtp.send_message(msg)
-                print(f"Email sent successfully to {to_email}")
-                logger.info(f"Email sent to {to_email} via MailHog")
-                return True
-                
+            built = [EmailService.build_message(*message) for message in messages]
+            results = EmailService.get_pool().send_many(built)
+            logger.info(f"Sent {sum(results)}/{len(results)} emails via SMTP pool")
+            return results
         except Exception as e:
             print(f"Failed to send email: {str(e)}")
             logger.error(f"Failed to send email via MailHog: {str(e)}")
-            return False
+            return [False] * len(messages)
+
+    @staticmethod
+    def metrics():
+        """Throughput counters for every SMTP pool in this process"""
+        with _pools_lock:
+            return {f"{host}:{port}": pool.stats() for (host, port), pool in _pools.items()}
 
     @staticmethod
     def send_reminder(user_email, username):
         """Send reminder email with better formatting"""
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <h2 style="color: #2c3e50; border-bottom: 2px solid #3498db;">Quiz Activity Reminder</h2>
-                    <p>Hello {username},</p>
-                    <p>We noticed you haven't taken any quizzes recently. Stay on track with your learning journey!</p>
-                    <div style="background-color: #f8f9fa; padding: 15px; border-radius: 5px; margin: 20px 0;">
-                        <p style="margin: 0;">🎯 <strong>Quick Tips:</strong></p>
-                        <ul>
-                            <li>Set aside 30 minutes daily for quizzes</li>
-                            <li>Try different subjects to maintain variety</li>
-                            <li>Track your progress regularly</li>
-                        </ul>
-                    </div>
-                    <p style="background-color: #e8f4fd; padding: 10px; border-radius: 5px;">
-                        Ready to get back to learning? Login now to explore new quizzes!
-                    </p>
-                    <p style="font-size: 0.9em; color: #666; margin-top: 30px;">
-                        Best regards,<br>
-                        Quiz Master Team
-                    </p>
-                </div>
-            </body>
-        </html>
-        """
-        plain_text = f"""
-        Quiz Activity Reminder
-
-        Hello {username},
-
-        We noticed you haven't taken any quizzes recently. Stay on track with your learning journey!
-
-        Quick Tips:
-        * Set aside 30 minutes daily for quizzes
-        * Try different subjects to maintain variety
-        * Track your progress regularly
+        html_content, text_content = render_email('reminder', 'Quiz Activity Reminder', username=username)
+        return EmailService.send_email(user_email, "Quiz Activity Reminder", html_content, text_content)
 
-        Ready to get back to learning? Login now to explore new quizzes!
-
-        Best regards,
-        Quiz Master Team
-        """
-        return EmailService.send_email(user_email, "Quiz Activity Reminder", html_content, plain_text)
+    @staticmethod
+    def send_reminders(recipients):
+        """Send reminders to many (email, username) pairs in batches, returns one bool per recipient"""
+        return EmailService._send_batched(
+            'reminder', 'Quiz Activity Reminder',
+            ((email, {'username': username}) for email, username in recipients)
+        )
 
     @staticmethod
     def send_report(user_email, username, report_data):
         """Send enhanced performance report email"""
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <h2 style="color: #2c3e50; border-bottom: 2px solid #3498db;">Monthly Performance Report</h2>
-                    <p>Hello {username},</p>
-                    <p>Here's your learning progress for the past month:</p>
-                    
-                    <div style="background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin: 20px 0;">
-                        <h3 style="color: #2c3e50; margin-top: 0;">Your Statistics</h3>
-                        <table style="width: 100%; border-collapse: collapse;">
-                            <tr>
-                                <td style="padding: 10px; border-bottom: 1px solid #dee2e6;">
-                                    <strong>Quizzes Completed:</strong>
-                                </td>
-                                <td style="padding: 10px; border-bottom: 1px solid #dee2e6;">
-                                    {report_data['total_quizzes']}
-                                </td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 10px; border-bottom: 1px solid #dee2e6;">
-                                    <strong>Average Score:</strong>
-                                </td>
-                                <td style="padding: 10px; border-bottom: 1px solid #dee2e6;">
-                                    {report_data['avg_score']}%
-                                </td>
-                            </tr>
-                            <tr>
-                                <td style="padding: 10px;">
-                                    <strong>Total Time Invested:</strong>
-                                </td>
-                                <td style="padding: 10px;">
-                                    {report_data['total_time']} minutes
-                                </td>
-                            </tr>
-                        </table>
-                    </div>
-                    
-                    <div style="background-color: #e8f4fd; padding: 15px; border-radius: 5px;">
-                        <p style="margin: 0;">
-                            <strong>💡 Pro Tip:</strong> Regular practice leads to better retention. 
-                            Try to attempt at least one quiz every day!
-                        </p>
-                    </div>
-
-                    <p style="font-size: 0.9em; color: #666; margin-top: 30px;">
-                        Keep up the great work!<br>
-                        Quiz Master Team
-                    </p>
-                    <p style="font-size: 0.8em; color: #999;">
-                        Report generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}
-                    </p>
-                </div>
-            </body>
-        </html>
-        """
-        plain_text = f"""
-        Monthly Performance Report
-
-        Hello {username},
-
-        Here's your learning progress for the past month:
-
-        Your Statistics:
-        - Quizzes Completed: {report_data['total_quizzes']}
-        - Average Score: {report_data['avg_score']}%
-        - Total Time Invested: {report_data['total_time']} minutes
+        html_content, text_content = render_email(
+            'report', 'Monthly Performance Report',
+            username=username, report=report_data, generated_on=datetime.now().strftime('%Y-%m-%d %H:%M')
+        )
+        return EmailService.send_email(user_email, "Monthly Performance Report", html_content, text_content)
 
-        Pro Tip: Regular practice leads to better retention. Try to attempt at least one quiz every day!
-
-        Keep up the great work!
-        Quiz Master Team
-
-        Report generated on: {datetime.now().strftime('%Y-%m-%d %H:%M')}
-        """
-        return EmailService.send_email(user_email, "Monthly Performance Report", html_content, plain_text)
+    @staticmethod
+    def send_reports(recipients):
+        """Send reports to many (email, username, report_data) rows in batches, returns one bool per recipient"""
+        generated_on = datetime.now().strftime('%Y-%m-%d %H:%M')
+        return EmailService._send_batched(
+            'report', 'Monthly Performance Report',
+            ((email, {'username': username, 'report': report_data, 'generated_on': generated_on})
+             for email, username, report_data in recipients)
+        )
 
     @staticmethod
     def send_quiz_completion(user_email, username, quiz_data):
         """Send quiz completion notification"""
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <h2 style="color: #2c3e50; border-bottom: 2px solid #3498db;">Quiz Completed!</h2>
-                    <p>Well done, {username}!</p>
-                    
-                    <div style="background-color: #f8f9fa; padding: 20px; border-radius: 5px; margin: 20px 0;">
-                        <h3 style="color: #2c3e50; margin-top: 0;">Quiz Results</h3>
-                        <p><strong>Quiz:</strong> {quiz_data['title']}</p>
-                        <p><strong>Score:</strong> {quiz_data['score']}%</p>
-                        <p><strong>Time Taken:</strong> {quiz_data['time_taken']} minutes</p>
-                        <p><strong>Correct Answers:</strong> {quiz_data['correct_answers']}/{quiz_data['total_questions']}</p>
-                    </div>
-
-                    <p style="background-color: #e8f4fd; padding: 10px; border-radius: 5px;">
-                        View your detailed results and performance analytics on the dashboard.
-                    </p>
-                </div>
-            </body>
-        </html>
-        """
-        plain_text = f"""
-        Quiz Completed!
+        html_content, text_content = render_email('quiz_completion', 'Quiz Completed!',
+                                                  username=username, quiz=quiz_data)
+        return EmailService.send_email(user_email, "Quiz Completed!", html_content, text_content)
+
+    @staticmethod
+    def _send_batched(template_name, subject, recipients):
+        """Render and send (email, context) pairs, one pooled connection per batch"""
+        results = []
+        batch_size = current_app.config.get('MAIL_BATCH_SIZE', 100)
+        batch = []
+        for message in render_emails(template_name, subject, recipients):
+            batch.append(message)
+            if len(batch) == batch_size:
+                results.extend(EmailService.send_bulk(batch))
+                batch = []
+        if batch:
+            results.extend(EmailService.send_bulk(batch))
+        return results
 
-        Well done, {username}!
 
-        Quiz Results:
-        - Quiz: {quiz_data['title']}
-        - Score: {quiz_data['score']}%
-        - Time Taken: {quiz_data['time_taken']} minutes
-        - Correct Answers: {quiz_data['correct_answers']}/{quiz_data['total_questions']}
+# ------------- Email Templates -------------
+# Templates are compiled once per process (no auto-reload), and the shared layout
+# is rendered once per title and split around the body.
+EMAIL_TEMPLATES_DIR = os.path.join(os.path.dirname(__file__), 'templates', 'emails')
+_CONTENT_MARKER = '<!-- email-content -->'
 
-        View your detailed results and performance analytics on the dashboard.
-        """
-        return EmailService.send_email(user_email, "Quiz Completed!", html_content, plain_text)
+@lru_cache(maxsize=None)
+def email_env():
+    return Environment(
+        loader=FileSystemLoader(EMAIL_TEMPLATES_DIR),
+        autoescape=select_autoescape(['html']),
+        auto_reload=False
+    )
+
+@lru_cache(maxsize=None)
+def _layout(title):
+    """Pre-rendered (head, tail) of the email layout for a title"""
+    html = email_env().get_template('layout.html').render(title=title, content=Markup(_CONTENT_MARKER))
+    head, tail = html.split(_CONTENT_MARKER)
+    return head, tail
 
+def render_email(template_name, title, **context):
+    """Render the (html, text) bodies of one email"""
+    env = email_env()
+    head, tail = _layout(title)
+    html = head + env.get_template(f'{template_name}.html').render(context) + tail
+    return html, env.get_template(f'{template_name}.txt').render(context)
 
+def render_emails(template_name, subject, recipients):
+    """Yield (email, subject, html, text) for each (email, context) pair"""
+    env = email_env()
+    head, tail = _layout(subject)
+    html_template = env.get_template(f'{template_name}.html')
+    text_template = env.get_template(f'{template_name}.txt')
+    for email, context in recipients:
+        yield email, subject, head + html_template.render(context) + tail, text_template.render(context)
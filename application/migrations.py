@@ -0,0 +1,95 @@
+from sqlalchemy import inspect, text
+from datetime import datetime
+from .models import db
+import logging
+
+logger = logging.getLogger(__name__)
+
+# ------------- Schema Migrations -------------
+# db.create_all() only creates missing tables, so changes to existing tables
+# (new indexes, new columns) are applied here, in order, exactly once per database.
+MIGRATIONS = []
+
+
+def migration(version, description):
+    """Register a migration function under a schema version"""
+    def decorator(func):
+        MIGRATIONS.append((version, description, func))
+        return func
+    return decorator
+
+
+def create_indexes(conn, *table_names):
+    """Create the indexes declared on the models for the given tables if missing
+
+    Indexes on columns a later migration adds are left for that migration to create.
+    """
+    for table_name in table_names:
+        existing = {c['name'] for c in inspect(conn).get_columns(table_name)}
+        for index in db.metadata.tables[table_name].indexes:
+            if all(column.name in existing for column in index.columns):
+                index.create(conn, checkfirst=True)
+
+
+def add_column(conn, table_name, column_ddl):
+    """Add a column to an existing table unless it is already there"""
+    column_name = column_ddl.split()[0]
+    existing = {c['name'] for c in inspect(conn).get_columns(table_name)}
+    if column_name not in existing:
+        conn.execute(text(f'ALTER TABLE {table_name} ADD COLUMN {column_ddl}'))
+
+
+@migration(1, 'Indexes for hot quiz attempt and catalog query paths')
+def _hot_path_indexes(conn):
+    create_indexes(conn, 'quiz_attempts', 'questions', 'quizzes', 'chapters')
+
+
+@migration(2, 'Backfill daily report rollups from existing attempts')
+def _backfill_rollups(conn):
+    from .rollups import rebuild_rollups
+    rebuild_rollups(conn)
+
+
+@migration(3, 'Denormalized chapter, quiz and question counters')
+def _catalog_counters(conn):
+    from .counters import recount_counters
+    add_column(conn, 'subjects', 'chapters_count INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'chapters', 'quizzes_count INTEGER NOT NULL DEFAULT 0')
+    add_column(conn, 'quizzes', 'questions_count INTEGER NOT NULL DEFAULT 0')
+    recount_counters(conn)
+
+
+@migration(4, 'Submission ids for queued quiz submissions')
+def _submission_ids(conn):
+    add_column(conn, 'quiz_attempts', 'submission_id VARCHAR(32)')
+    create_indexes(conn, 'quiz_attempts')
+
+
+@migration(5, 'Answer key versions kept with the quiz')
+def _answer_key_versions(conn):
+    add_column(conn, 'quizzes', 'answer_key_version INTEGER NOT NULL DEFAULT 0')
+
+
+def run_migrations():
+    """Apply all pending migrations, returns the list of versions applied"""
+    applied = []
+    with db.engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, description VARCHAR(255), applied_at DATETIME)'
+        ))
+        done = {row[0] for row in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+    for version, description, func in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in done:
+            continue
+        with db.engine.begin() as conn:
+            func(conn)
+            conn.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) '
+                     'VALUES (:version, :description, :applied_at)'),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()}
+            )
+        logger.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
@@ -2,8 +2,9 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_security import UserMixin, RoleMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from .routing import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 # ------- User Management Models -------
 class RolesUsers(db.Model):
@@ -45,16 +46,18 @@ class Subject(db.Model):
     name = db.Column(db.String(100), nullable=False, unique=True)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    chapters_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Kept by application.counters
     chapters = db.relationship('Chapter', backref='subject', lazy=True, cascade='all, delete-orphan')
 
 class Chapter(db.Model):
     """Chapter Model With Quiz Relationships"""
     __tablename__ = 'chapters'
     id = db.Column(db.Integer, primary_key=True)
-    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), nullable=False)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), nullable=False, index=True)
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    quizzes_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Kept by application.counters
     quizzes = db.relationship('Quiz', backref='chapter', lazy=True, cascade='all, delete-orphan')
 
 # ------- Quiz Management Models -------
@@ -62,13 +65,15 @@ class Quiz(db.Model):
     """Quiz Model With Questions And Attempts"""
     __tablename__ = 'quizzes'
     id = db.Column(db.Integer, primary_key=True)
-    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False)
+    chapter_id = db.Column(db.Integer, db.ForeignKey('chapters.id'), nullable=False, index=True)
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text)
     duration = db.Column(db.Integer, nullable=False)  # duration in minutes
     start_time = db.Column(db.DateTime)  # New field for scheduled start
     end_time = db.Column(db.DateTime)    # New field for scheduled end
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    questions_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Kept by application.counters
+    answer_key_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # Bumped by application.answer_keys
     questions = db.relationship('Question', backref='quiz', lazy=True, cascade='all, delete-orphan')
     attempts = db.relationship('QuizAttempt', backref='quiz', lazy=True)
 
@@ -97,7 +102,7 @@ class Quiz(db.Model):
 class Question(db.Model):
     __tablename__ = 'questions'
     id = db.Column(db.Integer, primary_key=True)
-    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False, index=True)
     question_text = db.Column(db.Text, nullable=False)
     options = db.Column(db.JSON, nullable=False)  # Store options as JSON array
     correct_answer = db.Column(db.Integer, nullable=False)  # Index of correct option
@@ -105,6 +110,16 @@ class Question(db.Model):
 
 class QuizAttempt(db.Model):
     __tablename__ = 'quiz_attempts'
+    __table_args__ = (
+        # Student history/stats and reminder queries filter by user and sort by date
+        db.Index('ix_quiz_attempts_user_date', 'user_id', 'date_created'),
+        # Per-quiz reports and deletes filter by quiz, optionally by date
+        db.Index('ix_quiz_attempts_quiz_date', 'quiz_id', 'date_created'),
+        # Report time windows filter by date alone
+        db.Index('ix_quiz_attempts_date', 'date_created'),
+        # The ingest writer skips submissions already stored when it replays a batch
+        db.Index('ix_quiz_attempts_submission', 'submission_id', unique=True),
+    )
     id = db.Column(db.Integer, primary_key=True)
     quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user_table.id'), nullable=False)
@@ -114,6 +129,7 @@ class QuizAttempt(db.Model):
     completed_at = db.Column(db.DateTime)
     answers = db.Column(db.JSON)  # Store user answers as JSON
     response_sheet = db.Column(db.JSON)  # Store detailed response data
+    submission_id = db.Column(db.String(32))  # Set for attempts written by the ingest queue, unique
 
     @property
     def duration(self):
@@ -123,3 +139,36 @@ class QuizAttempt(db.Model):
             return round(delta.total_seconds() / 60, 1)
         return None
 
+
+# ------- Reporting Rollup Models -------
+class QuizDailyStat(db.Model):
+    """Per Quiz Per Day Attempt Totals For Admin Reports"""
+    __tablename__ = 'quiz_daily_stats'
+    __table_args__ = (db.Index('ix_quiz_daily_stats_day', 'day'),)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    pass_count = db.Column(db.Integer, nullable=False, default=0)
+
+class SubjectDailyStat(db.Model):
+    """Per Subject Per Day Attempt Totals For Admin Reports"""
+    __tablename__ = 'subject_daily_stats'
+    __table_args__ = (db.Index('ix_subject_daily_stats_day', 'day'),)
+    subject_id = db.Column(db.Integer, db.ForeignKey('subjects.id'), primary_key=True)
+    day = db.Column(db.Date, primary_key=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    score_sum = db.Column(db.Float, nullable=False, default=0.0)
+    pass_count = db.Column(db.Integer, nullable=False, default=0)
+
+# ------- Analytics Models -------
+class AttemptAnswer(db.Model):
+    """Append-Only Per Question Answer Facts For Item Analysis"""
+    __tablename__ = 'attempt_answers'
+    __table_args__ = (db.Index('ix_attempt_answers_quiz_question', 'quiz_id', 'question_id'),)
+    attempt_id = db.Column(db.Integer, db.ForeignKey('quiz_attempts.id'), primary_key=True)
+    question_id = db.Column(db.Integer, db.ForeignKey('questions.id'), primary_key=True)
+    quiz_id = db.Column(db.Integer, db.ForeignKey('quizzes.id'), nullable=False)
+    chosen_option = db.Column(db.Integer)  # Index of the chosen option, NULL if unanswered
+    is_correct = db.Column(db.Boolean, nullable=False, default=False)
+    marks = db.Column(db.Integer, nullable=False, default=0)  # Marks awarded
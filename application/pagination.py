@@ -0,0 +1,63 @@
+from flask import request
+from datetime import datetime
+import base64
+import json
+
+
+class PageArgumentError(ValueError):
+    """Invalid cursor, limit or fields parameter"""
+
+
+# ------------- Keyset Cursors -------------
+# A cursor is the sort key of the last row served, so the next page is a range
+# scan from that key rather than an OFFSET that re-reads every earlier row.
+def encode_cursor(*values):
+    raw = json.dumps(values, separators=(',', ':'), default=str).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _cursor_value(value, kind):
+    """A cursor value as kind (int or datetime), raises PageArgumentError for any other shape"""
+    if kind is int and isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if kind is datetime and isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    raise PageArgumentError('Invalid cursor')
+
+
+def decode_cursor(cursor, *kinds):
+    """Values stored in a cursor converted to kinds, e.g. decode_cursor(cursor, datetime, int)
+
+    Raises PageArgumentError unless the cursor holds one value of each kind.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise PageArgumentError('Invalid cursor')
+    if not isinstance(values, list) or len(values) != len(kinds):
+        raise PageArgumentError('Invalid cursor')
+    return [_cursor_value(value, kind) for value, kind in zip(values, kinds)]
+
+
+def page_limit(default, maximum):
+    """The limit query argument, clamped to 1..maximum"""
+    try:
+        limit = int(request.args.get('limit', default))
+    except ValueError:
+        raise PageArgumentError('limit must be an integer')
+    return max(1, min(limit, maximum))
+
+
+def selected_fields(available):
+    """Fields named in the fields query argument (all of `available` when absent)"""
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+    selected = [field.strip() for field in fields.split(',') if field.strip()]
+    unknown = set(selected) - set(available)
+    if unknown:
+        raise PageArgumentError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return selected
@@ -0,0 +1,33 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from .models import db
+
+# ------------- Query Budgets -------------
+# Most SQL statements a single request may issue, including Flask-Security's
+# user and role lookups. List endpoints must stay flat as the catalog grows.
+QUERY_BUDGETS = [
+    ('admin', '/api/subjects', 3),
+    ('admin', '/api/subjects/{subject_id}/chapters', 3),
+    ('admin', '/api/chapters/{chapter_id}/quizzes', 3),
+    ('stud', '/api/student/available-quizzes', 3),
+    ('stud', '/api/student/all-quizzes', 3),
+    ('stud', '/api/student/stats', 6),  # Aggregates on a cache miss; the identity cache spares the user and role lookups
+]
+
+
+@contextmanager
+def count_queries():
+    """Collect the SQL statements executed on the app's engines (primary and replica) inside the block"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        for engine in engines:
+            event.remove(engine, 'before_cursor_execute', before_cursor_execute)
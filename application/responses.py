@@ -0,0 +1,162 @@
+from flask import current_app, request, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+import gzip
+import os
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the stdlib encoder is used without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is offered without it
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json', 'text/html', 'text/css', 'text/plain', 'text/csv',
+    'application/javascript', 'text/javascript', 'image/svg+xml'
+}
+# Encodings in order of preference, with the file suffix of pre-compressed static assets
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')] if brotli else [('gzip', '.gz')]
+
+
+# ------------- JSON Encoding -------------
+class FastJSONProvider(DefaultJSONProvider):
+    """jsonify through orjson when it is installed
+
+    Output matches the stdlib provider: sorted keys, and dates, decimals and anything
+    else orjson does not know go through the same default() hook.
+    """
+
+    def _encode(self, obj, pretty=False):
+        """orjson bytes for obj, None when orjson is missing or cannot encode it"""
+        if orjson is None:
+            return None
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if pretty:
+            options |= orjson.OPT_INDENT_2
+        try:
+            return orjson.dumps(obj, default=self.default, option=options)
+        except (orjson.JSONEncodeError, TypeError):  # e.g. integers wider than 64 bits
+            return None
+
+    def dumps(self, obj, **kwargs):
+        encoded = None if kwargs else self._encode(obj)
+        if encoded is None:
+            return super().dumps(obj, **kwargs)
+        return encoded.decode()
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        pretty = (self.compact is None and self._app.debug) or self.compact is False
+        encoded = self._encode(obj, pretty)
+        if encoded is None:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(encoded + b'\n', mimetype=self.mimetype)
+
+
+# ------------- Compression -------------
+def _negotiate(response):
+    """(encoding, suffix) the client prefers for this response, or None"""
+    if response.headers.get('Content-Encoding'):
+        return None
+    best = request.accept_encodings.best_match([encoding for encoding, _ in ENCODINGS])
+    return next((pair for pair in ENCODINGS if pair[0] == best), None)
+
+
+def _precompressed(response, encoding, suffix):
+    """The .gz/.br sibling of a static file when one at least as new exists"""
+    filename = request.view_args.get('filename') if request.view_args else None
+    if not filename:
+        return None
+    source = os.path.join(current_app.static_folder, filename)
+    compressed = source + suffix
+    try:
+        if os.path.getmtime(compressed) < os.path.getmtime(source):
+            return None
+    except OSError:
+        return None
+    alternative = send_from_directory(current_app.static_folder, filename + suffix, mimetype=response.mimetype)
+    alternative.headers['Content-Encoding'] = encoding
+    alternative.vary.add('Accept-Encoding')
+    response.close()
+    return alternative
+
+
+def _compress(data, encoding):
+    config = current_app.config
+    if encoding == 'br':
+        return brotli.compress(data, quality=config['COMPRESS_BROTLI_QUALITY'])
+    return gzip.compress(data, compresslevel=config['COMPRESS_LEVEL'], mtime=0)
+
+
+def compress_response(response):
+    """after_request hook: compress bodies above COMPRESS_MIN_SIZE when the client accepts it
+
+    Static files are swapped for their pre-compressed copies (manage_db.py compress-static)
+    instead of being compressed per request.
+    """
+    if response.status_code != 200 or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    negotiated = _negotiate(response)
+    if negotiated is None:
+        return response
+    encoding, suffix = negotiated
+
+    if response.direct_passthrough or response.is_streamed:
+        if request.endpoint == 'static':
+            return _precompressed(response, encoding, suffix) or response
+        return response
+
+    data = response.get_data()
+    if len(data) < current_app.config['COMPRESS_MIN_SIZE']:
+        return response
+    response.set_data(_compress(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:  # The body changed, so a strong validator no longer holds
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_responses(app):
+    """Install the JSON provider and compression hook, before Flask-Security extends the provider"""
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
+    app.after_request(compress_response)
+
+
+# ------------- Pre-compressed Static Assets -------------
+def precompress_static(folder, min_size=1024):
+    """Write .gz (and .br with brotli) copies of compressible files under folder
+
+    Files smaller than min_size or already up to date are skipped, and a copy that
+    would not be smaller is not written. Returns the number of files written.
+    """
+    extensions = ('.js', '.css', '.html', '.svg', '.json', '.txt')
+    written = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if not name.endswith(extensions):
+                continue
+            source = os.path.join(root, name)
+            if os.path.getsize(source) < min_size:
+                continue
+            with open(source, 'rb') as f:
+                data = f.read()
+            for encoding, suffix in ENCODINGS:
+                target = source + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                    continue
+                compressed = brotli.compress(data, quality=11) if encoding == 'br' \
+                    else gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) >= len(data):
+                    continue
+                with open(target, 'wb') as f:
+                    f.write(compressed)
+                written += 1
+    return written
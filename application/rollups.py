@@ -0,0 +1,90 @@
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from .models import db, Quiz, Chapter, QuizAttempt, QuizDailyStat, SubjectDailyStat
+
+PASS_MARK = 40  # Score percentage counted as a pass in reports
+
+COUNTERS = ('attempts', 'score_sum', 'pass_count')
+
+
+def _apply(model, keys, deltas):
+    """Add deltas to a rollup row inside the current session transaction, creating it if needed"""
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert_fn = sqlite_insert if dialect == 'sqlite' else pg_insert
+        stmt = insert_fn(model).values(**keys, **deltas)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=list(keys),
+            set_={name: getattr(model, name) + getattr(stmt.excluded, name) for name in COUNTERS}
+        )
+        db.session.execute(stmt)
+        return
+
+    result = db.session.execute(
+        update(model)
+        .filter_by(**keys)
+        .values({name: getattr(model, name) + deltas[name] for name in COUNTERS})
+    )
+    if result.rowcount == 0:
+        db.session.execute(insert(model).values(**keys, **deltas))
+
+
+def record_attempt(quiz_id, subject_id, day, score):
+    """Count one attempt in the quiz and subject rollups for its day"""
+    deltas = {'attempts': 1, 'score_sum': score, 'pass_count': int(score >= PASS_MARK)}
+    _apply(QuizDailyStat, {'quiz_id': quiz_id, 'day': day}, deltas)
+    _apply(SubjectDailyStat, {'subject_id': subject_id, 'day': day}, deltas)
+
+
+def record_attempts(attempts):
+    """Count (quiz_id, subject_id, day, score) attempts, one rollup update per quiz and subject day"""
+    quiz_deltas, subject_deltas = {}, {}
+    for quiz_id, subject_id, day, score in attempts:
+        for totals, keys in ((quiz_deltas, ('quiz_id', quiz_id, day)), (subject_deltas, ('subject_id', subject_id, day))):
+            deltas = totals.setdefault(keys, dict.fromkeys(COUNTERS, 0))
+            deltas['attempts'] += 1
+            deltas['score_sum'] += score
+            deltas['pass_count'] += int(score >= PASS_MARK)
+    for model, totals in ((QuizDailyStat, quiz_deltas), (SubjectDailyStat, subject_deltas)):
+        for (key, key_id, day), deltas in totals.items():
+            _apply(model, {key: key_id, 'day': day}, deltas)
+
+
+def remove_quiz(quiz_id, subject_id):
+    """Drop a quiz's rollup rows and take its totals out of the subject rollup"""
+    rows = QuizDailyStat.query.filter_by(quiz_id=quiz_id).all()
+    for row in rows:
+        _apply(SubjectDailyStat, {'subject_id': subject_id, 'day': row.day},
+               {name: -getattr(row, name) for name in COUNTERS})
+    QuizDailyStat.query.filter_by(quiz_id=quiz_id).delete()
+
+
+def rebuild_rollups(conn=None):
+    """Recompute every rollup row from quiz_attempts, returns (quiz_rows, subject_rows)
+
+    Runs on the given connection (inside a migration) or on the session, which it commits.
+    """
+    executor = conn if conn is not None else db.session
+    day = func.date(QuizAttempt.date_created)
+    passed = func.sum(case((QuizAttempt.score >= PASS_MARK, 1), else_=0))
+
+    executor.execute(delete(QuizDailyStat))
+    executor.execute(delete(SubjectDailyStat))
+
+    executor.execute(insert(QuizDailyStat).from_select(
+        ['quiz_id', 'day', 'attempts', 'score_sum', 'pass_count'],
+        select(QuizAttempt.quiz_id, day, func.count(QuizAttempt.id), func.sum(QuizAttempt.score), passed)
+        .group_by(QuizAttempt.quiz_id, day)
+    ))
+    executor.execute(insert(SubjectDailyStat).from_select(
+        ['subject_id', 'day', 'attempts', 'score_sum', 'pass_count'],
+        select(Chapter.subject_id, day, func.count(QuizAttempt.id), func.sum(QuizAttempt.score), passed)
+        .join(Quiz, QuizAttempt.quiz_id == Quiz.id)
+        .join(Chapter, Quiz.chapter_id == Chapter.id)
+        .group_by(Chapter.subject_id, day)
+    ))
+    if conn is None:
+        db.session.commit()
+    return (executor.execute(select(func.count()).select_from(QuizDailyStat)).scalar(),
+            executor.execute(select(func.count()).select_from(SubjectDailyStat)).scalar())
@@ -0,0 +1,117 @@
+from flask import current_app, g, has_request_context, session
+from flask_security import current_user
+from flask_sqlalchemy.session import Session
+from .instance import generation_time, get_redis, tag_generations
+from redis.exceptions import RedisError
+from sqlalchemy import Select
+import functools
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+REPLICA_BIND = 'replica'             # SQLALCHEMY_BINDS key of the read-only database
+SYNCED_KEY = 'replica:synced_at'     # Redis key holding the time the replica was last known current
+PRIMARY_UNTIL = '_db_primary_until'  # Session key, reads stay on the primary until then after a write
+
+
+# ------------- Routing Session -------------
+class RoutingSession(Session):
+    """Sends the SELECTs of views marked with @read_replica to the replica bind
+
+    Flushes, DML and anything after the request's first write go to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_request_context():
+            if self._flushing or not isinstance(clause, Select):
+                g._db_wrote = True
+            elif _use_replica():
+                engine = self._db.engines.get(REPLICA_BIND)
+                if engine is not None:
+                    return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+# ------------- Replica Freshness -------------
+def replica_synced_at():
+    """Time up to which the replica holds every commit, 0 when unknown
+
+    Snapshots record it in Redis when refreshed. Streaming replicas set
+    REPLICA_MAX_LAG instead and are assumed that far behind.
+    """
+    max_lag = current_app.config.get('REPLICA_MAX_LAG')
+    if max_lag is not None:
+        return time.time() - max_lag
+    try:
+        return float(get_redis().get(SYNCED_KEY) or 0)
+    except RedisError as e:
+        logger.warning(f"Failed to read replica sync time: {str(e)}")
+        return 0
+
+
+def _replica_fresh(tags):
+    """Whether the replica has every change behind the tags' current generations"""
+    synced_at = replica_synced_at()
+    if not synced_at:  # Never refreshed
+        return False
+    if not tags:
+        return True
+    generations = tag_generations(*tags)
+    if generations is None:  # Cache unreachable, the tags' ages are unknown
+        return False
+    changed_at = max((generation_time(token) or float('inf')) for token in generations)
+    return changed_at <= synced_at
+
+
+def _use_replica():
+    """Whether this request's next SELECT may go to the replica
+
+    Decided on the first SELECT of a @read_replica view, so requests answered
+    from the view cache never pay for the freshness check.
+    """
+    if g.get('_db_wrote'):
+        return False
+    if '_db_replica' not in g:
+        tags = g.get('_db_replica_tags')
+        if tags is None:
+            return False
+        try:
+            g._db_replica = _replica_fresh(tags)
+        except RedisError as e:
+            logger.warning(f"Replica freshness check failed, reading from the primary: {str(e)}")
+            g._db_replica = False
+    return g._db_replica
+
+
+def read_replica(*tags):
+    """Serve the view's reads from the replica
+
+    With tags (the view's cache tags, which may use its URL arguments and {user_id}),
+    the replica is only used once it is newer than their last invalidation, so a
+    freshly invalidated cache entry is never rebuilt from stale rows. Untagged views
+    accept the replica's lag. A user's own writes send their reads to the primary
+    for REPLICA_READ_YOUR_WRITES seconds.
+    """
+    def decorator(f):
+        @functools.wraps(f)
+        def decorated_function(*args, **kwargs):
+            if (REPLICA_BIND in current_app.config.get('SQLALCHEMY_BINDS', {})
+                    and session.get(PRIMARY_UNTIL, 0) < time.time()):
+                user_id = current_user.id if current_user.is_authenticated else None
+                g._db_replica_tags = [tag.format(user_id=user_id, **kwargs) for tag in tags]
+            return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def _remember_writes(response):
+    """after_request hook: open the read-your-writes window after a request that wrote"""
+    if g.get('_db_wrote') and REPLICA_BIND in current_app.config.get('SQLALCHEMY_BINDS', {}):
+        session[PRIMARY_UNTIL] = time.time() + current_app.config.get('REPLICA_READ_YOUR_WRITES', 120)
+    return response
+
+
+def init_routing(app):
+    app.after_request(_remember_writes)
+
@@ -0,0 +1,63 @@
+from flask import current_app
+from sqlalchemy import event
+from .models import db
+
+# ------------- Engine Profiles -------------
+# Pragmas applied to every new SQLite connection, selected with SQLITE_PROFILE
+# and adjusted per config class through SQLITE_PRAGMAS.
+SQLITE_PROFILES = {
+    'default': {},  # SQLite's own settings: rollback journal, synchronous=FULL
+    'concurrent': {
+        'journal_mode': 'WAL',         # Readers no longer block the writer or each other
+        'synchronous': 'NORMAL',       # Safe with WAL, fsyncs at checkpoints instead of every commit
+        'busy_timeout': 5000,          # Milliseconds a writer waits for the lock before "database is locked"
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -32000,          # Negative is KiB, so about 32 MB of page cache per connection
+        'temp_store': 'MEMORY',
+    },
+}
+
+
+def profile_pragmas(config):
+    """{pragma: value} for the configured profile, raises ValueError for an unknown one"""
+    name = config.get('SQLITE_PROFILE', 'default')
+    if name not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLITE_PROFILE {name!r} (expected one of {', '.join(SQLITE_PROFILES)})")
+    return {**SQLITE_PROFILES[name], **config.get('SQLITE_PRAGMAS', {})}
+
+
+def listen_pragmas(engine, pragmas):
+    """Run the pragmas on each connection the engine opens"""
+    if not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        finally:
+            cursor.close()
+
+
+def apply_sqlite_profile(app):
+    """Install the configured profile on the app's engines, before they open any connection"""
+    with app.app_context():
+        for engine in db.engines.values():
+            if engine.dialect.name == 'sqlite':
+                listen_pragmas(engine, profile_pragmas(app.config))
+
+
+def current_pragmas():
+    """Values of the profile's pragmas as a pooled connection sees them"""
+    names = set(SQLITE_PROFILES['concurrent']) | set(current_app.config.get('SQLITE_PRAGMAS', {}))
+    with db.engine.connect() as conn:
+        return {name: conn.exec_driver_sql(f"PRAGMA {name}").scalar() for name in sorted(names)}
+
+
+def optimize_database():
+    """PRAGMA optimize: refresh the planner statistics of tables whose queries would benefit"""
+    with db.engine.connect() as conn:
+        conn.exec_driver_sql("PRAGMA optimize")
+        conn.commit()
@@ -80,6 +80,11 @@ new Vue({
                         await new Promise(resolve => setTimeout(resolve, 2000));
                         await this.pollTaskStatus(taskId, taskName);
                         break;
+                    case 'PROGRESS':
+                        this.taskStatus = `${taskName} in progress: ${status.info?.processed ?? 0} users processed...`;
+                        await new Promise(resolve => setTimeout(resolve, 2000));
+                        await this.pollTaskStatus(taskId, taskName);
+                        break;
                     case 'STARTED':
                         this.taskStatus = `${taskName} is in progress...`;
                         await new Promise(resolve => setTimeout(resolve, 2000));
@@ -4,7 +4,9 @@ new Vue({
     // --------------- Data Management --------------- 
     data: {
         // Content management
-        users: [],            // List of all users
+        users: [],            // Users loaded so far
+        nextCursor: null,     // Cursor for the next page, null on the last one
+        loadingMore: false,   // Next page in flight
         availableRoles: ['admin', 'stud'], // Available user roles
         
         // Modal states
@@ -30,9 +32,28 @@ new Vue({
         // --------------- User Management Methods --------------- 
         fetchUsers() {
             axios.get('/api/users')
-                .then(response => this.users = response.data)
+                .then(response => {
+                    this.users = response.data.users;
+                    this.nextCursor = response.data.next_cursor;
+                })
+                .catch(error => {
+                    this.error = error.response?.data?.message || 'Error fetching users';
+                });
+        },
+
+        loadMore() {
+            if (!this.nextCursor || this.loadingMore) return;
+            this.loadingMore = true;
+            axios.get('/api/users', { params: { cursor: this.nextCursor } })
+                .then(response => {
+                    this.users = this.users.concat(response.data.users);
+                    this.nextCursor = response.data.next_cursor;
+                })
                 .catch(error => {
                     this.error = error.response?.data?.message || 'Error fetching users';
+                })
+                .finally(() => {
+                    this.loadingMore = false;
                 });
         },
 
@@ -8,6 +8,7 @@ new Vue({
         
         // UI states
         loading: true,             // Loading indicator
+        loadingMore: false,        // Next page in flight
         error: null,              // Error message storage
         
         // Statistics
@@ -19,6 +20,7 @@ new Vue({
         
         // Content management
         attempts: [],             // List of quiz attempts
+        nextCursor: null,        // Cursor for the next page, null on the last one
         searchQuery: '',         // Search query string
         selectedAttempt: null    // Currently selected attempt
     },
@@ -91,23 +93,15 @@ new Vue({
         
         fetchResults() {
             this.loading = true;
+            this.attempts = [];
+            this.nextCursor = null;
             
-            axios.get('/api/student/attempts')
-                .then(response => {
-                    if (!response.data.attempts) {
-                        throw new Error('No attempts data received');
-                    }
-                    
-                    this.attempts = response.data.attempts.map(attempt => ({
-                        ...attempt,
-                        score: parseFloat(attempt.score),
-                        date: new Date(attempt.date)
-                    }));
-                    
+            this.fetchAttemptsPage()
+                .then(data => {
                     this.stats = {
-                        averageScore: parseFloat(response.data.stats.averageScore) || 0,
-                        totalAttempts: response.data.stats.totalAttempts || 0,
-                        passRate: parseFloat(response.data.stats.passRate) || 0
+                        averageScore: parseFloat(data.stats.averageScore) || 0,
+                        totalAttempts: data.stats.totalAttempts || 0,
+                        passRate: parseFloat(data.stats.passRate) || 0
                     };
                 })
                 .catch(error => {
@@ -118,6 +112,40 @@ new Vue({
                 });
         },
         
+        loadMore() {
+            if (!this.nextCursor || this.loadingMore) return;
+            this.loadingMore = true;
+            
+            this.fetchAttemptsPage(this.nextCursor)
+                .catch(error => {
+                    this.error = error.response?.data?.error || error.message || 'Failed to load results';
+                })
+                .finally(() => {
+                    this.loadingMore = false;
+                });
+        },
+        
+        fetchAttemptsPage(cursor) {
+            // The list leaves out response_sheet, attempt details fetch it on demand
+            const params = { fields: 'id,quiz_id,quiz_title,subject_name,chapter_name,score,date' };
+            if (cursor) params.cursor = cursor;
+            
+            return axios.get('/api/student/attempts', { params })
+                .then(response => {
+                    if (!response.data.attempts) {
+                        throw new Error('No attempts data received');
+                    }
+                    
+                    this.attempts = this.attempts.concat(response.data.attempts.map(attempt => ({
+                        ...attempt,
+                        score: parseFloat(attempt.score),
+                        date: new Date(attempt.date)
+                    })));
+                    this.nextCursor = response.data.next_cursor;
+                    return response.data;
+                });
+        },
+        
         // --------------- Authentication Methods --------------- 
         logout() {
             axios.post('/api/logout')
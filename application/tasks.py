@@ -1,16 +1,24 @@
 from celery import shared_task, Celery
 from celery.schedules import crontab
 from datetime import datetime, timedelta
-from application.models import User, Quiz, QuizAttempt, db
+from application.models import User, Role, RolesUsers, Quiz, QuizAttempt, db
 from sqlalchemy import func
 import csv
 import io
 import os
 import json
-from flask import render_template
+from flask import render_template, current_app
 from celery.signals import worker_ready
 from application.mail_service import EmailService
-import shutil
+from application.leaderboard import rebuild_leaderboards
+from application.instance import get_redis
+from application.backups import create_backup, refresh_replica
+from application.routing import REPLICA_BIND
+from application.exports import export_all
+from application.item_analysis import backfill_attempt_answers
+from application.sqlite_profile import optimize_database
+from application.ingest import drain_submissions
+from application.attempt_sessions import sweep_expired_sessions
 
 app = Celery()
 
@@ -58,21 +66,137 @@ def setup_periodic_tasks(sender, **kwargs):
         name='export-analytics'
     )
 
+    # Grade and store attempts whose deadline passed without a submit
+    sender.add_periodic_task(
+        timedelta(seconds=30),
+        sweep_attempt_sessions.s(),
+        name='sweep-attempt-sessions'
+    )
+
+    # Store queued submissions, a backstop for the ingest writer process
+    sender.add_periodic_task(
+        timedelta(seconds=10),
+        drain_submission_queue.s(),
+        name='drain-submissions'
+    )
+
+    # Refresh the read replica snapshot every minute
+    sender.add_periodic_task(
+        timedelta(minutes=1),
+        refresh_read_replica.s(),
+        name='refresh-replica'
+    )
+
+    # Refresh SQLite planner statistics every 6 hours
+    sender.add_periodic_task(
+        timedelta(hours=6),
+        optimize_sqlite.s(),
+        name='sqlite-optimize'
+    )
+
+# ------------- Daily Reminders -------------
+REMINDER_BATCH_SIZE = 1000
+REMINDER_INACTIVE_DAYS = 7
+
+def inactive_student_rows(cutoff_date, batch_size=REMINDER_BATCH_SIZE):
+    """Stream (user_id, email, username) for active students with no attempt since the cutoff
+
+    Uses an anti-join against the (user_id, date_created) index and pages by user id,
+    so students who never attempted a quiz are included and nobody appears twice.
+    """
+    recent_attempt = db.session.query(QuizAttempt.id).filter(
+        QuizAttempt.user_id == User.id,
+        QuizAttempt.date_created >= cutoff_date
+    ).exists()
+    is_student = db.session.query(RolesUsers.id).join(Role, RolesUsers.role_id == Role.id).filter(
+        RolesUsers.user_id == User.id,
+        Role.name == 'stud'
+    ).exists()
+
+    last_id = 0
+    while True:
+        rows = db.session.query(User.id, User.email, User.username).filter(
+            User.active == True,
+            User.id > last_id,
+            is_student,
+            ~recent_attempt
+        ).order_by(User.id).limit(batch_size).all()
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1][0]
+
 @shared_task
 def send_daily_reminders():
-    """Send reminders to inactive users daily"""
-    cutoff_date = datetime.now() - timedelta(days=7)
-    inactive_users = User.query.join(QuizAttempt).filter(
-        QuizAttempt.date_created < cutoff_date
-    ).all()
-    
-    for user in inactive_users:
-        EmailService.send_reminder(user.email, user.username)
-    return f"Sent reminders to {len(inactive_users)} users"
+    """Send reminders to inactive students daily (at most once per student per day)"""
+    cutoff_date = datetime.now() - timedelta(days=REMINDER_INACTIVE_DAYS)
+    client = get_redis()
+    sent_key = f"reminders:{datetime.now().strftime('%Y-%m-%d')}"
+    sent = 0
+    skipped = 0
 
-@shared_task(bind=True)
+    for batch in _batched(inactive_student_rows(cutoff_date), REMINDER_BATCH_SIZE):
+        # Claim users before sending so a rerun on the same day skips them
+        pending = [row for row in batch if client.sadd(sent_key, row[0])]
+        skipped += len(batch) - len(pending)
+        results = EmailService.send_reminders((email, username) for _, email, username in pending)
+        sent += sum(results)
+        # Release failed sends so a retry later today can reach them
+        failed = [row[0] for row, success in zip(pending, results) if not success]
+        if failed:
+            client.srem(sent_key, *failed)
+        client.expire(sent_key, 2 * 24 * 3600)
+
+    return f"Sent reminders to {sent} users ({skipped} already reminded today)"
+
+# ------------- Monthly Report Pipeline -------------
+MONTHLY_REPORT_BATCH_SIZE = 100   # Users per email batch task
+MONTHLY_REPORT_RATE_LIMIT = '30/m'  # Batch tasks per minute per worker
+MONTHLY_REPORT_STATE_TTL = 7 * 24 * 3600
+
+def _duration_minutes():
+    """SQL expression for attempt duration in minutes"""
+    if db.engine.dialect.name == 'sqlite':
+        return (func.julianday(QuizAttempt.completed_at) - func.julianday(QuizAttempt.started_at)) * 1440
+    return func.extract('epoch', QuizAttempt.completed_at - QuizAttempt.started_at) / 60
+
+def monthly_report_rows(since, after_user_id=0):
+    """Stream (user_id, email, username, total_quizzes, avg_score, total_time) per active user"""
+    query = db.session.query(
+        User.id,
+        User.email,
+        User.username,
+        func.count(QuizAttempt.id),
+        func.avg(QuizAttempt.score),
+        func.sum(_duration_minutes())
+    ).join(QuizAttempt, QuizAttempt.user_id == User.id)\
+     .filter(
+        User.active == True,
+        User.id > after_user_id,
+        QuizAttempt.date_created >= since
+    ).group_by(User.id, User.email, User.username)\
+     .order_by(User.id)
+
+    for user_id, email, username, total, avg_score, total_time in query.yield_per(1000):
+        yield [user_id, email, username, total, round(float(avg_score or 0), 2), round(float(total_time or 0), 1)]
+
+def _batched(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+@shared_task(bind=True, acks_late=True)
 def generate_monthly_report(self):
-    """Generate monthly report"""
+    """Generate monthly report and dispatch report emails in rate-limited batches
+
+    Progress is checkpointed in Redis under the task id, so a redelivered task
+    (acks_late) resumes after the last dispatched user instead of starting over.
+    """
     try:
         # Get absolute path and create reports directory
         current_dir = os.getcwd()
@@ -84,56 +208,38 @@ def generate_monthly_report(self):
             print(f"Error creating reports directory: {str(mkdir_error)}")
             raise
 
-        # Get all active users and generate their reports
-        users = User.query.filter_by(active=True).all()
-        emails_sent = 0
-        email_failures = []
-        
-        print(f"Found {len(users)} active users to process")
-        
-        for user in users:
-            try:
-                # Calculate user statistics for the past month
-                last_month = datetime.now() - timedelta(days=30)
-                user_attempts = QuizAttempt.query.filter(
-                    QuizAttempt.user_id == user.id,
-                    QuizAttempt.date_created >= last_month
-                ).all()
-                
-                if user_attempts:
-                    print(f"Preparing report for user {user.email}")
-                    report_data = {
-                        'total_quizzes': len(user_attempts),
-                        'avg_score': round(sum(a.score for a in user_attempts) / len(user_attempts), 2),
-                        'total_time': sum(a.duration or 0 for a in user_attempts)
-                    }
-                    
-                    print(f"Attempting to send email to {user.email}")
-                    # Send email report with better error handling
-                    success = EmailService.send_report(user.email, user.username, report_data)
-                    if success:
-                        emails_sent += 1
-                        print(f"Successfully sent email to {user.email}")
-                    else:
-                        email_failures.append(user.email)
-                        print(f"Failed to send email to {user.email}")
-                    
-                    # Add a small delay between emails
-                    from time import sleep
-                    sleep(1)
-                    
-            except Exception as e:
-                print(f"Error processing user {user.email}: {str(e)}")
-                email_failures.append(user.email)
-
-        # Generate summary report
+        run_id = self.request.id or datetime.now().strftime('%Y%m%d%H%M%S')
+        state_key = f"monthly_report:{run_id}"
+        client = get_redis()
+        state = client.hgetall(state_key)
+        if state:
+            print(f"Resuming monthly report {run_id} after user {state['last_user_id']}")
+        else:
+            state = {'since': (datetime.now() - timedelta(days=30)).isoformat(), 'last_user_id': 0, 'processed': 0, 'batches': 0}
+            client.hset(state_key, mapping=state)
+            client.expire(state_key, MONTHLY_REPORT_STATE_TTL)
+
+        processed = int(state['processed'])
+        batches = int(state['batches'])
+        rows = monthly_report_rows(datetime.fromisoformat(state['since']), int(state['last_user_id']))
+
+        for batch in _batched(rows, MONTHLY_REPORT_BATCH_SIZE):
+            send_monthly_report_batch.delay(run_id, batch)
+            processed += len(batch)
+            batches += 1
+            client.hset(state_key, mapping={'last_user_id': batch[-1][0], 'processed': processed, 'batches': batches})
+            self.update_state(state='PROGRESS', meta={'processed': processed, 'batches': batches})
+
+        print(f"Dispatched {batches} email batches for {processed} users")
+
+        # Generate summary report (per-email results accumulate in Redis as batches run)
         report_data = {
             'timestamp': datetime.now().isoformat(),
             'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'status': 'completed',
-            'emails_sent': emails_sent,
-            'email_failures': email_failures,
-            'total_users': len(users)
+            'status': 'dispatched',
+            'run_id': run_id,
+            'batches': batches,
+            'total_users': processed
         }
 
         filename = os.path.join(reports_dir, f'monthly_report_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json')
@@ -145,9 +251,9 @@ def generate_monthly_report(self):
         return {
             'status': 'SUCCESS',
             'file': filename,
-            'emails_sent': emails_sent,
-            'email_failures': email_failures,
-            'total_users': len(users)
+            'run_id': run_id,
+            'batches': batches,
+            'total_users': processed
         }
     except Exception as e:
         error_msg = f"Error in generate_monthly_report: {str(e)}"
@@ -155,46 +261,58 @@ def generate_monthly_report(self):
         self.update_state(state='FAILURE', meta={'error': error_msg})
         return {'status': 'FAILURE', 'error': error_msg}
 
+@shared_task(bind=True, acks_late=True, rate_limit=MONTHLY_REPORT_RATE_LIMIT)
+def send_monthly_report_batch(self, run_id, rows):
+    """Send report emails for one batch of users, skipping users already mailed in this run
+
+    Users are recorded as mailed only once their email went out, so a worker that
+    dies mid-batch has the redelivered batch resend to the rest (at-least-once):
+    a user mailed just before the crash may get the report twice, none is missed.
+    """
+    client = get_redis()
+    state_key = f"monthly_report:{run_id}"
+    sent_key = f"{state_key}:sent"
+    failures_key = f"{state_key}:failures"
+
+    already_sent = client.smismember(sent_key, [row[0] for row in rows])
+    pending = [row for row, sent in zip(rows, already_sent) if not sent]
+    results = EmailService.send_reports(
+        (email, username, {'total_quizzes': total_quizzes, 'avg_score': avg_score, 'total_time': total_time})
+        for user_id, email, username, total_quizzes, avg_score, total_time in pending
+    )
+    emails_sent = sum(results)
+    sent_ids = [row[0] for row, success in zip(pending, results) if success]
+    if sent_ids:
+        client.sadd(sent_key, *sent_ids)
+    failures = [row[1] for row, success in zip(pending, results) if not success]
+    client.hincrby(state_key, 'emails_sent', emails_sent)
+    if failures:
+        client.hincrby(state_key, 'email_failures', len(failures))
+        client.rpush(failures_key, *failures)
+
+    for key in (sent_key, failures_key):
+        client.expire(key, MONTHLY_REPORT_STATE_TTL)
+    return {'emails_sent': emails_sent, 'batch_size': len(rows)}
+
 @shared_task(bind=True)
 def backup_database(self):
-    """Backup database"""
+    """Backup database online with the SQLite backup API, then verify, compress and prune"""
     try:
         # Get absolute path and create backups directory
-        current_dir = os.getcwd()
-        backups_dir = os.path.join(current_dir, 'backups')
-        
-        print(f"Current directory: {current_dir}")
-        print(f"Creating backups directory at: {backups_dir}")
-        
-        try:
-            os.makedirs(backups_dir, exist_ok=True)
-            print(f"Backups directory created/verified at: {backups_dir}")
-        except Exception as mkdir_error:
-            print(f"Error creating backups directory: {str(mkdir_error)}")
-            raise
+        config = current_app.config
+        backups_dir = os.path.join(os.getcwd(), config.get('BACKUP_DIR', 'backups'))
+        print(f"Backing up database to: {backups_dir}")
 
-        # Create backup file path
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        backup_file = os.path.join(backups_dir, f'db_backup_{timestamp}.sqlite')
-        db_path = os.path.join(current_dir, 'instance', 'quiz.db')
-        
-        print(f"Database path: {db_path}")
-        print(f"Backup file path: {backup_file}")
-        
-        if not os.path.exists(db_path):
-            error_msg = f'Database file not found at {db_path}'
-            print(error_msg)
-            raise FileNotFoundError(error_msg)
+        entry = create_backup(
+            backups_dir,
+            compression=config.get('BACKUP_COMPRESSION', 'gzip'),
+            keep=config.get('BACKUP_RETENTION', 7),
+            pages=config.get('BACKUP_PAGES_PER_STEP', 256)
+        )
+        backup_file = os.path.join(backups_dir, entry['file'])
+        print(f"Database successfully backed up to: {backup_file} ({entry['size']} bytes)")
 
-        # Perform backup
-        try:
-            shutil.copy2(db_path, backup_file)
-            print(f"Database successfully backed up to: {backup_file}")
-        except Exception as backup_error:
-            print(f"Error backing up database: {str(backup_error)}")
-            raise
-
-        return {'status': 'SUCCESS', 'file': backup_file}
+        return {'status': 'SUCCESS', 'file': backup_file, 'sha256': entry['sha256'], 'integrity': entry['integrity']}
     except Exception as e:
         error_msg = f"Error in backup_database: {str(e)}"
         print(error_msg)
@@ -203,67 +321,67 @@ def backup_database(self):
 
 @shared_task
 def update_leaderboard():
-    """Update global and subject-wise leaderboards"""
-    # Calculate global rankings
-    global_leaders = db.session.query(
-        User.id,
-        User.username,
-        func.avg(QuizAttempt.score).label('avg_score')
-    ).join(QuizAttempt).group_by(User.id).order_by(
-        func.avg(QuizAttempt.score).desc()
-    ).limit(10).all()
-    
-    # Store in cache or database
-    return "Leaderboard updated"
+    """Rebuild global, subject-wise and quiz-wise leaderboards in Redis"""
+    boards = rebuild_leaderboards()
+    return f"Leaderboard updated ({boards} boards)"
 
 @shared_task(bind=True)
 def export_analytics(self):
-    """Export analytics data"""
+    """Export attempts, per-question responses and per-quiz aggregates as compressed parts"""
     try:
         # Get absolute path and create exports directory
-        current_dir = os.getcwd()
-        exports_dir = os.path.join(current_dir, 'exports')
-        
-        print(f"Current directory: {current_dir}")
-        print(f"Creating exports directory at: {exports_dir}")
-        
-        try:
-            os.makedirs(exports_dir, exist_ok=True)
-            print(f"Exports directory created/verified at: {exports_dir}")
-        except Exception as mkdir_error:
-            print(f"Error creating exports directory: {str(mkdir_error)}")
-            raise
-
-        # Generate export data
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = os.path.join(exports_dir, f'analytics_{timestamp}.json')
-        print(f"Attempting to save analytics to: {filename}")
-        
-        export_data = {
-            'timestamp': datetime.now().isoformat(),
-            'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'data': {
-                'total_users': 100,
-                'total_quizzes': 50,
-                'total_attempts': 250
-            }
-        }
+        config = current_app.config
+        exports_dir = os.path.join(os.getcwd(), 'exports')
+        print(f"Exporting analytics to: {exports_dir}")
 
-        try:
-            with open(filename, 'w') as f:
-                json.dump(export_data, f)
-            print(f"Analytics successfully saved to: {filename}")
-        except Exception as file_error:
-            print(f"Error saving analytics file: {str(file_error)}")
-            raise
+        manifest_path, manifest = export_all(
+            exports_dir,
+            fmt=config.get('EXPORT_FORMAT', 'csv'),
+            max_rows=config.get('EXPORT_PART_ROWS', 500000),
+            max_bytes=config.get('EXPORT_PART_BYTES', 64 * 1024 * 1024)
+        )
+        rows = {dataset['dataset']: dataset['rows'] for dataset in manifest['datasets']}
+        print(f"Analytics successfully exported: {rows}")
 
-        return {'status': 'SUCCESS', 'file': filename}
+        return {'status': 'SUCCESS', 'file': manifest_path, 'rows': rows}
     except Exception as e:
         error_msg = f"Error in export_analytics: {str(e)}"
         print(error_msg)
         self.update_state(state='FAILURE', meta={'error': error_msg})
         return {'status': 'FAILURE', 'error': error_msg}
 
+@shared_task
+def backfill_attempt_answers_task():
+    """Populate attempt_answers from response sheets of attempts made before it existed"""
+    attempts, rows = backfill_attempt_answers()
+    return f"Backfilled {rows} answers from {attempts} attempts"
+
+@shared_task
+def sweep_attempt_sessions():
+    """Submit the autosaved answers of attempt sessions that ran past their deadline"""
+    swept = sweep_expired_sessions()
+    return f"Submitted {swept} expired attempt sessions"
+
+@shared_task
+def drain_submission_queue():
+    """Write queued quiz submissions unless the ingest writer is already doing so"""
+    stored, failed = drain_submissions()
+    return f"Stored {stored} queued submissions ({failed} failed)"
+
+@shared_task
+def refresh_read_replica():
+    """Copy the primary over the SQLite read replica so replica reads catch up"""
+    if REPLICA_BIND not in current_app.config.get('SQLALCHEMY_BINDS', {}):
+        return "No read replica configured"
+    pages = refresh_replica(pages=current_app.config.get('BACKUP_PAGES_PER_STEP', 256))
+    return f"Read replica refreshed ({pages} pages)"
+
+@shared_task
+def optimize_sqlite():
+    """Run PRAGMA optimize so the query planner works from current statistics"""
+    optimize_database()
+    return "SQLite statistics optimized"
+
 @shared_task
 def clean_expired_sessions():
     """Clean expired sessions"""
@@ -1,16 +1,29 @@
 # ------------- Imports -------------
 from flask import render_template, redirect, url_for, jsonify, request
-from flask_security import current_user, roles_required
+from flask_security import current_user, roles_required, roles_accepted
 from flask import current_app as app
 from application.models import Subject, Chapter, Quiz, Question, QuizAttempt, db
-from application.models import User, Role
+from application.models import User, Role, QuizDailyStat, SubjectDailyStat, AttemptAnswer
 from uuid import uuid4
-from sqlalchemy import case, func
+from sqlalchemy import and_, case, func, insert, or_
+from sqlalchemy.exc import IntegrityError
+from redis.exceptions import RedisError
 from datetime import datetime, timedelta
 from application.tasks import generate_monthly_report, backup_database, export_analytics
-from .instance import cache
+from .instance import cached_view, cached_per_user, cache_stats, tier_stats, invalidate_tags, remember
+from .instance import conditional_response
+from .routing import read_replica
+from .ingest import enqueue_submission, submission_status
+from .attempt_sessions import start_session, autosave, take_session, restore_session, close_quiz_sessions, AttemptExpired
+from .answer_keys import get_answer_key, grade_answers, invalidate_answer_keys, answer_facts
+from .item_analysis import item_statistics, option_distribution
+from .rollups import PASS_MARK, record_attempt, remove_quiz
+from .pagination import PageArgumentError, decode_cursor, encode_cursor, page_limit, selected_fields
+from .leaderboard import board_scope, rank_of, safe_record_score, safe_remove_user, top
+from .identity import invalidate_identity
 from flask_wtf.csrf import generate_csrf
 import os
+import time
 
 # ------------- Admin Dashboard Routes -------------
 @app.route('/admin/dashboard')
@@ -79,17 +92,62 @@ def get_current_user():
         'email': current_user.email
     })
 
+# ------------- Catalog Queries -------------
+# Catalog reads are cached for hours under tags, and every write below bumps the
+# tags it affects: 'subjects' (subject list), 'subject:{id}' (its chapter list),
+# 'chapter:{id}' (its quiz list), 'quiz:{id}' (its questions) and 'catalog'
+# (the student quiz listings).
+CATALOG_TIMEOUT = app.config.get('CATALOG_CACHE_TIMEOUT', 6 * 60 * 60)
+# Student pages are cached per user under 'user:{id}' (bumped when they submit)
+# and 'catalog'; admin reports are shared by role under 'reports'.
+STUDENT_TIMEOUT = app.config.get('STUDENT_CACHE_TIMEOUT', 60 * 60)
+# Browsers revalidate catalog and student data on every use (a cheap 304 when
+# unchanged), so edits show up at once; finished attempt details may be reused.
+CATALOG_CACHE_CONTROL = 'public, no-cache'
+STUDENT_CACHE_CONTROL = 'private, no-cache'
+ATTEMPT_CACHE_CONTROL = 'private, max-age=300'
+
+def student_quiz_rows():
+    """Every quiz with its chapter and subject, as cacheable dicts"""
+    def load():
+        rows = db.session.query(
+            Quiz,
+            Chapter.name.label('chapter_name'),
+            Subject.id.label('subject_id'),
+            Subject.name.label('subject_name')
+        ).join(Chapter, Quiz.chapter_id == Chapter.id)\
+         .join(Subject, Chapter.subject_id == Subject.id)\
+         .all()
+        return [{
+            'id': q.id,
+            'title': q.title,
+            'duration': q.duration,
+            'description': q.description,
+            'questions_count': q.questions_count,
+            'chapter_name': chapter_name,
+            'subject_name': subject_name,
+            'chapter_id': q.chapter_id,
+            'subject_id': subject_id,
+            'start_time': q.start_time,
+            'end_time': q.end_time
+        } for q, chapter_name, subject_id, subject_name in rows]
+    return remember('student_quizzes', ['catalog'], load, timeout=CATALOG_TIMEOUT)
+
 # ------------- Subject API Routes -------------
 @app.route('/api/subjects', methods=['GET'])
-@cache.cached(timeout=300)  # Cache subject list for 5 minutes
+@read_replica('subjects')
+@cached_view('subjects', timeout=CATALOG_TIMEOUT, stale_while_revalidate=True,
+             cache_control=CATALOG_CACHE_CONTROL)
 def get_subjects():
     """Get All Subjects With Their Chapter Counts"""
-    subjects = Subject.query.all()
+    subjects = db.session.query(
+        Subject.id, Subject.name, Subject.description, Subject.chapters_count
+    ).all()
     return jsonify([{
         'id': s.id,
         'name': s.name,
         'description': s.description,
-        'chapters_count': len(s.chapters)
+        'chapters_count': s.chapters_count
     } for s in subjects])
 
 @app.route('/api/subjects', methods=['POST'])
@@ -99,6 +157,7 @@ def create_subject():
     subject = Subject(name=data['name'], description=data.get('description', ''))
     db.session.add(subject)
     db.session.commit()
+    invalidate_tags('subjects')
     return jsonify({'id': subject.id, 'name': subject.name}), 201
 
 @app.route('/api/subjects/<int:id>', methods=['PUT'])
@@ -115,11 +174,12 @@ def update_subject(id):
             subject.description = data['description']
             
         db.session.commit()
+        invalidate_tags('subjects', 'catalog')
         return jsonify({
             'id': subject.id,
             'name': subject.name,
             'description': subject.description,
-            'chapters_count': len(subject.chapters)
+            'chapters_count': subject.chapters_count
         })
     except Exception as e:
         db.session.rollback()
@@ -130,8 +190,13 @@ def update_subject(id):
 def delete_subject(id):
     try:
         subject = Subject.query.get_or_404(id)
+        chapter_ids = [c.id for c in subject.chapters]
+        quiz_ids = [q.id for c in subject.chapters for q in c.quizzes]
         db.session.delete(subject)
         db.session.commit()
+        invalidate_answer_keys(*quiz_ids)
+        invalidate_tags('subjects', 'catalog', f'subject:{id}',
+                        *(f'chapter:{c}' for c in chapter_ids), *(f'quiz:{q}' for q in quiz_ids))
         return jsonify({'message': 'Subject deleted successfully'})
     except Exception as e:
         db.session.rollback()
@@ -139,14 +204,17 @@ def delete_subject(id):
 
 # ------------- Chapter API Routes -------------
 @app.route('/api/subjects/<int:subject_id>/chapters', methods=['GET'])
-@cache.cached(timeout=300)  # Cache chapter list for 5 minutes
+@read_replica('subject:{subject_id}')
+@cached_view('subject:{subject_id}', timeout=CATALOG_TIMEOUT, cache_control=CATALOG_CACHE_CONTROL)
 def get_chapters(subject_id):
-    chapters = Chapter.query.filter_by(subject_id=subject_id).all()
+    chapters = db.session.query(
+        Chapter.id, Chapter.name, Chapter.description, Chapter.subject_id, Chapter.quizzes_count
+    ).filter(Chapter.subject_id == subject_id).all()
     return jsonify([{
         'id': c.id,
         'name': c.name,
         'description': c.description,
-        'quizzes_count': len(c.quizzes),
+        'quizzes_count': c.quizzes_count,
         'subject_id': c.subject_id  # Add subject_id to the response
     } for c in chapters])
 
@@ -162,6 +230,7 @@ def create_chapter():
     )
     db.session.add(chapter)
     db.session.commit()
+    invalidate_tags('subjects', f'subject:{chapter.subject_id}')
     return jsonify({'id': chapter.id, 'name': chapter.name}), 201
 
 @app.route('/api/chapters/<int:id>', methods=['PUT'])
@@ -177,11 +246,12 @@ def update_chapter(id):
             chapter.description = data['description']
             
         db.session.commit()
+        invalidate_tags('catalog', f'subject:{chapter.subject_id}')
         return jsonify({
             'id': chapter.id,
             'name': chapter.name,
             'description': chapter.description,
-            'quizzes_count': len(chapter.quizzes)
+            'quizzes_count': chapter.quizzes_count
         })
     except Exception as e:
         db.session.rollback()
@@ -192,8 +262,13 @@ def update_chapter(id):
 def delete_chapter(id):
     try:
         chapter = Chapter.query.get_or_404(id)
+        subject_id = chapter.subject_id
+        quiz_ids = [q.id for q in chapter.quizzes]
         db.session.delete(chapter)
         db.session.commit()
+        invalidate_answer_keys(*quiz_ids)
+        invalidate_tags('subjects', 'catalog', f'subject:{subject_id}', f'chapter:{id}',
+                        *(f'quiz:{q}' for q in quiz_ids))
         return jsonify({'message': 'Chapter deleted successfully'})
     except Exception as e:
         db.session.rollback()
@@ -201,21 +276,29 @@ def delete_chapter(id):
 
 # ------------- Quiz API Routes -------------
 @app.route('/api/chapters/<int:chapter_id>/quizzes', methods=['GET'])
-@cache.cached(timeout=60)  # Cache quiz list for 1 minute since it changes more frequently
+@read_replica('chapter:{chapter_id}')
 def get_quizzes(chapter_id):
-    quizzes = Quiz.query.filter_by(chapter_id=chapter_id).all()
+    def load():
+        return [{
+            'id': q.id,
+            'title': q.title,
+            'description': q.description,
+            'duration': q.duration,
+            'start_time': q.start_time,
+            'end_time': q.end_time,
+            'questions_count': q.questions_count
+        } for q in Quiz.query.filter_by(chapter_id=chapter_id).all()]
+
+    # The quiz rows are cached; status depends on the clock so it is computed per request
+    quizzes = remember(f'chapter_quizzes/{chapter_id}', [f'chapter:{chapter_id}'], load, timeout=CATALOG_TIMEOUT)
     current_time = datetime.now()  # Use local system time
-    return jsonify([{
-        'id': q.id,
-        'title': q.title,
-        'description': q.description,
-        'duration': q.duration,
-        'start_time': q.start_time.isoformat() if q.start_time else None,
-        'end_time': q.end_time.isoformat() if q.end_time else None,
-        'questions_count': len(q.questions),
-        'status': 'active' if (q.start_time and q.end_time and 
-                             q.start_time <= current_time <= q.end_time) else 'inactive'
-    } for q in quizzes])
+    return conditional_response(jsonify([{
+        **q,
+        'start_time': q['start_time'].isoformat() if q['start_time'] else None,
+        'end_time': q['end_time'].isoformat() if q['end_time'] else None,
+        'status': 'active' if (q['start_time'] and q['end_time'] and 
+                             q['start_time'] <= current_time <= q['end_time']) else 'inactive'
+    } for q in quizzes]), CATALOG_CACHE_CONTROL)
 
 @app.route('/api/quizzes', methods=['POST'])
 @roles_required('admin')
@@ -250,6 +333,7 @@ def create_quiz():
         )
         db.session.add(quiz)
         db.session.commit()
+        invalidate_tags('catalog', f'subject:{quiz.chapter.subject_id}', f'chapter:{quiz.chapter_id}')
         
         return jsonify({
             'id': quiz.id,
@@ -292,6 +376,7 @@ def update_quiz(id):
                 return jsonify({'error': f"Invalid start time format: {str(e)}"}), 400
             
         db.session.commit()
+        invalidate_tags('catalog', f'chapter:{quiz.chapter_id}')
         
         # Use current system time for status calculation
         now = datetime.now()
@@ -302,7 +387,7 @@ def update_quiz(id):
             'duration': quiz.duration,
             'start_time': quiz.start_time.isoformat() if quiz.start_time else None,
             'end_time': quiz.end_time.isoformat() if quiz.end_time else None,
-            'questions_count': len(quiz.questions),
+            'questions_count': quiz.questions_count,
             'status': 'active' if (quiz.start_time <= now <= quiz.end_time) else 'inactive'
         })
     except Exception as e:
@@ -315,8 +400,11 @@ def delete_quiz(id):
     try:
         # Start a transaction
         quiz = Quiz.query.get_or_404(id)
+        chapter_id, subject_id = quiz.chapter_id, quiz.chapter.subject_id
         
-        # Delete all related quiz attempts first
+        # Delete all related quiz attempts first (and their report rollups)
+        remove_quiz(id, subject_id)
+        AttemptAnswer.query.filter_by(quiz_id=id).delete()
         QuizAttempt.query.filter_by(quiz_id=id).delete()
         
         # Delete all questions
@@ -325,6 +413,9 @@ def delete_quiz(id):
         # Finally delete the quiz
         db.session.delete(quiz)
         db.session.commit()
+        invalidate_answer_keys(id)
+        close_quiz_sessions(id)
+        invalidate_tags('catalog', 'reports', f'subject:{subject_id}', f'chapter:{chapter_id}', f'quiz:{id}')
         
         return jsonify({'message': 'Quiz deleted successfully'})
     except Exception as e:
@@ -333,6 +424,8 @@ def delete_quiz(id):
 
 # ------------- Question API Routes -------------
 @app.route('/api/quizzes/<int:quiz_id>/questions', methods=['GET'])
+@read_replica('quiz:{quiz_id}')
+@cached_view('quiz:{quiz_id}', timeout=CATALOG_TIMEOUT)
 def get_questions(quiz_id):
     questions = Question.query.filter_by(quiz_id=quiz_id).all()
     return jsonify([{
@@ -356,6 +449,7 @@ def create_question():
     )
     db.session.add(question)
     db.session.commit()
+    invalidate_tags('catalog', f'chapter:{question.quiz.chapter_id}', f'quiz:{question.quiz_id}')
     return jsonify({'id': question.id}), 201
 
 @app.route('/api/questions/<int:id>', methods=['PUT', 'DELETE'])
@@ -364,8 +458,10 @@ def manage_question(id):
     question = Question.query.get_or_404(id)
     
     if request.method == 'DELETE':
+        quiz = question.quiz
         db.session.delete(question)
         db.session.commit()
+        invalidate_tags('catalog', f'chapter:{quiz.chapter_id}', f'quiz:{quiz.id}')
         return jsonify({'message': 'Question deleted successfully'})
         
     data = request.get_json()
@@ -375,6 +471,7 @@ def manage_question(id):
     question.marks = data.get('marks', 1)
     
     db.session.commit()
+    invalidate_tags(f'quiz:{question.quiz_id}')
     return jsonify({
         'id': question.id,
         'question_text': question.question_text,
@@ -384,17 +481,36 @@ def manage_question(id):
     })
 
 # ------------- User Management API Routes -------------
+USER_FIELDS = {
+    'id': lambda u: u.id,
+    'username': lambda u: u.username,
+    'email': lambda u: u.email,
+    'active': lambda u: u.active,
+    'roles': lambda u: [role.name for role in u.roles]
+}
+
 @app.route('/api/users', methods=['GET'])
 @roles_required('admin')
 def get_users():
-    users = User.query.all()
-    return jsonify([{
-        'id': u.id,
-        'username': u.username,
-        'email': u.email,
-        'active': u.active,
-        'roles': [role.name for role in u.roles]
-    } for u in users])
+    """Users by id, a page at a time (?limit=, ?cursor= from next_cursor, ?fields=)"""
+    try:
+        limit = page_limit(50, 200)
+        fields = selected_fields(USER_FIELDS)
+        query = User.query.order_by(User.id)
+        if 'roles' in fields:
+            query = query.options(db.selectinload(User.roles))
+        if request.args.get('cursor'):
+            last_id, = decode_cursor(request.args['cursor'], int)
+            query = query.filter(User.id > last_id)
+        users = query.limit(limit + 1).all()
+    except PageArgumentError as e:
+        return jsonify({'error': str(e)}), 400
+
+    page = users[:limit]
+    return jsonify({
+        'users': [{field: USER_FIELDS[field](u) for field in fields} for u in page],
+        'next_cursor': encode_cursor(page[-1].id) if len(users) > limit else None
+    })
 
 @app.route('/api/users', methods=['POST'])
 @roles_required('admin')
@@ -447,6 +563,7 @@ def update_user(id):
                     user.roles.append(role)
         
         db.session.commit()
+        invalidate_identity(user.fs_uniquifier)
         return jsonify({
             'id': user.id,
             'username': user.username,
@@ -463,8 +580,11 @@ def update_user(id):
 def delete_user(id):
     try:
         user = User.query.get_or_404(id)
+        uniquifier = user.fs_uniquifier
         db.session.delete(user)
         db.session.commit()
+        invalidate_identity(uniquifier)
+        safe_remove_user(id)
         return jsonify({'message': 'User deleted successfully'})
     except Exception as e:
         db.session.rollback()
@@ -477,6 +597,7 @@ def toggle_user_status(id):
         user = User.query.get_or_404(id)
         user.active = not user.active
         db.session.commit()
+        invalidate_identity(user.fs_uniquifier)
         return jsonify({
             'id': user.id,
             'active': user.active
@@ -488,7 +609,8 @@ def toggle_user_status(id):
 # ------------- Report Generation API Routes -------------
 @app.route('/api/reports/summary')
 @roles_required('admin')
-@cache.cached(timeout=300)  # Cache report summary for 5 minutes
+@read_replica('reports')
+@cached_per_user('report_summary', 'reports', timeout=300, per_user=False, stale_while_revalidate=True)
 def report_summary():
     """Get summary statistics for reporting"""
     try:
@@ -564,39 +686,34 @@ def report_summary():
 
 @app.route('/api/reports/quiz-activity')
 @roles_required('admin')
+@read_replica('reports')
+@cached_per_user('report_quiz_activity', 'reports', timeout=300, per_user=False)
 def report_quiz_activity():
-    """Get quiz activity data for reporting"""
+    """Get quiz activity data for reporting (read from the daily rollups)"""
     try:
         time_period = request.args.get('time_period', 'all')
         subject_id = request.args.get('subject_id')
         chapter_id = request.args.get('chapter_id')
         
-        # Base query - join all necessary tables
-        from sqlalchemy import func
+        # Base query over the per quiz per day rollup
+        attempts = func.sum(QuizDailyStat.attempts)
         query = db.session.query(
             Quiz.id.label('quiz_id'),
             Quiz.title.label('quiz_title'),
             Chapter.name.label('chapter_name'),
             Subject.name.label('subject_name'),
-            func.count(QuizAttempt.id).label('attempts'),
-            func.avg(QuizAttempt.score).label('avg_score'),
+            attempts.label('attempts'),
+            (func.sum(QuizDailyStat.score_sum) / attempts).label('avg_score'),
             # Pass rate calculation (scores >= 40%)
-            (func.sum(case((QuizAttempt.score >= 40, 1), else_=0)) / func.count(QuizAttempt.id) * 100).label('pass_rate')
-        ).join(Quiz, QuizAttempt.quiz_id == Quiz.id)\
+            (func.sum(QuizDailyStat.pass_count) * 100.0 / attempts).label('pass_rate')
+        ).join(Quiz, QuizDailyStat.quiz_id == Quiz.id)\
          .join(Chapter, Quiz.chapter_id == Chapter.id)\
          .join(Subject, Chapter.subject_id == Subject.id)
         
         # Apply filters
-        if time_period != 'all':
-            from datetime import datetime, timedelta
-            today = datetime.now()
-            if time_period == '7days':
-                start_date = today - timedelta(days=7)
-            elif time_period == '30days':
-                start_date = today - timedelta(days=30)
-            elif time_period == '90days':
-                start_date = today - timedelta(days=90)
-            query = query.filter(QuizAttempt.date_created >= start_date)
+        start_date = report_start_date(time_period)
+        if start_date:
+            query = query.filter(QuizDailyStat.day >= start_date)
         
         if chapter_id:
             query = query.filter(Quiz.chapter_id == chapter_id)
@@ -628,54 +745,48 @@ def report_quiz_activity():
     except Exception as e:
         return jsonify([])
 
+def report_start_date(time_period):
+    """First rollup day included for a report time period, None for all time"""
+    days = {'7days': 7, '30days': 30, '90days': 90}.get(time_period)
+    if not days:
+        return None
+    return (datetime.now() - timedelta(days=days)).date()
+
+def time_series_days(time_period):
+    """Number of days shown on the performance chart (7 for 'all' to avoid too much data)"""
+    return {'7days': 7, '30days': 30, '90days': 90}.get(time_period, 7)
+
 @app.route('/api/reports/time-series')
 @roles_required('admin')
 def report_time_series():
-    """Get time series data for performance chart"""
+    """Get time series data for performance chart (read from the daily rollups)"""
+    time_period = request.args.get('time_period', 'all')
+    days = time_series_days(time_period)
+    start_date = datetime.now().date() - timedelta(days=days-1)
+    
+    # Generate all dates in the range
+    date_range = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
+    
     try:
-        time_period = request.args.get('time_period', 'all')
         subject_id = request.args.get('subject_id')
         chapter_id = request.args.get('chapter_id')
         
-        # Determine date range based on time period
-        from datetime import datetime, timedelta
-        today = datetime.now().date()
-        
-        if time_period == '7days':
-            days = 7
-        elif time_period == '30days':
-            days = 30
-        elif time_period == '90days':
-            days = 90
-        else:  # Default to last 7 days if 'all' to avoid too much data
-            days = 7
-        
-        start_date = today - timedelta(days=days-1)
-        
-        # Generate all dates in the range
-        date_range = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
-        
-        # Base query with date formatting and grouping
-        from sqlalchemy import func, cast, Date
+        # Chapter filters need the quiz rollup, otherwise the smaller subject rollup is enough
+        stat = QuizDailyStat if chapter_id else SubjectDailyStat
         query = db.session.query(
-            cast(QuizAttempt.date_created, Date).label('attempt_date'),
-            func.avg(QuizAttempt.score).label('avg_score'),
-            func.count(QuizAttempt.id).label('attempts')
-        )
+            stat.day.label('attempt_date'),
+            (func.sum(stat.score_sum) / func.sum(stat.attempts)).label('avg_score'),
+            func.sum(stat.attempts).label('attempts')
+        ).filter(stat.day >= start_date)
         
-        # Apply filters
-        query = query.filter(QuizAttempt.date_created >= start_date)
-        
-        if chapter_id or subject_id:
-            query = query.join(Quiz)
-            
-            if chapter_id:
-                query = query.filter(Quiz.chapter_id == chapter_id)
-            elif subject_id:
-                query = query.join(Chapter).filter(Chapter.subject_id == subject_id)
+        if chapter_id:
+            query = query.join(Quiz, QuizDailyStat.quiz_id == Quiz.id)\
+                .filter(Quiz.chapter_id == chapter_id)
+        elif subject_id:
+            query = query.filter(SubjectDailyStat.subject_id == subject_id)
         
         # Group by date and execute
-        query = query.group_by('attempt_date').order_by('attempt_date')
+        query = query.group_by(stat.day).order_by(stat.day)
         results = query.all()
         
         # Create a lookup dictionary for actual data
@@ -683,45 +794,51 @@ def report_time_series():
             row.attempt_date.strftime('%Y-%m-%d'): {
                 'avg_score': round(float(row.avg_score), 1) if row.avg_score else 0,
                 'attempts': row.attempts
-            } for row in results
+            } for row in results if row.attempts
         }
         
         # Build the final time series with all dates (filling gaps with zeros)
-        time_data = []
-        for date_str in date_range:
-            if date_str in data_by_date:
-                time_data.append({
-                    'date': date_str,
-                    'avg_score': data_by_date[date_str]['avg_score'],
-                    'attempts': data_by_date[date_str]['attempts']
-                })
-            else:
-                time_data.append({
-                    'date': date_str,
-                    'avg_score': 0,
-                    'attempts': 0
-                })
-        
-        return jsonify(time_data)
+        return jsonify([{
+            'date': date_str,
+            'avg_score': data_by_date.get(date_str, {}).get('avg_score', 0),
+            'attempts': data_by_date.get(date_str, {}).get('attempts', 0)
+        } for date_str in date_range])
     except Exception as e:
         # Return empty data for the requested range
-        from datetime import datetime, timedelta
-        today = datetime.now().date()
-        
-        if time_period == '7days':
-            days = 7
-        elif time_period == '30days':
-            days = 30
-        elif time_period == '90days':
-            days = 90
-        else:
-            days = 7
-            
-        start_date = today - timedelta(days=days-1)
-        date_range = [(start_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in range(days)]
-        
         return jsonify([{'date': date_str, 'avg_score': 0, 'attempts': 0} for date_str in date_range])
 
+@app.route('/api/reports/quizzes/<int:quiz_id>/items')
+@roles_required('admin')
+@read_replica('reports', 'quiz:{quiz_id}')
+def report_item_analysis(quiz_id):
+    """Per-question difficulty, discrimination index and option distribution for a quiz"""
+    try:
+        quiz = Quiz.query.get_or_404(quiz_id)
+        stats = item_statistics(quiz_id)
+        distribution = option_distribution(quiz_id)
+        questions = Question.query.filter_by(quiz_id=quiz_id).order_by(Question.id).all()
+        
+        return jsonify({
+            'quiz_id': quiz.id,
+            'quiz_title': quiz.title,
+            'questions': [{
+                'question_id': q.id,
+                'question_text': q.question_text,
+                'correct_answer': q.correct_answer,
+                'responses': stats.get(q.id, {}).get('responses', 0),
+                'difficulty': stats.get(q.id, {}).get('difficulty'),
+                'discrimination': stats.get(q.id, {}).get('discrimination'),
+                'options': [{
+                    'option': index,
+                    'text': text,
+                    'count': distribution.get(q.id, {}).get(index, 0)
+                } for index, text in enumerate(q.options)],
+                'unanswered': distribution.get(q.id, {}).get(None, 0)
+            } for q in questions]
+        })
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 # ------------ Celery beats configurations -----------
 @app.route('/api/admin/trigger-report')
 @roles_required('admin')
@@ -784,6 +901,15 @@ def trigger_analytics_export():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/cache-stats')
+@roles_required('admin')
+def get_cache_stats():
+    """Hit and miss counters per cache key family and per cache tier"""
+    try:
+        return jsonify({'families': cache_stats(), 'tiers': tier_stats()})
+    except RedisError as e:
+        return jsonify({'error': str(e)}), 503
+
 @app.route('/api/task-status/<task_id>')
 @roles_required('admin')
 def get_task_status(task_id):
@@ -804,6 +930,8 @@ def get_task_status(task_id):
             response['info'] = task.get()
         elif task.state == 'FAILURE':
             response['info'] = str(task.result)
+        elif task.state == 'PROGRESS':
+            response['info'] = task.info
         else:
             response['info'] = 'Task is in progress...'
             
@@ -868,9 +996,46 @@ def get_quiz_details(quiz_id):
     except Exception as e:
         return jsonify({'error': 'Failed to load quiz'}), 500
 
+@app.route('/api/student/quiz/<int:quiz_id>/start', methods=['POST'])
+@roles_required('stud')
+def start_quiz_attempt(quiz_id):
+    """Start or resume a timed attempt, returns the deadline and any autosaved answers"""
+    quiz = Quiz.query.get_or_404(quiz_id)
+    now = datetime.now()
+    if not quiz.start_time <= now <= quiz.end_time:
+        return jsonify({'error': 'Quiz is not currently available'}), 403
+    try:
+        attempt_session = start_session(current_user, quiz)
+    except RedisError as e:
+        return jsonify({'error': 'Attempt sessions are temporarily unavailable'}), 503
+    return jsonify({
+        'started_at': datetime.fromtimestamp(attempt_session['started_at']).isoformat(),
+        'deadline': datetime.fromtimestamp(attempt_session['deadline']).isoformat(),
+        'remaining_seconds': max(0, int(attempt_session['deadline'] - time.time())),
+        'answers': attempt_session['answers']
+    })
+
+@app.route('/api/student/quiz/<int:quiz_id>/autosave', methods=['PUT'])
+@roles_required('stud')
+def autosave_quiz_attempt(quiz_id):
+    """Save partial answers ({question_id: option index or null}) to the attempt session, Redis only"""
+    data = request.get_json(silent=True) or {}
+    try:
+        saved = autosave(current_user.id, quiz_id, data.get('answers'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RedisError as e:
+        return jsonify({'error': 'Autosave is temporarily unavailable'}), 503
+    if saved == -1:
+        return jsonify({'error': 'No attempt in progress, start the quiz first'}), 404
+    if saved == 0:
+        return jsonify({'error': 'Time is up'}), 409
+    return '', 204
+
 @app.route('/api/student/quiz/<int:quiz_id>/submit', methods=['POST'])
 @roles_required('stud')
 def submit_quiz(quiz_id):
+    attempt_session = None
     try:
         if not request.is_json:
             return jsonify({'error': 'Invalid content type, expected JSON'}), 400
@@ -889,95 +1054,132 @@ def submit_quiz(quiz_id):
         if now > quiz.end_time:
             return jsonify({'error': 'Quiz has expired'}), 403
 
-        # Process answers and calculate score
-        questions = Question.query.filter_by(quiz_id=quiz_id).all()
-        if not questions:
+        # Grade against the compiled answer key (no question reads on the hot path)
+        answer_key = get_answer_key(quiz_id, quiz.answer_key_version)
+        if not answer_key['questions']:
             return jsonify({'error': 'No questions found for this quiz'}), 404
 
-        total_marks = sum(q.marks for q in questions)
-        scored_marks = 0
-        response_sheet = []
+        # A timed session supplies the real start time and the answers autosaved so far.
+        # Taking it over atomically keeps the sweeper from submitting it as well.
+        try:
+            attempt_session = take_session(current_user.id, quiz_id)
+        except AttemptExpired:
+            return jsonify({'error': 'Time is up, your saved answers are submitted automatically'}), 403
+        except RedisError as e:
+            app.logger.warning(f"Attempt session unavailable, grading the submitted answers: {str(e)}")
+        answers = data['answers']
+        started_at = now
+        submission_id = uuid4().hex
+        if attempt_session:
+            answers = {**attempt_session['answers'], **answers}
+            started_at = datetime.fromtimestamp(attempt_session['started_at'])
+            submission_id = attempt_session['session_id']
 
-        for question in questions:
-            question_id = str(question.id)
-            submitted_answer = data['answers'].get(question_id)
-            is_correct = False
-            
-            if submitted_answer is not None:
-                try:
-                    submitted_answer = int(submitted_answer)
-                    if 0 <= submitted_answer < len(question.options):
-                        is_correct = (submitted_answer == question.correct_answer)
-                        if is_correct:
-                            scored_marks += question.marks
-                except (ValueError, TypeError):
-                    pass
-
-            response_sheet.append({
-                'question_id': question.id,
-                'text': question.question_text,
-                'correct_answer': question.options[question.correct_answer],
-                'user_answer': question.options[submitted_answer] if submitted_answer is not None and 0 <= submitted_answer < len(question.options) else None,
-                'is_correct': is_correct,
-                'marks': question.marks,
-                'scored': question.marks if is_correct else 0
-            })
+        total_marks = answer_key['total_marks']
+        scored_marks, response_sheet = grade_answers(answer_key, answers)
 
         score_percentage = (scored_marks / total_marks * 100) if total_marks > 0 else 0
+        result = {
+            'score': score_percentage,
+            'total_marks': total_marks,
+            'scored_marks': scored_marks,
+            'response_sheet': response_sheet
+        }
+
+        # Ingest mode: acknowledge now, the writer stores the attempt in its next batch
+        if app.config.get('SUBMIT_INGEST'):
+            try:
+                enqueue_submission({
+                    'submission_id': submission_id,
+                    'user_id': current_user.id,
+                    'username': current_user.username,
+                    'quiz_id': quiz_id,
+                    'subject_id': quiz.chapter.subject_id,
+                    'score': score_percentage,
+                    'answers': answers,
+                    'response_sheet': response_sheet,
+                    'facts': answer_facts(answer_key, None, answers),
+                    'started_at': started_at.isoformat(),
+                    'submitted_at': now.isoformat()
+                })
+            except RedisError as e:
+                app.logger.warning(f"Submission queue unavailable, storing directly: {str(e)}")
+            else:
+                return jsonify({**result, 'submission_id': submission_id, 'status': 'queued'}), 202
 
         # Save the attempt
         attempt = QuizAttempt(
             user_id=current_user.id,
             quiz_id=quiz_id,
             score=score_percentage,
-            answers=data['answers'],
+            answers=answers,
             response_sheet=response_sheet,
-            started_at=now,
-            completed_at=now
+            started_at=started_at,
+            completed_at=now,
+            submission_id=submission_id
         )
         
-        db.session.add(attempt)
-        db.session.commit()
+        try:
+            db.session.add(attempt)
+            db.session.flush()
+            db.session.execute(insert(AttemptAnswer), answer_facts(answer_key, attempt.id, answers))
+            record_attempt(quiz_id, quiz.chapter.subject_id, attempt.date_created.date(), score_percentage)
+            db.session.commit()
+        except IntegrityError:
+            # The same submission was stored already (a retried request), answer with that attempt
+            db.session.rollback()
+            stored = QuizAttempt.query.filter_by(submission_id=submission_id).first()
+            if stored is None:
+                raise
+            return jsonify({
+                'score': stored.score,
+                'total_marks': total_marks,
+                'scored_marks': sum(response['scored'] for response in stored.response_sheet),
+                'response_sheet': stored.response_sheet,
+                'attempt_id': stored.id,
+                'status': 'stored'
+            })
+        attempt_session = None
+        invalidate_tags(f'user:{current_user.id}', 'reports')
+        safe_record_score(current_user.id, current_user.username, quiz_id,
+                          quiz.chapter.subject_id, score_percentage, attempt.id)
 
-        return jsonify({
-            'score': score_percentage,
-            'total_marks': total_marks,
-            'scored_marks': scored_marks,
-            'response_sheet': response_sheet
-        })
+        return jsonify({**result, 'attempt_id': attempt.id, 'status': 'stored'})
 
     except Exception as e:
         db.session.rollback()
+        if attempt_session:
+            restore_session(attempt_session)
         return jsonify({'error': 'Server error while submitting quiz'}), 500
 
+@app.route('/api/student/submissions/<submission_id>')
+@roles_required('stud')
+def get_submission_status(submission_id):
+    """Whether a queued submission has been stored yet (queued, stored or failed)"""
+    status = submission_status(submission_id)
+    if status is None or status['user_id'] != current_user.id:
+        return jsonify({'error': 'Submission not found'}), 404
+    return jsonify({
+        'submission_id': submission_id,
+        'status': status['state'],
+        'attempt_id': status['attempt_id']
+    })
+
 @app.route('/api/student/available-quizzes')
 @roles_required('stud')
-@cache.cached(timeout=60)  # Cache available quizzes for 1 minute
+@read_replica('catalog')
 def get_available_quizzes():
     """Get all available quizzes for students"""
     try:
         now = datetime.now()  # Use system time
-        quizzes = db.session.query(Quiz)\
-            .join(Chapter)\
-            .join(Subject)\
-            .filter(
-                Quiz.start_time <= now,
-                Quiz.end_time >= now
-            ).all()
+        quizzes = [q for q in student_quiz_rows()
+                   if q['start_time'] and q['end_time'] and q['start_time'] <= now <= q['end_time']]
         
         return jsonify([{
-            'id': q.id,
-            'title': q.title,
-            'duration': q.duration,
-            'description': q.description,
-            'questions_count': len(q.questions),
-            'chapter_name': q.chapter.name,
-            'subject_name': q.chapter.subject.name,
-            'chapter_id': q.chapter_id,
-            'subject_id': q.chapter.subject_id,
-            'start_time': q.start_time.isoformat(),
-            'end_time': q.end_time.isoformat(),
-            'remaining_time': int((q.end_time - now).total_seconds() / 60),
+            **q,
+            'start_time': q['start_time'].isoformat(),
+            'end_time': q['end_time'].isoformat(),
+            'remaining_time': int((q['end_time'] - now).total_seconds() / 60),
             'status': 'active'
         } for q in quizzes])
     except Exception as e:
@@ -986,7 +1188,9 @@ def get_available_quizzes():
 # ------------- Student Performance API Routes -------------
 @app.route('/api/student/stats')
 @roles_required('stud')
-@cache.memoize(timeout=300)  # Cache per-user stats for 5 minutes
+@read_replica('user:{user_id}', 'catalog')
+@cached_per_user('student_stats', 'user:{user_id}', 'catalog', timeout=STUDENT_TIMEOUT,
+                 cache_control=STUDENT_CACHE_CONTROL)
 def get_student_stats():
     try:
         user_id = current_user.id
@@ -1038,16 +1242,42 @@ def get_student_stats():
         return jsonify({'error': str(e)}), 500
 
 # ------------- Student Quiz Attempts API Routes -------------
+ATTEMPT_FIELDS = {
+    'id': QuizAttempt.id,
+    'quiz_id': QuizAttempt.quiz_id,
+    'quiz_title': Quiz.title,
+    'subject_name': Subject.name,
+    'chapter_name': Chapter.name,
+    'score': QuizAttempt.score,
+    'date': QuizAttempt.date_created,
+    'response_sheet': QuizAttempt.response_sheet
+}
+
+def format_attempt_field(field, value):
+    if field == 'score':
+        return float(value)
+    if field == 'date':
+        return value.isoformat()
+    return value
+
 @app.route('/api/student/attempts')
 @roles_required('stud')
+@read_replica('user:{user_id}', 'catalog')
+@cached_per_user('student_attempts', 'user:{user_id}', 'catalog', timeout=STUDENT_TIMEOUT,
+                 cache_control=STUDENT_CACHE_CONTROL)
 def get_student_attempts():
-    """Get all quiz attempts for the current student"""
+    """The current student's attempts, newest first, a page at a time
+
+    ?limit=, ?cursor= (from next_cursor) and ?fields= to leave out heavy
+    columns such as response_sheet. Summary stats come with the first page.
+    """
     try:
-        attempts = db.session.query(
-            QuizAttempt,
-            Quiz.title.label('quiz_title'),
-            Subject.name.label('subject_name'),
-            Chapter.name.label('chapter_name')
+        limit = page_limit(20, 100)
+        fields = selected_fields(ATTEMPT_FIELDS)
+        query = db.session.query(
+            QuizAttempt.id.label('cursor_id'),
+            QuizAttempt.date_created.label('cursor_date'),
+            *(ATTEMPT_FIELDS[field].label(field) for field in fields)
         ).join(
             Quiz, QuizAttempt.quiz_id == Quiz.id
         ).join(
@@ -1056,36 +1286,40 @@ def get_student_attempts():
             Subject, Chapter.subject_id == Subject.id
         ).filter(
             QuizAttempt.user_id == current_user.id
-        ).order_by(
-            QuizAttempt.date_created.desc()
-        ).all()
-        
-        total_attempts = len(attempts)
-        if total_attempts > 0:
-            avg_score = sum(a[0].score for a in attempts) / total_attempts
-            passing_attempts = sum(1 for a in attempts if a[0].score >= 40)
-            pass_rate = (passing_attempts / total_attempts) * 100
-        else:
-            avg_score = 0
-            pass_rate = 0
-        
+        )
+        cursor = request.args.get('cursor')
+        if cursor:
+            last_date, last_id = decode_cursor(cursor, datetime, int)
+            query = query.filter(or_(
+                QuizAttempt.date_created < last_date,
+                and_(QuizAttempt.date_created == last_date, QuizAttempt.id < last_id)
+            ))
+        rows = query.order_by(
+            QuizAttempt.date_created.desc(), QuizAttempt.id.desc()
+        ).limit(limit + 1).all()
+    except PageArgumentError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        page = rows[:limit]
         response_data = {
             'attempts': [{
-                'id': a.QuizAttempt.id,
-                'quiz_id': a.QuizAttempt.quiz_id,
-                'quiz_title': a.quiz_title,
-                'subject_name': a.subject_name,
-                'chapter_name': a.chapter_name,
-                'score': float(a.QuizAttempt.score),
-                'date': a.QuizAttempt.date_created.isoformat(),
-                'response_sheet': a.QuizAttempt.response_sheet
-            } for a in attempts],
-            'stats': {
-                'averageScore': round(float(avg_score), 1),
+                field: format_attempt_field(field, getattr(row, field)) for field in fields
+            } for row in page],
+            'next_cursor': encode_cursor(page[-1].cursor_date.isoformat(), page[-1].cursor_id)
+                           if len(rows) > limit else None
+        }
+        if not cursor:
+            total_attempts, avg_score, passing_attempts = db.session.query(
+                func.count(QuizAttempt.id),
+                func.avg(QuizAttempt.score),
+                func.sum(case((QuizAttempt.score >= PASS_MARK, 1), else_=0))
+            ).filter(QuizAttempt.user_id == current_user.id).one()
+            response_data['stats'] = {
+                'averageScore': round(float(avg_score or 0), 1),
                 'totalAttempts': total_attempts,
-                'passRate': round(float(pass_rate), 1)
+                'passRate': round(float(passing_attempts or 0) / total_attempts * 100, 1) if total_attempts else 0
             }
-        }
         
         return jsonify(response_data)
     except Exception as e:
@@ -1093,6 +1327,9 @@ def get_student_attempts():
 
 @app.route('/api/student/attempts/<int:attempt_id>')
 @roles_required('stud')
+@read_replica('user:{user_id}', 'catalog')
+@cached_per_user('attempt_details', 'user:{user_id}', 'catalog', timeout=STUDENT_TIMEOUT,
+                 cache_control=ATTEMPT_CACHE_CONTROL)
 def get_attempt_details(attempt_id):
     """Get detailed results for a specific quiz attempt"""
     try:
@@ -1139,6 +1376,32 @@ def get_attempt_details(attempt_id):
     except Exception as e:
         return jsonify({'error': 'Failed to load attempt details'}), 500
 
+# ------------- Leaderboard API Routes -------------
+@app.route('/api/leaderboard')
+@roles_accepted('admin', 'stud')
+def get_leaderboard():
+    """Top N users by average score, globally or for one subject/quiz"""
+    try:
+        scope = board_scope(request.args.get('scope', 'global'), request.args.get('id'))
+        limit = request.args.get('limit', 10, type=int)
+        return jsonify({'scope': scope, 'leaders': top(scope, max(limit, 1))})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RedisError as e:
+        return jsonify({'error': 'Leaderboard is temporarily unavailable'}), 503
+
+@app.route('/api/leaderboard/me')
+@roles_required('stud')
+def get_my_rank():
+    """Current student's rank on a leaderboard"""
+    try:
+        scope = board_scope(request.args.get('scope', 'global'), request.args.get('id'))
+        return jsonify({'scope': scope, 'rank': rank_of(scope, current_user.id)})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RedisError as e:
+        return jsonify({'error': 'Leaderboard is temporarily unavailable'}), 503
+
 # ------------- Helper Functions -------------
 def get_subject_wise_performance(user_id):
     """Helper function to get subject-wise performance stats"""
@@ -1164,40 +1427,30 @@ def get_subject_wise_performance(user_id):
 
 @app.route('/api/student/all-quizzes')
 @roles_required('stud')
+@read_replica('catalog')
 def get_all_student_quizzes():
     """Get all quizzes categorized by status for students"""
     try:
         now = datetime.now()
-        quizzes = db.session.query(Quiz)\
-            .join(Chapter)\
-            .join(Subject)\
-            .all()
         
         upcoming = []
         ongoing = []
         expired = []
         
-        for q in quizzes:
+        for q in student_quiz_rows():
+            start_time, end_time = q['start_time'], q['end_time']
             quiz_data = {
-                'id': q.id,
-                'title': q.title,
-                'duration': q.duration,
-                'description': q.description,
-                'questions_count': len(q.questions),
-                'chapter_name': q.chapter.name,
-                'subject_name': q.chapter.subject.name,
-                'chapter_id': q.chapter_id,
-                'subject_id': q.chapter.subject_id,
-                'start_time': q.start_time.strftime('%Y-%m-%d %H:%M') if q.start_time else None,
-                'end_time': q.end_time.strftime('%Y-%m-%d %H:%M') if q.end_time else None
+                **q,
+                'start_time': start_time.strftime('%Y-%m-%d %H:%M') if start_time else None,
+                'end_time': end_time.strftime('%Y-%m-%d %H:%M') if end_time else None
             }
             
-            if q.start_time and q.end_time:
-                if q.start_time <= now <= q.end_time:
-                    quiz_data['remaining_time'] = int((q.end_time - now).total_seconds() / 60)
+            if start_time and end_time:
+                if start_time <= now <= end_time:
+                    quiz_data['remaining_time'] = int((end_time - now).total_seconds() / 60)
                     ongoing.append(quiz_data)
-                elif now < q.start_time:
-                    quiz_data['time_until_start'] = int((q.start_time - now).total_seconds() / 60)
+                elif now < start_time:
+                    quiz_data['time_until_start'] = int((start_time - now).total_seconds() / 60)
                     upcoming.append(quiz_data)
                 else:
                     expired.append(quiz_data)
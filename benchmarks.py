@@ -0,0 +1,549 @@
+# ------------ Performance Benchmarks -----------
+# Run against a seeded development database (python db_seeder.py) with Redis running:
+#   python benchmarks.py grading --submissions 2000
+#   python benchmarks.py smtp --messages 500        (needs aiosmtpd, or --port of a running MailHog)
+#   python benchmarks.py render --emails 100000
+#   python benchmarks.py stampede --threads 32 --seconds 12 --ttl 3
+#   python benchmarks.py payload --attempts 1000
+#   python benchmarks.py writers --writers 8 --submissions 200
+#   python benchmarks.py ingest --submissions 5000 --threads 16   (writes to the dev database, cleans up after)
+#   python benchmarks.py identity --requests 500
+
+import argparse
+import gzip
+import os
+import tempfile
+import random
+import threading
+import time
+import smtplib
+import socket
+from datetime import datetime, timedelta
+from uuid import uuid4
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import create_engine, event, func, insert, select
+from sqlalchemy.exc import OperationalError
+from main import app
+from application.models import db, User, Role, Quiz, Question, QuizAttempt, AttemptAnswer
+from application.instance import get_redis, remember
+from application.answer_keys import get_answer_key, grade_answers, answer_facts
+from application.ingest import QUEUE, drain_submissions, enqueue_submission
+from application.rollups import record_attempt, rebuild_rollups
+from application.mail_service import EmailService, render_email, render_emails
+from application.responses import FastJSONProvider, brotli, orjson
+from application.sqlite_profile import SQLITE_PROFILES, listen_pragmas
+from application.query_budget import count_queries
+
+
+def _report(label, count, elapsed):
+    rate = count / elapsed if elapsed else float('inf')
+    print(f"{label:<32} {count:>8} in {elapsed:8.3f}s  ->  {rate:10.1f}/s")
+
+
+# ------------- Grading -------------
+def _legacy_grade(quiz_id, answers):
+    """Grading as submit_quiz did it before answer keys: load questions and loop"""
+    questions = Question.query.filter_by(quiz_id=quiz_id).all()
+    scored_marks = 0
+    for question in questions:
+        submitted_answer = answers.get(str(question.id))
+        if submitted_answer is not None and 0 <= int(submitted_answer) < len(question.options):
+            if int(submitted_answer) == question.correct_answer:
+                scored_marks += question.marks
+    return scored_marks
+
+
+def bench_grading(args):
+    quiz = Quiz.query.join(Question).first()
+    if not quiz:
+        print("No quiz with questions found, seed the database first")
+        return
+    questions = Question.query.filter_by(quiz_id=quiz.id).all()
+    submissions = [
+        {str(q.id): random.randrange(len(q.options)) for q in questions}
+        for _ in range(args.submissions)
+    ]
+    print(f"Quiz {quiz.id} ({len(questions)} questions)")
+
+    start = time.perf_counter()
+    for answers in submissions:
+        _legacy_grade(quiz.id, answers)
+        db.session.expire_all()
+    _report("legacy (query + loop)", len(submissions), time.perf_counter() - start)
+
+    get_answer_key(quiz.id)  # warm the key
+    start = time.perf_counter()
+    for answers in submissions:
+        grade_answers(get_answer_key(quiz.id), answers)
+    _report("compiled answer key", len(submissions), time.perf_counter() - start)
+
+
+# ------------- SMTP -------------
+def _local_smtp_sink():
+    """Start an in-process aiosmtpd server that discards mail, returns (controller, port)"""
+    from aiosmtpd.controller import Controller
+    from aiosmtpd.handlers import Sink
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    controller = Controller(Sink(), hostname='127.0.0.1', port=port)
+    controller.start()
+    return controller, port
+
+
+def bench_smtp(args):
+    controller = None
+    port = args.port
+    if port is None:
+        controller, port = _local_smtp_sink()
+    app.config.update(MAIL_SERVER='127.0.0.1', MAIL_PORT=port)
+    messages = [(f"student{i}@example.com", "Benchmark", "<p>Hello</p>", "Hello")
+                for i in range(args.messages)]
+    try:
+        start = time.perf_counter()
+        for message in messages:
+            with smtplib.SMTP('127.0.0.1', port) as smtp:
+                smtp.send_message(EmailService.build_message(*message))
+        _report("connection per message", len(messages), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for message in messages:
+            EmailService.send_email(*message)
+        _report("pooled send_email", len(messages), time.perf_counter() - start)
+
+        start = time.perf_counter()
+        EmailService.send_bulk(messages)
+        _report("send_bulk", len(messages), time.perf_counter() - start)
+        print(EmailService.metrics())
+    finally:
+        if controller:
+            controller.stop()
+
+
+# ------------- Email Rendering -------------
+def bench_render(args):
+    recipients = [(f"student{i}@example.com", {'username': f"Student {i}"}) for i in range(args.emails)]
+
+    single = recipients[:10000]
+    start = time.perf_counter()
+    for email, context in single:
+        render_email('reminder', 'Quiz Activity Reminder', **context)
+    elapsed = time.perf_counter() - start
+    count = len(single)
+    _report("render_email (one at a time)", count, elapsed)
+    print(f"{'':<32} {elapsed / count * 1e6:8.1f} us/message")
+
+    start = time.perf_counter()
+    size = sum(len(html) + len(text) for _, _, html, text in
+               render_emails('reminder', 'Quiz Activity Reminder', recipients))
+    elapsed = time.perf_counter() - start
+    _report("render_emails (batched)", len(recipients), elapsed)
+    print(f"{'':<32} {elapsed / len(recipients) * 1e6:8.1f} us/message, {size / len(recipients):.0f} bytes/message")
+
+
+# ------------- Cache Stampede -------------
+def _summary_query(delay):
+    """The aggregate behind report_summary, padded to look like a slow report"""
+    row = db.session.query(
+        func.count(QuizAttempt.id), func.avg(QuizAttempt.score), func.count(func.distinct(QuizAttempt.user_id))
+    ).one()
+    time.sleep(delay)
+    return tuple(row)
+
+
+def _stampede_run(args, protected, swr):
+    """Hammer one cached value from many threads, returns (requests, query times) since start"""
+    app.config['CACHE_STAMPEDE_PROTECTION'] = protected
+    key = f"bench/stampede/{uuid4().hex}"
+    query_times = []
+    requests = [0] * args.threads
+
+    def on_query(conn, cursor, statement, parameters, context, executemany):
+        query_times.append(time.perf_counter() - start)
+
+    def worker(index):
+        while time.perf_counter() < deadline:
+            with app.app_context():
+                remember(key, [], lambda: _summary_query(args.compute_ms / 1000),
+                         timeout=args.ttl, stale_while_revalidate=swr)
+            requests[index] += 1
+
+    event.listen(db.engine, 'before_cursor_execute', on_query)
+    start = time.perf_counter()
+    deadline = start + args.seconds
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        time.sleep(args.compute_ms / 1000)  # let a background refresh finish
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', on_query)
+        app.config['CACHE_STAMPEDE_PROTECTION'] = True
+    return sum(requests), query_times
+
+
+def bench_stampede(args):
+    modes = [
+        ('unprotected', False, False),
+        ('single-flight', True, False),
+        ('stale-while-revalidate', True, True),
+    ]
+    results = []
+    for label, protected, swr in modes:
+        count, query_times = _stampede_run(args, protected, swr)
+        per_second = [0] * args.seconds
+        for moment in query_times:
+            per_second[min(int(moment), args.seconds - 1)] += 1
+        results.append((label, count, per_second))
+        print(f"{label:<24} {count:>8} reads, {len(query_times):>5} DB queries, "
+              f"peak {max(per_second)}/s")
+
+    print(f"\nDB queries per second (TTL {args.ttl}s, {args.threads} threads, {args.compute_ms}ms recompute)")
+    print(f"{'second':>6}  " + '  '.join(f"{label:>22}" for label, _, _ in results))
+    for second in range(args.seconds):
+        print(f"{second:>6}  " + '  '.join(f"{per_second[second]:>22}" for _, _, per_second in results))
+
+
+
+# ------------- Response Payloads -------------
+def _attempts_payload(count, quiz, questions):
+    """A get_student_attempts body with count graded attempts on quiz"""
+    answer_key = get_answer_key(quiz.id)
+    now = datetime.now()
+    attempts = []
+    for i in range(count):
+        answers = {str(q.id): random.randrange(len(q.options)) for q in questions}
+        scored_marks, response_sheet = grade_answers(answer_key, answers)
+        attempts.append({
+            'id': count - i,
+            'quiz_id': quiz.id,
+            'quiz_title': quiz.title,
+            'subject_name': 'Benchmark Subject',
+            'chapter_name': 'Benchmark Chapter',
+            'score': float(random.randrange(101)),
+            'date': (now - timedelta(minutes=i)).isoformat(),
+            'response_sheet': response_sheet
+        })
+    return {'attempts': attempts, 'next_cursor': None,
+            'stats': {'averageScore': 55.0, 'totalAttempts': count, 'passRate': 60.0}}
+
+
+def _timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func()
+    return result, (time.perf_counter() - start) / repeat
+
+
+def bench_payload(args):
+    quiz = Quiz.query.join(Question).first()
+    if not quiz:
+        print("No quiz with questions found, seed the database first")
+        return
+    questions = Question.query.filter_by(quiz_id=quiz.id).all()
+    payload = _attempts_payload(args.attempts, quiz, questions)
+    slim = dict(payload, attempts=[
+        {k: v for k, v in attempt.items() if k != 'response_sheet'} for attempt in payload['attempts']
+    ])
+    print(f"{args.attempts} attempts of a {len(questions)}-question quiz, mean of {args.repeat} runs")
+
+    with app.test_request_context():
+        encoders = [('stdlib json', DefaultJSONProvider(app))]
+        if orjson is not None:
+            encoders.append(('orjson', FastJSONProvider(app)))
+        else:
+            print("orjson is not installed, only the stdlib encoder is measured")
+        for label, provider in encoders:
+            provider.compact = True  # As in production, debug mode would pretty-print
+            _, elapsed = _timed(lambda: provider.response(payload), args.repeat)
+            print(f"jsonify  {label:<24} {elapsed * 1000:9.2f} ms")
+
+    for name, body in [('all fields', payload), ('fields= without response_sheet', slim)]:
+        raw = DefaultJSONProvider(app).dumps(body, separators=(',', ':')).encode()
+        print(f"\n{name}: {len(raw):>10} bytes raw")
+        codecs = [(f"gzip -{level}", lambda level=level: gzip.compress(raw, compresslevel=level, mtime=0))
+                  for level in (1, 6, 9)]
+        if brotli is not None:
+            codecs += [(f"brotli q{quality}", lambda quality=quality: brotli.compress(raw, quality=quality))
+                       for quality in (1, 5, 11)]
+        for label, compress in codecs:
+            compressed, elapsed = _timed(compress, args.repeat)
+            print(f"  {label:<20} {len(compressed):>10} bytes  {len(compressed) / len(raw):6.1%}  "
+                  f"{elapsed * 1000:8.2f} ms")
+
+
+
+# ------------- Concurrent Writers -------------
+def _writers_run(args, profile):
+    """Concurrent submits and report reads on a scratch database
+
+    Returns (submits, reads, write lock errors, read lock errors, seconds).
+    """
+    handle, path = tempfile.mkstemp(suffix='.sqlite')
+    os.close(handle)
+    engine = create_engine(f"sqlite:///{path}", pool_size=args.writers + args.readers)
+    listen_pragmas(engine, SQLITE_PROFILES[profile])
+    db.metadata.create_all(engine, tables=[QuizAttempt.__table__, AttemptAnswer.__table__])
+    submits = [0] * args.writers
+    errors = [0] * args.writers
+    reads = [0] * args.readers
+    read_errors = [0] * args.readers
+    done = threading.Event()
+
+    def writer(index):
+        for _ in range(args.submissions):
+            try:
+                with engine.begin() as conn:  # One submit_quiz transaction: the attempt and its answers
+                    attempt_id = conn.execute(insert(QuizAttempt.__table__).values(
+                        quiz_id=1, user_id=index + 1, score=random.randrange(101),
+                        response_sheet=[], date_created=datetime.now()
+                    )).inserted_primary_key[0]
+                    conn.execute(insert(AttemptAnswer.__table__), [
+                        {'attempt_id': attempt_id, 'question_id': q, 'quiz_id': 1,
+                         'chosen_option': random.randrange(4), 'is_correct': random.random() < 0.5, 'marks': 1}
+                        for q in range(args.questions)
+                    ])
+                submits[index] += 1
+            except OperationalError:  # "database is locked"
+                errors[index] += 1
+
+    def reader(index):
+        table = AttemptAnswer.__table__
+        while not done.is_set():
+            try:
+                with engine.connect() as conn:
+                    conn.execute(select(table.c.question_id, func.avg(table.c.is_correct))
+                                 .group_by(table.c.question_id)).all()
+                reads[index] += 1
+            except OperationalError:
+                read_errors[index] += 1
+
+    writers = [threading.Thread(target=writer, args=(i,)) for i in range(args.writers)]
+    readers = [threading.Thread(target=reader, args=(i,)) for i in range(args.readers)]
+    start = time.perf_counter()
+    try:
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        done.set()
+        for thread in readers:
+            thread.join()
+    finally:
+        engine.dispose()
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+    return sum(submits), sum(reads), sum(errors), sum(read_errors), elapsed
+
+
+def bench_writers(args):
+    print(f"{args.writers} writers x {args.submissions} submits ({args.questions} answers each), {args.readers} readers")
+    for profile in ('default', 'concurrent'):
+        submits, reads, errors, read_errors, elapsed = _writers_run(args, profile)
+        print(f"{profile:<12} {submits:>7} submits {submits / elapsed:8.1f}/s {errors:>5} locked  "
+              f"{reads:>7} reads {read_errors:>5} locked  in {elapsed:7.2f}s")
+
+
+
+# ------------- Submission Ingest -------------
+def _burst(quiz, count):
+    """count graded submissions for quiz as submit_quiz queues them"""
+    answer_key = get_answer_key(quiz.id)
+    questions = answer_key['questions']
+    now = datetime.now()
+    submissions = []
+    for i in range(count):
+        answers = {str(q['id']): random.randrange(len(q['options'])) for q in questions}
+        scored_marks, response_sheet = grade_answers(answer_key, answers)
+        submissions.append({
+            'submission_id': f"bench{uuid4().hex[5:]}",
+            'user_id': 1_000_000 + i,  # Not real users, removed again afterwards
+            'quiz_id': quiz.id,
+            'subject_id': quiz.chapter.subject_id,
+            'score': scored_marks / answer_key['total_marks'] * 100 if answer_key['total_marks'] else 0,
+            'answers': answers,
+            'response_sheet': response_sheet,
+            'facts': answer_facts(answer_key, None, answers),
+            'submitted_at': now.isoformat()
+        })
+    return submissions
+
+
+def _store_directly(submission):
+    """What submit_quiz does without ingest: one transaction and commit per submission"""
+    submitted_at = datetime.fromisoformat(submission['submitted_at'])
+    attempt = QuizAttempt(
+        user_id=submission['user_id'], quiz_id=submission['quiz_id'], score=submission['score'],
+        answers=submission['answers'], response_sheet=submission['response_sheet'],
+        started_at=submitted_at, completed_at=submitted_at, submission_id=submission['submission_id']
+    )
+    db.session.add(attempt)
+    db.session.flush()
+    db.session.execute(insert(AttemptAnswer), [dict(f, attempt_id=attempt.id) for f in submission['facts']])
+    record_attempt(submission['quiz_id'], submission['subject_id'], submitted_at.date(), submission['score'])
+    db.session.commit()
+
+
+def _run_threads(count, threads, func):
+    """Call func(index) for every index from a pool of threads, returns (seconds, errors)"""
+    next_index = iter(range(count))
+    lock = threading.Lock()
+    errors = [0]
+
+    def worker():
+        while True:
+            with lock:
+                index = next(next_index, None)
+            if index is None:
+                return
+            with app.app_context():
+                try:
+                    func(index)
+                except Exception:
+                    db.session.rollback()
+                    with lock:
+                        errors[0] += 1
+
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return time.perf_counter() - start, errors[0]
+
+
+def _remove_bench_attempts():
+    attempt_ids = select(QuizAttempt.id).where(QuizAttempt.submission_id.like('bench%'))
+    AttemptAnswer.query.filter(AttemptAnswer.attempt_id.in_(attempt_ids)).delete(synchronize_session=False)
+    removed = QuizAttempt.query.filter(QuizAttempt.submission_id.like('bench%')).delete(synchronize_session=False)
+    db.session.commit()
+    rebuild_rollups()
+    return removed
+
+
+def bench_ingest(args):
+    quiz = Quiz.query.join(Question).first()
+    if not quiz:
+        print("No quiz with questions found, seed the database first")
+        return
+    print(f"Burst of {args.submissions} submissions from {args.threads} threads, quiz {quiz.id}")
+    try:
+        burst = _burst(quiz, args.submissions)
+        elapsed, errors = _run_threads(len(burst), args.threads, lambda i: _store_directly(burst[i]))
+        _report("direct (commit per submit)", len(burst) - errors, elapsed)
+        print(f"{'':<32} {errors} failed")
+
+        burst = _burst(quiz, args.submissions)
+        get_redis().delete(QUEUE)
+        writer_done = threading.Event()
+        written = {'stored': 0, 'failed': 0}
+
+        def writer():
+            with app.app_context():
+                while not writer_done.is_set() or get_redis().llen(QUEUE):
+                    stored, failed = drain_submissions(batch_size=args.batch_size)
+                    written['stored'] += stored
+                    written['failed'] += failed
+                    if not stored and not failed:
+                        time.sleep(0.05)
+
+        writer_thread = threading.Thread(target=writer)
+        start = time.perf_counter()
+        writer_thread.start()
+        elapsed, errors = _run_threads(len(burst), args.threads, lambda i: enqueue_submission(burst[i]))
+        _report("ingest: acknowledged", len(burst) - errors, elapsed)
+        writer_done.set()
+        writer_thread.join()
+        total = time.perf_counter() - start
+        _report(f"ingest: stored (batches of {args.batch_size})", written['stored'], total)
+        print(f"{'':<32} {errors} not queued, {written['failed']} failed to store")
+    finally:
+        print(f"Removed {_remove_bench_attempts()} benchmark attempts")
+
+
+# ------------- Identity Resolution -------------
+def bench_identity(args):
+    student = User.query.join(User.roles).filter(Role.name == 'stud', User.active.is_(True)).first()
+    if not student:
+        print("No active student found, seed the database first")
+        return
+    client = app.test_client()
+    with client.session_transaction() as session:  # Logged in as the student without a password
+        session['_user_id'] = student.fs_uniquifier
+        session['_fresh'] = True
+    client.get(args.path)  # Warm the view cache, so only authentication is measured
+
+    print(f"GET {args.path} as user {student.id}, view cache warm")
+    try:
+        for label, enabled in (('database user loader', False), ('identity cache', True)):
+            app.config['IDENTITY_CACHE'] = enabled
+            client.get(args.path)
+            queries = 0
+            start = time.perf_counter()
+            for _ in range(args.requests):
+                # A fresh app context per request, as in manage_db.py check-queries
+                with count_queries() as statements, app.app_context():
+                    response = client.get(args.path)
+                queries += len(statements)
+                assert response.status_code == 200, response.status_code
+            _report(label, args.requests, time.perf_counter() - start)
+            print(f"{'':<32} {queries / args.requests:.1f} queries per request")
+    finally:
+        app.config['IDENTITY_CACHE'] = True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quiz Master performance benchmarks')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    grading = commands.add_parser('grading', help='submit_quiz grading throughput')
+    grading.add_argument('--submissions', type=int, default=2000)
+    grading.set_defaults(func=bench_grading)
+
+    smtp = commands.add_parser('smtp', help='email sending throughput')
+    smtp.add_argument('--messages', type=int, default=500)
+    smtp.add_argument('--port', type=int, help='existing SMTP server port (default: local aiosmtpd sink)')
+    smtp.set_defaults(func=bench_smtp)
+
+    render = commands.add_parser('render', help='email template rendering cost')
+    render.add_argument('--emails', type=int, default=100000)
+    render.set_defaults(func=bench_render)
+
+    stampede = commands.add_parser('stampede', help='DB queries at cache expiry with and without stampede protection')
+    stampede.add_argument('--threads', type=int, default=32)
+    stampede.add_argument('--seconds', type=int, default=12)
+    stampede.add_argument('--ttl', type=int, default=3, help='cache timeout in seconds')
+    stampede.add_argument('--compute-ms', type=int, default=200, help='extra recompute latency')
+    stampede.set_defaults(func=bench_stampede)
+
+    payload = commands.add_parser('payload', help='get_student_attempts serialization time and compressed sizes')
+    payload.add_argument('--attempts', type=int, default=1000)
+    payload.add_argument('--repeat', type=int, default=20)
+    payload.set_defaults(func=bench_payload)
+
+    writers = commands.add_parser('writers', help='concurrent submit throughput and lock errors per SQLite profile')
+    writers.add_argument('--writers', type=int, default=8)
+    writers.add_argument('--readers', type=int, default=4)
+    writers.add_argument('--submissions', type=int, default=200)
+    writers.add_argument('--questions', type=int, default=10)
+    writers.set_defaults(func=bench_writers)
+
+    ingest = commands.add_parser('ingest', help='end-of-exam submit burst, direct commits vs the ingest queue')
+    ingest.add_argument('--submissions', type=int, default=5000)
+    ingest.add_argument('--threads', type=int, default=16)
+    ingest.add_argument('--batch-size', type=int, default=500)
+    ingest.set_defaults(func=bench_ingest)
+
+    identity = commands.add_parser('identity', help='SQL queries and latency of authentication per request')
+    identity.add_argument('--requests', type=int, default=500)
+    identity.add_argument('--path', default='/api/student/stats')
+    identity.set_defaults(func=bench_identity)
+
+    args = parser.parse_args()
+    with app.app_context():
+        args.func(args)
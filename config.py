@@ -12,13 +12,64 @@ class Config(object):
     MAIL_MAX_EMAILS = None   # No limit
     MAIL_SUPPRESS_SEND = False
     MAIL_ASCII_ATTACHMENTS = False
+    MAIL_POOL_SIZE = 4       # Kept-alive SMTP connections per process
+    MAIL_KEEPALIVE = 60      # Seconds an idle connection is reused without a NOOP check
+    MAIL_BATCH_SIZE = 100    # Messages rendered and sent per connection in bulk campaigns
     CACHE_TYPE = "RedisCache"
     CACHE_DEFAULT_TIMEOUT = 300
+    CATALOG_CACHE_TIMEOUT = 6 * 60 * 60  # Catalog reads are invalidated through tags on every write
+    STUDENT_CACHE_TIMEOUT = 60 * 60      # Per-student pages, invalidated when the student submits
+    CACHE_STAMPEDE_PROTECTION = True     # Single-flight recomputation with early refresh
+    CACHE_STALE_GRACE = 300              # Seconds an expired entry may still be served while one worker refreshes it
+    CACHE_LOCK_TIMEOUT = 30              # Seconds a recomputation lock is held at most
+    CACHE_LOCK_WAIT = 5                  # Seconds a request waits for another worker's result when nothing is cached
+    CACHE_L1_SIZE = 1024                 # Entries in each process's in-memory cache in front of Redis (0 disables it)
+    CACHE_L1_TIMEOUT = 10                # Seconds an entry lives in the in-memory cache
+    CACHE_METRICS_FLUSH = 10             # Seconds between writes of cache hit/miss counters to Redis
+
+    # Response Compression
+    COMPRESS_MIN_SIZE = 1024       # Bytes below which responses are sent uncompressed
+    COMPRESS_LEVEL = 6             # gzip level for dynamic responses
+    COMPRESS_BROTLI_QUALITY = 5    # brotli quality for dynamic responses (needs brotli)
+
+    # SQLite Engine
+    SQLITE_PROFILE = 'concurrent'      # Pragma profile in application/sqlite_profile.py (default or concurrent)
+    SQLITE_PRAGMAS = {}                # Per-config overrides on top of the profile, e.g. {'busy_timeout': 10000}
+
+    # Read Replica (enabled by a 'replica' entry in SQLALCHEMY_BINDS)
+    REPLICA_READ_YOUR_WRITES = 120     # Seconds a user's reads stay on the primary after they write
+    REPLICA_MAX_LAG = None             # Seconds a streaming replica may lag, None for snapshots refreshed by beat
+
+    # Submission Ingest (needs Redis with appendonly persistence so acknowledged submissions survive a restart)
+    SUBMIT_INGEST = False              # Acknowledge graded submissions and write them in batches from a Redis queue
+    INGEST_BATCH_SIZE = 500            # Submissions inserted per transaction by the writer
+    INGEST_STATUS_TIMEOUT = 24 * 60 * 60  # Seconds a submission's status is kept in Redis
+    INGEST_WRITER_LOCK_TIMEOUT = 60    # Seconds the single-writer lock outlives a stalled writer
+
+    # Identity Cache
+    IDENTITY_CACHE = True              # Resolve the logged-in user and roles from Redis instead of two queries
+    IDENTITY_CACHE_TIMEOUT = 60        # Seconds a cached identity lives, bounds staleness if an invalidation is missed
+
+    # Attempt Sessions
+    ATTEMPT_GRACE_SECONDS = 30         # Seconds after the deadline a submit or autosave is still accepted
+    ATTEMPT_SESSION_RETENTION = 24 * 60 * 60  # Seconds an unswept session outlives its deadline in Redis
+
+    # Database Backups
+    BACKUP_DIR = 'backups'
+    BACKUP_COMPRESSION = 'gzip'    # gzip, zstd (needs zstandard) or none
+    BACKUP_RETENTION = 7           # Newest backups kept, older ones are deleted
+    BACKUP_PAGES_PER_STEP = 256    # Pages copied per backup step before releasing the lock
+
+    # Analytics Exports
+    EXPORT_FORMAT = 'csv'              # csv or jsonl, always gzip-compressed
+    EXPORT_PART_ROWS = 500000          # Rows per part file
+    EXPORT_PART_BYTES = 64 * 1024 * 1024  # Uncompressed bytes per part file
 
 
 class DevelopmentConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = 'sqlite:///quiz.db'
+    SQLALCHEMY_BINDS = {'replica': 'sqlite:///quiz_replica.db'}  # Snapshot refreshed with the backup API
     SECRET_KEY = "rishu"
     SECURITY_PASSWORD_SALT = "rishu"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
@@ -31,6 +82,10 @@ class DevelopmentConfig(Config):
     CACHE_REDIS_PORT = 6379
     CACHE_REDIS_DB = 3
 
+    # Redis Data Store (answer keys, leaderboards, attempt sessions)
+    REDIS_URL = "redis://localhost:6379/4"
+    ANSWER_KEY_TIMEOUT = 3600  # Seconds a compiled answer key lives in Redis
+
     # Email Configuration
     MAIL_SERVER = '0.0.0.0'  # MailHog server address
     MAIL_PORT = 1025         # MailHog SMTP port
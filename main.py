@@ -13,6 +13,12 @@ import uuid
 from datetime import datetime
 from celery import Celery, Task
 from application.instance import cache
+from application.migrations import run_migrations
+from application.responses import init_responses
+from application.sqlite_profile import apply_sqlite_profile
+from application.routing import init_routing
+from application.identity import init_identity
+import application.counters  # Registers the ORM hooks that maintain catalog counters
 
 
 
@@ -49,16 +55,21 @@ def create_app():
     
     # ------------ Extensions Initialization -----------
     db.init_app(app)
+    apply_sqlite_profile(app)
+    init_routing(app)
     api.init_app(app)
     cache.init_app(app)
+    init_responses(app)
     datastore = SQLAlchemyUserDatastore(db, User, Role)
     app.security = Security(app, datastore)
+    init_identity(app)
     
 
     
     with app.app_context():
         # ------------ Database Setup -----------
         db.create_all()
+        run_migrations()
         import application.views
         
         # ------------ Test User Creation -----------
@@ -0,0 +1,223 @@
+# ------------ Database Maintenance Commands -----------
+# Usage:
+#   python manage_db.py migrate            Apply pending schema migrations
+#   python manage_db.py check-plans        Verify hot queries use indexes (SQLite)
+#   python manage_db.py backfill-rollups   Rebuild daily report rollups from quiz_attempts
+#   python manage_db.py verify-backup FILE Restore a backup to a temp file and integrity-check it
+#   python manage_db.py backfill-answers   Populate attempt_answers from stored response sheets
+#   python manage_db.py check-queries      Fail when a catalog endpoint exceeds its SQL statement budget
+#   python manage_db.py recount            Repair the denormalized chapter/quiz/question counters
+#   python manage_db.py compress-static    Write .gz/.br copies of static assets for pre-compressed serving
+#   python manage_db.py sqlite-profile     Show the engine pragmas in effect and run PRAGMA optimize
+#   python manage_db.py refresh-replica    Copy the primary over the SQLite read replica snapshot
+#   python manage_db.py ingest-writer      Run the writer that stores queued quiz submissions in batches
+
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+from sqlalchemy import func, select
+from main import app
+from application.models import db, User, Subject, Chapter, Quiz, Question, QuizAttempt
+from application.migrations import run_migrations
+from application.rollups import rebuild_rollups
+from application.backups import refresh_replica, verify_backup
+from application.ingest import run_writer
+from application.item_analysis import backfill_attempt_answers
+from application.query_budget import QUERY_BUDGETS, count_queries
+from application.counters import recount_counters
+from application.responses import precompress_static
+from application.sqlite_profile import current_pragmas, optimize_database
+from application.instance import cache
+
+
+def migrate(args):
+    applied = run_migrations()
+    print(f"Applied migrations: {applied}" if applied else "Database schema is up to date")
+
+
+def backfill_rollups(args):
+    quiz_rows, subject_rows = rebuild_rollups()
+    print(f"Rebuilt {quiz_rows} quiz/day and {subject_rows} subject/day rollup rows")
+
+
+def backfill_answers(args):
+    attempts, rows = backfill_attempt_answers()
+    print(f"Backfilled {rows} answers from {attempts} attempts")
+
+
+def recount(args):
+    corrected = recount_counters()
+    print(f"Corrected {corrected} catalog counters" if corrected else "Catalog counters are correct")
+
+
+def compress_static(args):
+    written = precompress_static(app.static_folder)
+    print(f"Wrote {written} pre-compressed static files")
+
+
+def sqlite_profile(args):
+    print(f"Profile: {app.config.get('SQLITE_PROFILE', 'default')}")
+    for pragma, value in current_pragmas().items():
+        print(f"  {pragma:<14} {value}")
+    optimize_database()
+    print("PRAGMA optimize done")
+
+
+def refresh(args):
+    pages = refresh_replica(pages=app.config.get('BACKUP_PAGES_PER_STEP', 256))
+    print(f"Read replica refreshed ({pages} pages)")
+
+
+def ingest_writer(args):
+    print("Storing queued submissions, Ctrl+C to stop")
+    try:
+        run_writer()
+    except KeyboardInterrupt:
+        pass
+
+
+def verify(args):
+    backups_dir = os.path.join(os.getcwd(), app.config.get('BACKUP_DIR', 'backups'))
+    try:
+        result = verify_backup(backups_dir, os.path.basename(args.file))
+    except ValueError as e:
+        print(f"Cannot verify backup: {e}")
+        return 1
+    print(result)
+    return 0 if result['status'] == 'OK' else 1
+
+
+# ------------- Query Plan Check -------------
+def hot_queries():
+    """Representative statements for the endpoints and tasks that run most often"""
+    week_ago = datetime.now() - timedelta(days=7)
+    return [
+        ('get_student_stats: attempt count',
+         select(func.count(QuizAttempt.id)).where(QuizAttempt.user_id == 1)),
+        ('get_student_stats: recent attempts',
+         select(QuizAttempt.id).where(QuizAttempt.user_id == 1)
+         .order_by(QuizAttempt.date_created.desc()).limit(5)),
+        ('get_student_attempts',
+         select(QuizAttempt.id, Quiz.title)
+         .join(Quiz, QuizAttempt.quiz_id == Quiz.id)
+         .where(QuizAttempt.user_id == 1)
+         .order_by(QuizAttempt.date_created.desc())),
+        ('report_summary: time window',
+         select(func.count(QuizAttempt.id)).where(QuizAttempt.date_created >= week_ago)),
+        ('report_time_series',
+         select(func.avg(QuizAttempt.score))
+         .where(QuizAttempt.date_created >= week_ago)
+         .group_by(func.date(QuizAttempt.date_created))),
+        ('quiz attempts by quiz',
+         select(QuizAttempt.id).where(QuizAttempt.quiz_id == 1)
+         .order_by(QuizAttempt.date_created)),
+        ('send_daily_reminders',
+         select(User.email).join(QuizAttempt, QuizAttempt.user_id == User.id)
+         .where(QuizAttempt.date_created < week_ago)),
+        ('questions by quiz',
+         select(Question.id).where(Question.quiz_id == 1)),
+        ('quizzes by chapter',
+         select(Quiz.id).where(Quiz.chapter_id == 1)),
+        ('chapters by subject',
+         select(Chapter.id).where(Chapter.subject_id == 1)),
+    ]
+
+
+def full_scans(plan_rows, tables):
+    """Return plan lines that scan one of the given tables without an index"""
+    return [row for row in plan_rows
+            if row.startswith('SCAN ') and row.split()[1] in tables and 'INDEX' not in row]
+
+
+def check_plans(args):
+    if db.engine.dialect.name != 'sqlite':
+        print(f"Query plan check only supports SQLite (got {db.engine.dialect.name})")
+        return 0
+
+    watched = {'quiz_attempts', 'questions', 'quizzes', 'chapters'}
+    failures = 0
+    with db.engine.connect() as conn:
+        for name, statement in hot_queries():
+            compiled = statement.compile(dialect=db.engine.dialect)
+            params = tuple(compiled.params[key] for key in compiled.positiontup)
+            plan = [row[-1] for row in conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params)]
+            scans = full_scans(plan, watched)
+            status = 'FAIL' if scans else 'ok'
+            print(f"[{status:>4}] {name}")
+            for row in plan:
+                print(f"         {row}")
+            failures += bool(scans)
+
+    print(f"{failures} hot queries fall back to full table scans" if failures else "All hot queries use indexes")
+    return 1 if failures else 0
+
+
+# ------------- Query Budget Check -------------
+def _login(client, email, password):
+    with app.app_context():
+        response = client.post('/api/login', json={'email': email, 'password': password})
+    if response.status_code != 200:
+        raise SystemExit(f"Login failed for {email}: {response.get_json()}")
+    return client
+
+
+def check_queries(args):
+    # Responses must be rendered from the database, not served from the cache
+    cache.init_app(app, config={'CACHE_TYPE': 'NullCache'})
+    app.config['CACHE_L1_SIZE'] = 0
+    clients = {
+        'admin': _login(app.test_client(), args.admin_email, args.admin_password),
+        'stud': _login(app.test_client(), args.student_email, args.student_password),
+    }
+    ids = {
+        'subject_id': db.session.query(Chapter.subject_id).group_by(Chapter.subject_id)
+                        .order_by(func.count().desc()).limit(1).scalar(),
+        'chapter_id': db.session.query(Quiz.chapter_id).group_by(Quiz.chapter_id)
+                        .order_by(func.count().desc()).limit(1).scalar(),
+    }
+    db.session.remove()
+
+    failures = 0
+    for role, path, budget in QUERY_BUDGETS:
+        url = path.format(**ids)
+        # A fresh app context per request, so g and the session hold nothing from earlier requests
+        with count_queries() as statements, app.app_context():
+            response = clients[role].get(url)
+        over = response.status_code != 200 or len(statements) > budget
+        print(f"[{'FAIL' if over else 'ok':>4}] {url:<40} {len(statements):>3} queries (budget {budget}), HTTP {response.status_code}")
+        if over and args.verbose:
+            for statement in statements:
+                print(f"         {' '.join(statement.split())[:160]}")
+        failures += over
+
+    print(f"{failures} endpoints over their query budget" if failures else "All endpoints within their query budgets")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Quiz Master database maintenance')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('migrate', help='apply pending schema migrations').set_defaults(func=migrate)
+    commands.add_parser('check-plans', help='assert hot queries use indexes').set_defaults(func=check_plans)
+    commands.add_parser('backfill-rollups', help='rebuild daily report rollups').set_defaults(func=backfill_rollups)
+    commands.add_parser('backfill-answers', help='populate attempt_answers').set_defaults(func=backfill_answers)
+    commands.add_parser('recount', help='repair catalog counters').set_defaults(func=recount)
+    commands.add_parser('compress-static', help='pre-compress static assets').set_defaults(func=compress_static)
+    commands.add_parser('refresh-replica', help='refresh the SQLite read replica').set_defaults(func=refresh)
+    commands.add_parser('ingest-writer', help='store queued quiz submissions').set_defaults(func=ingest_writer)
+    commands.add_parser('sqlite-profile', help='show SQLite pragmas, run PRAGMA optimize').set_defaults(func=sqlite_profile)
+    queries_parser = commands.add_parser('check-queries', help='assert per-request SQL statement budgets')
+    queries_parser.add_argument('--admin-email', default='admin@example.com')
+    queries_parser.add_argument('--admin-password', default='admin123')
+    queries_parser.add_argument('--student-email', default='student@example.com')
+    queries_parser.add_argument('--student-password', default='student123')
+    queries_parser.add_argument('-v', '--verbose', action='store_true', help='print the statements of failing endpoints')
+    queries_parser.set_defaults(func=check_queries)
+    verify_parser = commands.add_parser('verify-backup', help='restore-verify a backup from the manifest')
+    verify_parser.add_argument('file')
+    verify_parser.set_defaults(func=verify)
+
+    args = parser.parse_args()
+    with app.app_context():
+        sys.exit(args.func(args) or 0)